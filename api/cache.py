@@ -0,0 +1,102 @@
+﻿import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from .utils import get_completion_state
+
+_sizes = {}
+
+class BoundedLocMemCache(LocMemCache):
+    """LocMemCache that also evicts least recently used entries above MAX_BYTES."""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 0))
+        self._sizes = _sizes.setdefault(name, {})
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _set(self, key, value, timeout=None):
+        if self._max_bytes and len(value) > self._max_bytes:
+            self._delete(key)
+            return
+        super()._set(key, value, timeout)
+        self._sizes[key] = len(value)
+        if self._max_bytes:
+            total = sum(self._sizes.values())
+            while total > self._max_bytes:
+                old_key, _ = self._cache.popitem()
+                self._expire_info.pop(old_key, None)
+                total -= self._sizes.pop(old_key, 0)
+
+    def _cull(self):
+        super()._cull()
+        for key in [key for key in self._sizes if key not in self._cache]:
+            del self._sizes[key]
+
+    def _delete(self, key):
+        self._sizes.pop(key, None)
+        return super()._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._sizes.clear()
+        super().clear()
+
+class PayloadCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    @property
+    def backend(self):
+        return caches[getattr(settings, 'PAYLOAD_CACHE_ALIAS', 'default')]
+
+    def make_key(self, kind, request, character, *parts):
+        state = get_completion_state(request)
+        return ':'.join([
+            kind,
+            str(request.user.pk),
+            f'v{character.version}',
+            state.user_today.isoformat(),
+            request.headers.get('X-Timezone', 'UTC'),
+            *[str(part) for part in parts],
+        ])
+
+    def get_or_build(self, kind, request, character, build, *parts):
+        key = self.make_key(kind, request, character, *parts)
+        data = self.backend.get(key)
+        if data is not None:
+            self._count('hits')
+            return data
+
+        self._count('misses')
+        data = build()
+        self.backend.set(key, data)
+        return data
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        backend = self.backend
+        if isinstance(backend, BoundedLocMemCache):
+            stats['entries'] = len(backend._cache)
+            stats['bytes'] = backend.total_bytes
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self._counters:
+                self._counters[name] = 0
+
+payload_cache = PayloadCache()
@@ -0,0 +1,118 @@
+﻿"""
+Per-request timing: SQL queries and their time (through a connection execute
+wrapper), view time and response rendering time. Reported as Server-Timing
+headers; requests over the configured budgets are logged as one JSON line.
+"""
+import json
+import logging
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('api.timing')
+
+_jsonl_paths = {}
+_jsonl_lock = threading.Lock()
+
+def get_jsonl_logger(name, path, max_bytes, backups):
+    """
+    Logger that writes bare lines to a rotating file, for JSONL output. The
+    handler is replaced when the configured path changes.
+    """
+    jsonl_logger = logging.getLogger(name)
+    path = Path(path)
+    with _jsonl_lock:
+        if _jsonl_paths.get(name) != path:
+            close_jsonl_logger(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            jsonl_logger.handlers = [handler]
+            jsonl_logger.setLevel(logging.INFO)
+            jsonl_logger.propagate = False
+            _jsonl_paths[name] = path
+    return jsonl_logger
+
+def close_jsonl_logger(name):
+    jsonl_logger = logging.getLogger(name)
+    for handler in jsonl_logger.handlers:
+        handler.close()
+    jsonl_logger.handlers = []
+    _jsonl_paths.pop(name, None)
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return request.path
+    return match.view_name or match.route
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.query_budget = settings.REQUEST_TIMING_QUERY_BUDGET
+        self.latency_budget_ms = settings.REQUEST_TIMING_LATENCY_BUDGET_MS
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        request._timing = {'view_started': None, 'view_finished': None}
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        total_ms = (finished - started) * 1000
+        view_started = request._timing['view_started']
+        view_finished = request._timing['view_finished'] or finished
+        metrics = [
+            ('total', total_ms, None),
+            ('db', timer.duration * 1000, f'{timer.count} queries'),
+        ]
+        if view_started is not None:
+            metrics.append(('view', (view_finished - view_started) * 1000, None))
+            metrics.append(('render', (finished - view_finished) * 1000, None))
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.1f}' + (f';desc="{description}"' if description else '')
+            for name, duration, description in metrics
+        )
+
+        over_queries = timer.count > self.query_budget
+        over_latency = total_ms > self.latency_budget_ms
+        if over_queries or over_latency:
+            record = {
+                'route': get_route(request),
+                'method': request.method,
+                'status': response.status_code,
+                'user_id': getattr(getattr(request, 'user', None), 'pk', None),
+                'over_budget': [name for name, over in (('queries', over_queries), ('latency', over_latency)) if over],
+            }
+            record.update({f'{name}_ms': round(duration, 1) for name, duration, _ in metrics})
+            record['queries'] = timer.count
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Called between the view returning and the DRF response being rendered.
+        request._timing['view_finished'] = time.perf_counter()
+        return response
@@ -1,106 +1,154 @@
-﻿import random
-from decimal import Decimal, ROUND_HALF_UP
-from .models import LootItem, LootRarity
-
+﻿import bisect
+import functools
+import heapq
+import random
+from decimal import Decimal
+from django.db import transaction
+from .models import LootItem, LootRarity, LOOT_WEIGHT_TOTAL, chance_to_bp
+from .tracing import traced
+from .versioning import mark_changed
+
+XP_FIELDS = ('level', 'current_xp', 'xp_to_next_level')
+MAX_XP_ATTEMPTS = 20
+
+class XPConflictError(Exception):
+    pass
+
+def update_xp_row(instance, amount):
+    """
+    Compare-and-swap of the XP fields: the UPDATE only matches if the row still
+    holds the values the change was computed from, otherwise the row is re-read
+    and the change is recomputed. Returns (leveled_up, attempts).
+    """
+    leveled_up, _, attempt = update_xp_row_steps(instance, [amount])
+    return leveled_up, attempt
+
+def update_xp_row_steps(instance, amounts):
+    """
+    Same as update_xp_row for several changes applied in order with one UPDATE
+    (bulk endpoints). Returns (leveled_up, highest_level, attempts), where
+    highest_level is the top level reached along the way.
+    """
+    model = type(instance)
+    for attempt in range(1, MAX_XP_ATTEMPTS + 1):
+        expected = {field: getattr(instance, field) for field in XP_FIELDS}
+        leveled_up = False
+        highest_level = instance.level
+        for amount in amounts:
+            if instance.add_xp(amount):
+                leveled_up = True
+            highest_level = max(highest_level, instance.level)
+        changed = {field: getattr(instance, field) for field in XP_FIELDS}
+        if model.objects.filter(pk=instance.pk, **expected).update(**changed):
+            return leveled_up, highest_level, attempt
+        instance.refresh_from_db(fields=XP_FIELDS)
+    raise XPConflictError(f'{model.__name__} {instance.pk}: XP was not applied after {MAX_XP_ATTEMPTS} attempts')
+
+@traced('apply_xp')
+def apply_xp(skill, character, amount):
+    """
+    Adds XP to a skill and a character without losing concurrent updates.
+    Returns (skill_leveled_up, character_leveled_up).
+    """
+    # No savepoint inside a caller's transaction: an XPConflictError rolls back the whole of it.
+    with transaction.atomic(savepoint=False):
+        skill_leveled_up, _ = update_xp_row(skill, amount)
+        character_leveled_up, _ = update_xp_row(character, amount)
+    # update() bypasses post_save, so the payload versions are bumped here.
+    mark_changed(characters=[character.pk, skill.character_id], groups=[skill.group_id])
+    return skill_leveled_up, character_leveled_up
+
+def split_by_largest_remainder(weights, total):
+    weight_sum = sum(weights)
+    shares = []
+    remainders = []
+    for index, weight in enumerate(weights):
+        share, remainder = divmod(weight * total, weight_sum)
+        shares.append(share)
+        remainders.append((remainder, -index))
+
+    # Недостающие после округления вниз пункты получают предметы с наибольшим остатком.
+    for _, negative_index in heapq.nlargest(total - sum(shares), remainders):
+        shares[-negative_index] += 1
+    return shares
+
+@traced('recalculate_loot_chances')
 def recalculate_loot_chances(user, fixed_item=None, new_chance_for_fixed=Decimal('0.0')):
     available_items = list(LootItem.objects.filter(owner=user, received_date__isnull=True))
 
     if not available_items:
         return
 
-    if len(available_items) == 1:
-        available_items[0].base_chance = Decimal('100.0')
-        available_items[0].save()
-        return
-
-    if new_chance_for_fixed:
-        new_chance_for_fixed = new_chance_for_fixed.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        if fixed_item:
-            fixed_item.base_chance = new_chance_for_fixed
-
-    remaining_chance = Decimal('100.0') - new_chance_for_fixed
-    if remaining_chance < 0:
-        remaining_chance = Decimal('0.0')
+    if fixed_item in available_items:
+        available_items[available_items.index(fixed_item)] = fixed_item
+    else:
+        fixed_item = None
 
     other_items = [item for item in available_items if item != fixed_item]
-    
-    if not other_items:
-        if fixed_item:
-            fixed_item.base_chance = Decimal('100.0')
-            fixed_item.save()
-        return
-
-    total_chance_of_others = sum(item.base_chance for item in other_items)
 
-    if total_chance_of_others > Decimal('0.001'):
-        coef = remaining_chance / total_chance_of_others
-        for item in other_items:
-            item.base_chance *= coef
+    if not other_items or len(available_items) == 1:
+        available_items[0].set_weight(LOOT_WEIGHT_TOTAL)
     else:
-        equal_chance = remaining_chance / len(other_items)
-        for item in other_items:
-            item.base_chance = equal_chance
-
-    current_sum = Decimal('0.0')
-    items_to_save = other_items + ([fixed_item] if fixed_item else [])
-    
-    for i, item in enumerate(items_to_save):
-        item.base_chance = item.base_chance.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        if item.base_chance < 0:
-            item.base_chance = Decimal('0.0')
-        
-        if i == len(items_to_save) - 1:
-            diff = Decimal('100.0') - sum(it.base_chance for it in items_to_save if it != item)
-            item.base_chance = diff
-        
-    for item in items_to_save:
-        item.save()
-
-
-def get_weighted_random_award(available_items, pity_counter):
+        fixed_bp = chance_to_bp(new_chance_for_fixed) if fixed_item else 0
+        weights = [item.weight_bp for item in other_items]
+        if not any(weights):
+            weights = [1] * len(other_items)
+
+        for item, weight_bp in zip(other_items, split_by_largest_remainder(weights, LOOT_WEIGHT_TOTAL - fixed_bp)):
+            item.set_weight(weight_bp)
+        if fixed_item:
+            fixed_item.set_weight(fixed_bp)
+
+    LootItem.objects.bulk_update(available_items, ['weight_bp', 'base_chance'])
+    mark_changed(users=[user.pk])
+
+
+PITY_RESET_RARITIES = (LootRarity.RARE, LootRarity.UNIQUE, LootRarity.LEGENDARY)
+
+# Бонус жалости: 0.005 (0.5%) за каждое открытие без редкого предмета,
+# делится поровну между всеми не-обычными предметами. В б.п. это 50 за открытие.
+PITY_BONUS_BP = 50
+
+@functools.lru_cache(maxsize=1024)
+def _cumulative_weights(pool, pity_counter):
+    non_common_count = sum(1 for is_common, _ in pool if not is_common)
+    # Веса умножены на число не-обычных предметов, чтобы доля бонуса оставалась целой.
+    scale = non_common_count or 1
+    cumulative = []
+    total = 0
+    for is_common, weight_bp in pool:
+        weight = weight_bp * scale
+        if not is_common:
+            weight += pity_counter * PITY_BONUS_BP
+        total += weight
+        cumulative.append(total)
+    return tuple(cumulative), scale
+
+class LootSampler:
+    def __init__(self, items, pity_counter):
+        self.items = list(items)
+        pool = tuple((item.rarity == LootRarity.COMMON, item.weight_bp) for item in self.items)
+        self.cumulative, scale = _cumulative_weights(pool, pity_counter)
+        self.units_per_percent = LOOT_WEIGHT_TOTAL // 100 * scale
+
+    @property
+    def total(self):
+        return self.cumulative[-1] if self.cumulative else 0
+
+    def draw(self, rng=random):
+        # Бросок делается в процентах, как раньше, и переводится в целые единицы таблицы.
+        roll = rng.uniform(0, self.total / self.units_per_percent) * self.units_per_percent
+        return self.items[min(bisect.bisect_right(self.cumulative, roll), len(self.items) - 1)]
+
+@traced('get_weighted_random_award')
+def get_weighted_random_award(available_items, pity_counter, rng=random):
     if not available_items:
         return None, 0
 
-    pity_bonus = pity_counter * Decimal('0.005') 
-    
-    non_common_items = [item for item in available_items if item.rarity != LootRarity.COMMON]
-    distributable_bonus = Decimal('0.0')
-    if non_common_items:
-        distributable_bonus = pity_bonus / len(non_common_items)
-
-    adjusted_chances = []
-    total_adjusted_chance = Decimal('0.0')
-    
-    for item in available_items:
-        chance = item.base_chance
-        if item.rarity != LootRarity.COMMON:
-            chance += distributable_bonus * 100
-        
-        if chance < 0: chance = Decimal('0.01')
-        
-        adjusted_chances.append({'item': item, 'chance': chance})
-        total_adjusted_chance += chance
-
-    if total_adjusted_chance <= 0:
-        return random.choice(available_items), pity_counter + 1
-
-    roll = Decimal(random.uniform(0, float(total_adjusted_chance)))
-    current_sum = Decimal('0.0')
-    
-    for entry in adjusted_chances:
-        current_sum += entry['chance']
-        if roll < current_sum:
-            won_item = entry['item']
-            if won_item.rarity in [LootRarity.RARE, LootRarity.UNIQUE, LootRarity.LEGENDARY]:
-                new_pity_counter = 0
-            else:
-                new_pity_counter = pity_counter + 1
-            
-            return won_item, new_pity_counter
-
-    won_item = adjusted_chances[-1]['item']
-    if won_item.rarity in [LootRarity.RARE, LootRarity.UNIQUE, LootRarity.LEGENDARY]:
-        new_pity_counter = 0
-    else:
-        new_pity_counter = pity_counter + 1
+    sampler = LootSampler(available_items, pity_counter)
+    if not sampler.total:
+        return rng.choice(sampler.items), pity_counter + 1
+
+    won_item = sampler.draw(rng)
+    new_pity_counter = 0 if won_item.rarity in PITY_RESET_RARITIES else pity_counter + 1
     return won_item, new_pity_counter
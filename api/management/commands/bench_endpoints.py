@@ -0,0 +1,195 @@
+﻿import json
+import math
+import statistics
+import time
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import Goal, GoalType, Skill
+
+class Rollback(Exception):
+    pass
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks every API route with the test client against a seeded dataset inside a rolled-back '
+        'transaction: p50/p95/p99 latency, SQL query count and time, response size. '
+        'Usage: manage.py bench_endpoints [--output run.json] [--compare baseline.json --threshold 20]'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per route')
+        parser.add_argument('--users', type=int, default=5, help='Users to seed (see seed_load_data)')
+        parser.add_argument('--history-days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--username', type=str, default=None, help='Benchmark an existing user instead of seeding')
+        parser.add_argument('--routes', type=str, default=None, help='Only routes whose name contains this text')
+        parser.add_argument('--output', type=str, default=None, help='Write results as JSON')
+        parser.add_argument('--compare', type=str, default=None, help='Baseline JSON from an earlier run')
+        parser.add_argument('--threshold', type=float, default=20.0, help='Allowed p95 latency regression, percent')
+        parser.add_argument('--query-threshold', type=int, default=0, help='Allowed extra SQL queries per request')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                results = self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'iterations': options['iterations'],
+                'users': options['users'],
+                'history_days': options['history_days'],
+                'seed': options['seed'],
+            },
+            'routes': results,
+        }
+        self.print_results(results)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline:
+                regressions = self.compare(json.load(baseline)['routes'], results, options['threshold'], options['query_threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(f'  {regression}'))
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}.'))
+
+    def run(self, options):
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["username"]}" does not exist.')
+        else:
+            self.stdout.write(f'Seeding {options["users"]} users with {options["history_days"]} days of history...')
+            call_command(
+                'seed_load_data', '--users', str(options['users']), '--prefix', 'bench_ep', '--replace',
+                '--history-days', str(options['history_days']), '--seed', str(options['seed']), stdout=StringIO()
+            )
+            user = User.objects.filter(username__startswith='bench_ep_').order_by('id').first()
+
+        # Staff rights let the admin-only routes be measured too; rolled back with everything else.
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        routes = self.get_routes(User.objects.get(pk=user.pk))
+        if options['routes']:
+            routes = [route for route in routes if options['routes'] in route[0]]
+
+        results = {}
+        for name, method, path, data in routes:
+            results[name] = self.measure(user, method, path, data, options['warmup'], options['iterations'])
+        return results
+
+    def get_routes(self, user):
+        skill = Skill.objects.filter(character__user=user).order_by('id').first()
+        goal = Goal.objects.filter(skill__character__user=user).order_by('id').first()
+        daily_goals = list(Goal.objects.filter(skill__character__user=user, goal_type=GoalType.DAILY).order_by('id').values_list('id', flat=True)[:10])
+        skill_ids = list(Skill.objects.filter(character__user=user).order_by('id').values_list('id', flat=True)[:10])
+
+        routes = [
+            ('character', 'get', reverse('character-detail'), None),
+            ('character.update', 'patch', reverse('character-detail'), {'name': user.character.name}),
+            ('skills.list', 'get', reverse('skill-list'), None),
+            ('goals.list', 'get', reverse('goal-list'), None),
+            ('goals-history.list', 'get', reverse('goalhistory-list'), None),
+            ('goals-history.page', 'get', reverse('goalhistory-list') + '?limit=50', None),
+            ('rewards-history.list', 'get', reverse('rewardhistory-list'), None),
+            ('loot-items.list', 'get', reverse('lootitem-list'), None),
+            ('notes.list', 'get', reverse('note-list'), None),
+            ('achievements.list', 'get', reverse('achievement-list'), None),
+            ('lootbox.status', 'get', reverse('lootbox-api'), None),
+            ('lootbox.open', 'post', reverse('lootbox-api'), None),
+            ('groups.list', 'get', reverse('group-list'), None),
+            ('users.list', 'get', reverse('user-list'), None),
+            ('users.search', 'get', reverse('user-search') + '?search=bench', None),
+            ('cache-stats', 'get', reverse('cache-stats'), None),
+            ('lootbox.simulate', 'get', reverse('lootbox-simulate') + '?sessions=1000&opens=10', None),
+        ]
+        if skill:
+            routes += [
+                ('skills.detail', 'get', reverse('skill-detail', kwargs={'pk': skill.pk}), None),
+                ('skills.add-progress', 'post', reverse('skill-add-progress', kwargs={'pk': skill.pk}), {'units': 1}),
+                ('skills.bulk-progress', 'post', reverse('skill-bulk-progress'), {'entries': [{'skill': pk, 'units': 1} for pk in skill_ids]}),
+            ]
+        if goal:
+            routes += [
+                ('goals.detail', 'get', reverse('goal-detail', kwargs={'pk': goal.pk}), None),
+                ('goals.toggle-complete', 'post', reverse('goal-toggle-complete', kwargs={'pk': goal.pk}), None),
+            ]
+        if daily_goals:
+            routes.append(('goals.bulk-toggle', 'post', reverse('goal-bulk-toggle'), {'goal_ids': daily_goals}))
+        return routes
+
+    def measure(self, user, method, path, data, warmup, iterations):
+        latencies, query_counts, sql_times, sizes, statuses = [], [], [], [], set()
+        for iteration in range(warmup + iterations):
+            # A fresh client and user per request, like a real authenticated request.
+            client = APIClient()
+            client.force_authenticate(user=User.objects.get(pk=user.pk))
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data, format='json', HTTP_X_TIMEZONE='UTC')
+                elapsed = time.perf_counter() - started
+            if iteration < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            query_counts.append(len(queries.captured_queries))
+            sql_times.append(sum(float(query['time']) for query in queries.captured_queries) * 1000)
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+
+        return {
+            'method': method.upper(),
+            'path': path,
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries': max(query_counts),
+            'sql_ms': round(statistics.fmean(sql_times), 3),
+            'bytes': max(sizes),
+        }
+
+    def print_results(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{"route":<24} {"status":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"sql ms":>8} {"bytes":>9}'
+        ))
+        for name, result in results.items():
+            status = ','.join(str(code) for code in result['status'])
+            self.stdout.write(
+                f'{name:<24} {status:>9} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+                f'{result["queries"]:>8} {result["sql_ms"]:>8.2f} {result["bytes"]:>9}'
+            )
+
+    def compare(self, baseline, results, threshold, query_threshold):
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            if before['p95_ms'] and (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 > threshold:
+                regressions.append(f'{name}: p95 {before["p95_ms"]:.2f} -> {result["p95_ms"]:.2f} ms (> {threshold:g}%)')
+            if result['queries'] - before['queries'] > query_threshold:
+                regressions.append(f'{name}: queries {before["queries"]} -> {result["queries"]}')
+        return regressions
@@ -0,0 +1,162 @@
+﻿import random
+import statistics
+import time
+from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from api.models import (
+    Character, Skill, Goal, GoalType, GoalCompletion, GoalHistory, GoalHistoryAction,
+    ReceivedReward, LootItem, LootRarity
+)
+
+BENCH_INDEXES = [
+    (GoalCompletion, 'api_goalcomp_owner_date_idx'),
+    (GoalHistory, 'api_goalhist_owner_ts_idx'),
+    (GoalHistory, 'api_goalhist_owner_skill_idx'),
+    (ReceivedReward, 'api_reward_owner_date_idx'),
+    (LootItem, 'api_loot_owner_avail_idx'),
+]
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a large throwaway dataset and compares query plans and timings of the hot filters '
+        'with and without the composite/partial indexes. Everything is rolled back at the end. '
+        'Usage: manage.py bench_indexes [--users N] [--days N]'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of seeded users')
+        parser.add_argument('--days', type=int, default=365, help='Days of completion history per user')
+        parser.add_argument('--goals', type=int, default=8, help='Goals per user (half of them daily)')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user, skill_id, today = self.seed(options)
+                queries = self.get_queries(user, skill_id, today)
+
+                self.drop_indexes()
+                before = self.measure(queries, options['repeat'])
+                self.create_indexes()
+                after = self.measure(queries, options['repeat'])
+
+                self.report(queries, before, after)
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Benchmark data rolled back.'))
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        today = now.date()
+        self.stdout.write(f'Seeding {options["users"]} users with {options["days"]} days of history...')
+
+        users = User.objects.bulk_create([
+            User(username=f'bench_idx_{i}', password='!') for i in range(options['users'])
+        ])
+        characters = Character.objects.bulk_create([Character(user=user, name=user.username) for user in users])
+        skills = Skill.objects.bulk_create([
+            Skill(character=character, name=f'Навык {j}') for character in characters for j in range(2)
+        ])
+
+        goals = []
+        for character, user in zip(characters, users):
+            user_skills = [skill for skill in skills if skill.character_id == character.id]
+            for j in range(options['goals']):
+                goal_type = GoalType.DAILY if j % 2 == 0 else rng.choice([GoalType.BLUE, GoalType.YELLOW, GoalType.RED])
+                goals.append(Goal(skill=user_skills[j % 2], owner=user, description=f'Цель {j}', goal_type=goal_type))
+        goals = Goal.objects.bulk_create(goals)
+
+        completions, history, rewards, loot = [], [], [], []
+        for user in users:
+            user_goals = [goal for goal in goals if goal.owner_id == user.id]
+            for day in range(options['days']):
+                completion_date = today - timedelta(days=day)
+                timestamp = now - timedelta(days=day)
+                for goal in user_goals:
+                    if goal.goal_type == GoalType.DAILY and rng.random() < 0.7:
+                        completions.append(GoalCompletion(goal=goal, owner=user, completion_date=completion_date))
+                        history.append(GoalHistory(
+                            owner=user, goal_description=goal.description, skill_name='Навык', skill_id=goal.skill_id,
+                            xp_amount=goal.xp_reward, action=GoalHistoryAction.COMPLETED, goal_type=goal.goal_type,
+                            timestamp=timestamp
+                        ))
+                if rng.random() < 0.3:
+                    rewards.append(ReceivedReward(owner=user, description='Награда', source_name='Лутбокс', received_date=timestamp))
+                    loot.append(LootItem(owner=user, name='Полученная', rarity=LootRarity.COMMON, base_chance=0, received_date=timestamp))
+            loot.extend(
+                LootItem(owner=user, name=f'Доступная {k}', rarity=LootRarity.COMMON, base_chance=20, weight_bp=2000) for k in range(5)
+            )
+
+        GoalCompletion.objects.bulk_create(completions, batch_size=2000)
+        GoalHistory.objects.bulk_create(history, batch_size=2000)
+        ReceivedReward.objects.bulk_create(rewards, batch_size=2000)
+        LootItem.objects.bulk_create(loot, batch_size=2000)
+        self.stdout.write(
+            f'Seeded {len(completions)} completions, {len(history)} history rows, '
+            f'{len(rewards)} rewards, {len(loot)} loot items.'
+        )
+
+        user = users[len(users) // 2]
+        skill_id = next(skill.id for skill in skills if skill.character_id == characters[len(users) // 2].id)
+        return user, skill_id, today
+
+    def get_queries(self, user, skill_id, today):
+        return [
+            ('lootbox: completed dailies', GoalCompletion.objects.filter(
+                owner=user, completion_date=today, goal__goal_type=GoalType.DAILY
+            )),
+            ('completion state', GoalCompletion.objects.filter(owner=user).filter(
+                Q(goal__goal_type=GoalType.DAILY, completion_date=today) | ~Q(goal__goal_type=GoalType.DAILY)
+            ).values_list('goal_id', flat=True)),
+            ('goal history page', GoalHistory.objects.filter(owner=user).order_by('-timestamp', '-id')[:100]),
+            ('goal history by skill', GoalHistory.objects.filter(owner=user, skill_id=skill_id).order_by('-timestamp', '-id')[:100]),
+            ('rewards history page', ReceivedReward.objects.filter(owner=user).order_by('-received_date', '-id')[:100]),
+            ('available loot items', LootItem.objects.filter(owner=user, received_date__isnull=True)),
+        ]
+
+    # The schema editor can't be entered inside an atomic block on SQLite,
+    # so the statements are built and executed directly.
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for _, name in BENCH_INDEXES:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+
+    def create_indexes(self):
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model, name in BENCH_INDEXES:
+                index = next(index for index in model._meta.indexes if index.name == name)
+                cursor.execute(str(index.create_sql(model, editor)))
+
+    def measure(self, queries, repeat):
+        results = []
+        for name, queryset in queries:
+            plan = queryset.explain()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results.append({'plan': plan, 'median_ms': statistics.median(timings)})
+        return results
+
+    def report(self, queries, before, after):
+        for (name, _), old, new in zip(queries, before, after):
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            self.stdout.write('  before:')
+            for line in old['plan'].splitlines():
+                self.stdout.write(f'    {line}')
+            self.stdout.write('  after:')
+            for line in new['plan'].splitlines():
+                self.stdout.write(f'    {line}')
+            speedup = old['median_ms'] / new['median_ms'] if new['median_ms'] else float('inf')
+            self.stdout.write(f'  median: {old["median_ms"]:.3f} ms -> {new["median_ms"]:.3f} ms (x{speedup:.1f})')
@@ -0,0 +1,33 @@
+﻿import timeit
+from django.core.management.base import BaseCommand
+from api.models import CHARACTER_XP_CURVE, SKILL_XP_CURVE
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of XP level resolution: table + bisect vs. the stepwise loop. Usage: manage.py bench_xp'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help='Calls per measurement')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        cases = [
+            ('small gain', 1, 0, 100, 50),
+            ('+10 000 XP', 1, 0, 100, 10_000),
+            ('+1 000 000 XP', 1, 0, 100, 1_000_000),
+            ('-1 000 000 XP', None, None, None, -1_000_000),
+        ]
+
+        for curve_name, curve in (('character', CHARACTER_XP_CURVE), ('skill', SKILL_XP_CURVE)):
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{curve_name} curve'))
+            for label, level, current_xp, xp_to_next_level, amount in cases:
+                if level is None:
+                    level, current_xp, xp_to_next_level, _ = curve.apply(1, 0, 100, -amount)
+                state = (level, current_xp, xp_to_next_level, amount)
+                # Warm the cumulative table so only lookups are measured.
+                curve.apply(*state)
+
+                table = timeit.timeit(lambda: curve.apply(*state), number=number) / number * 1e6
+                stepwise = timeit.timeit(lambda: curve.apply_stepwise(*state), number=number) / number * 1e6
+                self.stdout.write(
+                    f'  {label:>15}: bisect {table:8.2f} us, stepwise {stepwise:10.2f} us (x{stepwise / table:.1f})'
+                )
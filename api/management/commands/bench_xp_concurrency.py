@@ -0,0 +1,82 @@
+﻿import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, connections, DatabaseError
+from api.logic import apply_xp, XPConflictError
+from api.models import Character, Skill, CHARACTER_XP_CURVE, SKILL_XP_CURVE
+
+class Command(BaseCommand):
+    help = 'Multi-threaded stress test of XP application: counts lost updates for the CAS service and the naive read-modify-save path. Usage: manage.py bench_xp_concurrency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writers')
+        parser.add_argument('--requests', type=int, default=200, help='XP grants per thread')
+        parser.add_argument('--amount', type=int, default=37, help='XP per grant')
+        parser.add_argument('--mode', choices=['cas', 'naive', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{connection.vendor}: {options["threads"]} threads x {options["requests"]} grants of {options["amount"]} XP'
+        ))
+        modes = ['naive', 'cas'] if options['mode'] == 'both' else [options['mode']]
+        for mode in modes:
+            self.run_mode(mode, options['threads'], options['requests'], options['amount'])
+
+    def run_mode(self, mode, thread_count, requests, amount):
+        user = User.objects.create_user(username=f'bench_xp_{uuid.uuid4().hex[:12]}')
+        try:
+            character = Character.objects.create(user=user, name='Bench')
+            skill = Skill.objects.create(character=character, name='Bench')
+            barrier = threading.Barrier(thread_count)
+            succeeded = []
+            failed = []
+
+            def writer():
+                ok = errors = 0
+                try:
+                    barrier.wait()
+                    for _ in range(requests):
+                        # Fresh copies per grant, as every HTTP request loads its own rows.
+                        request_skill = Skill.objects.get(pk=skill.pk)
+                        request_character = Character.objects.get(pk=character.pk)
+                        try:
+                            if mode == 'cas':
+                                apply_xp(request_skill, request_character, amount)
+                            else:
+                                request_skill.add_xp(amount)
+                                request_character.add_xp(amount)
+                                request_skill.save()
+                                request_character.save()
+                            ok += 1
+                        except (DatabaseError, XPConflictError):
+                            errors += 1
+                finally:
+                    succeeded.append(ok)
+                    failed.append(errors)
+                    connections.close_all()
+
+            threads = [threading.Thread(target=writer) for _ in range(thread_count)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            skill.refresh_from_db()
+            character.refresh_from_db()
+            expected = sum(succeeded) * amount
+            skill_total = SKILL_XP_CURVE.cumulative(skill.level) + skill.current_xp
+            character_total = CHARACTER_XP_CURVE.cumulative(character.level) + character.current_xp
+            lost = (expected - skill_total) + (expected - character_total)
+
+            style = self.style.SUCCESS if lost == 0 else self.style.ERROR
+            self.stdout.write(style(
+                f'  {mode:>5}: {sum(succeeded)} grants in {elapsed:.2f} s ({sum(succeeded) / elapsed:.0f}/s), '
+                f'{sum(failed)} failed, skill XP {skill_total}/{expected}, character XP {character_total}/{expected}, '
+                f'lost {lost} XP'
+            ))
+        finally:
+            user.delete()
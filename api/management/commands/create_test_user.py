@@ -1,8 +1,6 @@
 ﻿from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from api.models import Character, Skill, Goal, LootItem, LootRarity
-from api.logic import recalculate_loot_chances
-from decimal import Decimal
+from api.onboarding import onboard_users
 
 class Command(BaseCommand):
     help = 'Creates a clean test user for E2E testing. Usage: manage.py create_test_user <username>'
@@ -26,14 +24,7 @@ class Command(BaseCommand):
         
         user = User.objects.create_user(username=username, password=password)
         
-        character = Character.objects.create(user=user, name=character_name)
-
-        Skill.objects.create(character=character, name='Тестирование E2E', unit_description='тест', xp_per_unit=15)
-        
-        LootItem.objects.create(owner=user, name='Тестовый Common', rarity=LootRarity.COMMON, base_chance=Decimal('70.00'))
-        LootItem.objects.create(owner=user, name='Тестовый Rare', rarity=LootRarity.RARE, base_chance=Decimal('20.00'))
-        LootItem.objects.create(owner=user, name='Тестовый Legendary', rarity=LootRarity.LEGENDARY, base_chance=Decimal('10.00'))
-        recalculate_loot_chances(user)
+        onboard_users([(user, character_name)], kit_name='e2e')
 
         self.stdout.write(self.style.SUCCESS(
             f'Successfully created test user.\nUsername: {username}\nPassword: {password}'
@@ -0,0 +1,189 @@
+﻿import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from api.models import Character
+from api.onboarding import DEFAULT_STARTER_KIT, available_starter_kits, onboard_users
+
+def _init_worker():
+    import django
+    django.setup()
+
+def _hash_password(password):
+    return make_password(password)
+
+class Command(BaseCommand):
+    help = (
+        'Imports users from a CSV or JSONL file (username, password, character_name[, email]) in chunks, '
+        'creating characters and starter content. Resumable. Usage: manage.py import_users <path>'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='CSV (with a header row) or JSONL file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='Input format (default: by file extension)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes for password hashing')
+        parser.add_argument('--kit', choices=available_starter_kits(), default=DEFAULT_STARTER_KIT, help='Starter kit for the new accounts')
+        parser.add_argument('--state', type=str, default=None, help='Progress file for resuming (default: <path>.import-state.json)')
+        parser.add_argument('--errors', type=str, default=None, help='CSV report of rejected rows (default: <path>.import-errors.csv)')
+        parser.add_argument('--restart', action='store_true', help='Ignore saved progress and start from the first row')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'File "{path}" does not exist.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        state_path = options['state'] or f'{path}.import-state.json'
+        errors_path = options['errors'] or f'{path}.import-errors.csv'
+
+        state = {'rows_done': 0, 'created': 0, 'errors': 0}
+        if not options['restart'] and os.path.isfile(state_path):
+            with open(state_path, encoding='utf-8') as state_file:
+                state.update(json.load(state_file))
+            self.stdout.write(f'Resuming after row {state["rows_done"]} ({state["created"]} users already created).')
+
+        executor = None
+        if options['workers'] > 1:
+            executor = ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker)
+
+        started = time.perf_counter()
+        created_now = rows_now = 0
+        errors_mode = 'a' if state['rows_done'] else 'w'
+        try:
+            with open(errors_path, errors_mode, newline='', encoding='utf-8') as errors_file:
+                errors_writer = csv.writer(errors_file)
+                if errors_mode == 'w':
+                    errors_writer.writerow(['row', 'username', 'error'])
+
+                rows = islice(self.read_rows(path, file_format), state['rows_done'], None)
+                row_number = state['rows_done']
+                while True:
+                    chunk = []
+                    for row in islice(rows, options['chunk_size']):
+                        row_number += 1
+                        chunk.append((row_number, row))
+                    if not chunk:
+                        break
+
+                    created, errors = self.import_chunk(chunk, options['kit'], executor)
+                    for error in errors:
+                        errors_writer.writerow(error)
+                    errors_file.flush()
+
+                    state['rows_done'] = row_number
+                    state['created'] += created
+                    state['errors'] += len(errors)
+                    self.save_state(state_path, state)
+
+                    created_now += created
+                    rows_now += len(chunk)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'  rows {row_number}: +{created} users, {len(errors)} errors ({rows_now / elapsed:.0f} rows/s)'
+                    )
+        finally:
+            if executor:
+                executor.shutdown()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Done in {elapsed:.1f} s: {created_now} users created in this run ({created_now / elapsed if elapsed else 0:.0f}/s), '
+            f'{state["created"]} in total, {state["errors"]} rejected rows (see {errors_path}).'
+        ))
+
+    def read_rows(self, path, file_format):
+        with open(path, newline='', encoding='utf-8-sig') as source:
+            if file_format == 'csv':
+                yield from csv.DictReader(source)
+                return
+            for line in source:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield {'_error': f'invalid JSON: {exc.msg}'}
+
+    def validate_row(self, row):
+        if '_error' in row:
+            raise ValidationError(row['_error'])
+
+        username = (row.get('username') or '').strip()
+        password = row.get('password') or ''
+        character_name = (row.get('character_name') or '').strip()
+        email = (row.get('email') or '').strip()
+        if not username or not password or not character_name:
+            raise ValidationError('username, password and character_name are required')
+
+        user = User(username=username, email=email)
+        user.full_clean(exclude=['password'], validate_unique=False)
+        Character._meta.get_field('name').run_validators(character_name)
+        return user, password, character_name
+
+    def import_chunk(self, chunk, kit_name, executor):
+        errors = []
+        accepted = []
+        seen = set()
+        for row_number, row in chunk:
+            try:
+                user, password, character_name = self.validate_row(row)
+            except ValidationError as exc:
+                errors.append((row_number, row.get('username', ''), '; '.join(exc.messages)))
+                continue
+            if user.username in seen:
+                errors.append((row_number, user.username, 'duplicate username in file'))
+                continue
+            seen.add(user.username)
+            accepted.append((row_number, user, password, character_name))
+
+        existing = set(User.objects.filter(username__in=seen).values_list('username', flat=True))
+        if existing:
+            errors += [(row_number, user.username, 'username already exists') for row_number, user, _, _ in accepted if user.username in existing]
+            accepted = [entry for entry in accepted if entry[1].username not in existing]
+
+        # PBKDF2 dominates the run time, so hashing is the part spread across processes.
+        passwords = [password for _, _, password, _ in accepted]
+        hashes = executor.map(_hash_password, passwords, chunksize=max(1, len(passwords) // 32)) if executor else map(_hash_password, passwords)
+        for (_, user, _, _), password_hash in zip(accepted, hashes):
+            user.password = password_hash
+
+        errors.sort()
+        try:
+            self.create_accounts(accepted, kit_name)
+            return len(accepted), errors
+        except IntegrityError:
+            # Someone created one of the usernames meanwhile: isolate the offending rows.
+            created = 0
+            for entry in accepted:
+                entry[1].pk = None
+                entry[1]._state.adding = True
+                try:
+                    self.create_accounts([entry], kit_name)
+                    created += 1
+                except IntegrityError as exc:
+                    errors.append((entry[0], entry[1].username, str(exc)))
+            return created, errors
+
+    def create_accounts(self, entries, kit_name):
+        if not entries:
+            return
+        with transaction.atomic():
+            users = User.objects.bulk_create([user for _, user, _, _ in entries])
+            onboard_users([(user, character_name) for user, (_, _, _, character_name) in zip(users, entries)], kit_name=kit_name)
+
+    def save_state(self, state_path, state):
+        temporary_path = f'{state_path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary_path, state_path)
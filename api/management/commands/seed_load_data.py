@@ -0,0 +1,246 @@
+﻿import datetime
+import random
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from api.logic import split_by_largest_remainder
+from api.models import (
+    Character, Skill, Goal, GoalType, GoalCompletion, GoalHistory, GoalHistoryAction, Note, Achievement,
+    LootItem, LootRarity, ReceivedReward, Group, LOOT_WEIGHT_TOTAL, CHARACTER_XP_CURVE, SKILL_XP_CURVE,
+)
+
+NON_DAILY_TYPES = [GoalType.BLUE, GoalType.YELLOW, GoalType.RED]
+RARITY_WEIGHTS = [
+    (LootRarity.COMMON, 60), (LootRarity.UNCOMMON, 25), (LootRarity.RARE, 9), (LootRarity.UNIQUE, 4), (LootRarity.LEGENDARY, 2),
+]
+
+def parse_range(value):
+    low, _, high = value.partition('-')
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise CommandError(f'"{value}" is not a number or a "min-max" range.')
+    if low < 0 or high < low:
+        raise CommandError(f'"{value}" is not a valid range.')
+    return low, high
+
+class Command(BaseCommand):
+    help = (
+        'Generates a deterministic synthetic dataset (users, skills, goals, notes, achievements, loot, groups and '
+        'multi-year completion history) with chunked bulk_create. Usage: manage.py seed_load_data --users 100'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--prefix', type=str, default='load_user', help='Username prefix')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=None, help='Last day of history, YYYY-MM-DD (default: today)')
+        parser.add_argument('--history-days', type=int, default=730)
+        parser.add_argument('--skills', type=parse_range, default=(3, 12), help='Skills per user, N or min-max')
+        parser.add_argument('--goals', type=parse_range, default=(2, 6), help='Goals per skill')
+        parser.add_argument('--daily-share', type=float, default=0.5, help='Share of goals that are daily')
+        parser.add_argument('--notes', type=parse_range, default=(0, 4), help='Notes per skill')
+        parser.add_argument('--achievements', type=parse_range, default=(1, 3), help='Achievements per skill and per character')
+        parser.add_argument('--loot-items', type=parse_range, default=(3, 10), help='Loot items per user')
+        parser.add_argument('--received-share', type=float, default=0.3, help='Share of loot items already won')
+        parser.add_argument('--completion-rate', type=float, default=0.6, help='Chance a daily goal is done on a given day')
+        parser.add_argument('--progress-rate', type=float, default=0.1, help='Chance of a progress entry per skill per day')
+        parser.add_argument('--groups', type=int, default=2)
+        parser.add_argument('--group-size', type=parse_range, default=(2, 8))
+        parser.add_argument('--chunk-users', type=int, default=20, help='Users generated per transaction')
+        parser.add_argument('--batch-size', type=int, default=2000, help='bulk_create batch size')
+        parser.add_argument('--password', type=str, default='password123', help='Shared password of all generated users')
+        parser.add_argument('--replace', action='store_true', help='Delete existing users with the prefix first')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.end_date = options['end_date'] or timezone.localdate()
+        self.days = [self.end_date - datetime.timedelta(days=offset) for offset in range(options['history_days'] - 1, -1, -1)]
+        self.counts = {}
+
+        existing = User.objects.filter(username__startswith=f'{options["prefix"]}_')
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError(f'Users with prefix "{options["prefix"]}_" already exist; use --replace or another --prefix.')
+            self.stdout.write(f'Deleting {existing.count()} existing users...')
+            existing.delete()
+
+        started = time.perf_counter()
+        # PBKDF2 is far too slow to run per synthetic account, so all of them share one hash.
+        password_hash = make_password(options['password'])
+        user_ids = []
+        for start in range(0, options['users'], options['chunk_users']):
+            indexes = range(start, min(start + options['chunk_users'], options['users']))
+            with transaction.atomic():
+                user_ids += self.create_users(indexes, password_hash)
+            self.stdout.write(f'  users {indexes.stop}/{options["users"]}: {sum(self.counts.values())} rows ({time.perf_counter() - started:.1f} s)')
+
+        with transaction.atomic():
+            self.create_groups(user_ids)
+
+        elapsed = time.perf_counter() - started
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(f'Created {total} rows in {elapsed:.1f} s ({total / elapsed if elapsed else 0:.0f} rows/s):'))
+        for name, count in self.counts.items():
+            self.stdout.write(f'  {name:>16}: {count}')
+
+    def bulk_create(self, model, objects):
+        created = model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(created)
+        return created
+
+    def timestamp(self, day):
+        moment = datetime.datetime.combine(day, datetime.time(self.rng.randint(6, 23), self.rng.randint(0, 59)))
+        return timezone.make_aware(moment, datetime.timezone.utc)
+
+    def create_users(self, indexes, password_hash):
+        prefix = self.options['prefix']
+        users = self.bulk_create(User, [User(username=f'{prefix}_{index}', password=password_hash) for index in indexes])
+        characters = self.bulk_create(Character, [Character(user=user, name=f'Нагрузка {index}') for user, index in zip(users, indexes)])
+
+        skills = []
+        for character in characters:
+            for number in range(self.rng.randint(*self.options['skills'])):
+                skills.append(Skill(character=character, name=f'Навык {number}', xp_per_unit=self.rng.choice([5, 10, 15, 20, 30])))
+        skills = self.bulk_create(Skill, skills)
+
+        goals = self.create_goals(skills)
+        self.create_notes(skills)
+        self.create_history(characters, skills, goals)
+        self.create_achievements(characters, skills)
+        self.create_loot(users)
+        return [user.pk for user in users]
+
+    def create_goals(self, skills):
+        goals = []
+        for skill in skills:
+            for number in range(self.rng.randint(*self.options['goals'])):
+                goal_type = GoalType.DAILY if self.rng.random() < self.options['daily_share'] else self.rng.choice(NON_DAILY_TYPES)
+                goals.append(Goal(skill=skill, description=f'Цель {number}', goal_type=goal_type, xp_reward=self.rng.choice([10, 25, 50, 100])))
+        return self.bulk_create(Goal, goals)
+
+    def create_notes(self, skills):
+        self.bulk_create(Note, [
+            Note(skill=skill, text=f'Заметка {number} о навыке {skill.name}')
+            for skill in skills for number in range(self.rng.randint(*self.options['notes']))
+        ])
+
+    def create_history(self, characters, skills, goals):
+        owner_of_character = {character.pk: character.user_id for character in characters}
+        skill_by_id = {skill.pk: skill for skill in skills}
+        goals_by_skill = {}
+        for goal in goals:
+            goals_by_skill.setdefault(goal.skill_id, []).append(goal)
+
+        completions = []
+        history = []
+        skill_xp = dict.fromkeys(skill_by_id, 0)
+        for skill in skills:
+            owner_id = owner_of_character[skill.character_id]
+            for goal in goals_by_skill.get(skill.pk, []):
+                if goal.goal_type == GoalType.DAILY:
+                    done_days = [day for day in self.days if self.rng.random() < self.options['completion_rate']]
+                elif self.days and self.rng.random() < 0.5:
+                    done_days = [self.rng.choice(self.days)]
+                else:
+                    done_days = []
+                for day in done_days:
+                    completions.append(GoalCompletion(goal=goal, owner_id=owner_id, completion_date=day))
+                    history.append(GoalHistory(
+                        owner_id=owner_id, goal_description=goal.description, skill_name=skill.name, skill_id=skill.pk,
+                        xp_amount=goal.xp_reward, action=GoalHistoryAction.COMPLETED, goal_type=goal.goal_type, timestamp=self.timestamp(day)
+                    ))
+                    skill_xp[skill.pk] += goal.xp_reward
+
+            for day in self.days:
+                if self.rng.random() < self.options['progress_rate']:
+                    units = self.rng.randint(1, 5)
+                    history.append(GoalHistory(
+                        owner_id=owner_id, goal_description=f'{units} ед. прогресса', skill_name=skill.name, skill_id=skill.pk,
+                        xp_amount=skill.xp_per_unit * units, action=GoalHistoryAction.PROGRESS_ADDED, timestamp=self.timestamp(day)
+                    ))
+                    skill_xp[skill.pk] += skill.xp_per_unit * units
+
+        self.bulk_create(GoalCompletion, completions)
+        self.bulk_create(GoalHistory, history)
+
+        # Levels follow from the generated history so the dataset is internally consistent.
+        character_xp = dict.fromkeys(owner_of_character, 0)
+        for skill in skills:
+            skill.level, skill.current_xp, skill.xp_to_next_level, _ = SKILL_XP_CURVE.apply(1, 0, 100, skill_xp[skill.pk])
+            character_xp[skill.character_id] += skill_xp[skill.pk]
+        for character in characters:
+            character.level, character.current_xp, character.xp_to_next_level, _ = CHARACTER_XP_CURVE.apply(1, 0, 100, character_xp[character.pk])
+
+    def achievements_for(self, level, owner_field, owner):
+        achievements = []
+        for number in range(self.rng.randint(*self.options['achievements'])):
+            required_level = self.rng.randint(2, max(3, level + 5))
+            claimed = required_level <= level
+            achievements.append(Achievement(
+                required_level=required_level, description=f'Награда {number}',
+                claimed_date=self.timestamp(self.end_date) if claimed else None, **{owner_field: owner}
+            ))
+        owner.next_achievement_level = min((a.required_level for a in achievements if not a.claimed_date), default=None)
+        return achievements
+
+    def create_achievements(self, characters, skills):
+        achievements = []
+        for character in characters:
+            achievements += self.achievements_for(character.level, 'owner_character', character)
+        for skill in skills:
+            achievements += self.achievements_for(skill.level, 'owner_skill', skill)
+        self.bulk_create(Achievement, achievements)
+
+        Character.objects.bulk_update(characters, ['level', 'current_xp', 'xp_to_next_level', 'next_achievement_level'], batch_size=self.batch_size)
+        Skill.objects.bulk_update(skills, ['level', 'current_xp', 'xp_to_next_level', 'next_achievement_level'], batch_size=self.batch_size)
+
+    def create_loot(self, users):
+        rarities, weights = zip(*RARITY_WEIGHTS)
+        items = []
+        rewards = []
+        for user in users:
+            pool = []
+            for number in range(self.rng.randint(*self.options['loot_items'])):
+                rarity = self.rng.choices(rarities, weights)[0]
+                item = LootItem(owner=user, name=f'Предмет {number}', rarity=rarity)
+                if self.rng.random() < self.options['received_share'] and self.days:
+                    item.received_date = self.timestamp(self.rng.choice(self.days))
+                    rewards.append(ReceivedReward(
+                        owner=user, description=item.name, source_name='Лутбокс', received_date=item.received_date, rarity=rarity
+                    ))
+                    item.set_weight(0)
+                else:
+                    pool.append(item)
+                items.append(item)
+
+            if pool:
+                shares = split_by_largest_remainder([self.rng.randint(1, 100) for _ in pool], LOOT_WEIGHT_TOTAL)
+                for item, weight_bp in zip(pool, shares):
+                    item.set_weight(weight_bp)
+
+        self.bulk_create(LootItem, items)
+        self.bulk_create(ReceivedReward, rewards)
+
+    def create_groups(self, user_ids):
+        if not user_ids:
+            return
+        membership = Group.members.through
+        groups = self.bulk_create(Group, [
+            Group(name=f'{self.options["prefix"]} группа {number}', owner_id=self.rng.choice(user_ids))
+            for number in range(self.options['groups'])
+        ])
+        members = []
+        skills = []
+        for group in groups:
+            size = min(self.rng.randint(*self.options['group_size']), len(user_ids))
+            members += [membership(group_id=group.pk, user_id=user_id) for user_id in self.rng.sample(user_ids, size)]
+            skills += [Skill(group=group, name=f'Групповой навык {number}') for number in range(self.rng.randint(1, 3))]
+        self.bulk_create(membership, members)
+        skills = self.bulk_create(Skill, skills)
+        self.create_goals(skills)
@@ -0,0 +1,65 @@
+﻿import json
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from api.models import LootItem
+from api.simulation import simulate_lootbox
+from api.views import MAX_SIMULATION_PITY
+
+class Command(BaseCommand):
+    help = 'Monte Carlo simulation of lootbox sessions for a user\'s loot pool. Usage: manage.py simulate_lootbox <username> [--sessions N] [--opens N] [--workers N]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', type=str, help='Owner of the loot pool')
+        parser.add_argument('--sessions', type=int, default=1_000_000, help='Number of simulated sessions')
+        parser.add_argument('--opens', type=int, default=30, help='Lootbox opens per session')
+        parser.add_argument('--pity', type=int, default=None, help='Starting pity counter (default: the character\'s current value)')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible runs')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes for the session chunks')
+        parser.add_argument('--json', action='store_true', help='Print the raw report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.select_related('character').get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        items = list(LootItem.objects.filter(owner=user, received_date__isnull=True).order_by('id'))
+        if not items:
+            raise CommandError('The user has no available loot items.')
+        if options['sessions'] < 1 or options['opens'] < 1:
+            raise CommandError('--sessions and --opens must be positive.')
+
+        start_pity = options['pity']
+        if start_pity is None:
+            start_pity = getattr(getattr(user, 'character', None), 'pity_counter', 0)
+        if not 0 <= start_pity <= MAX_SIMULATION_PITY:
+            raise CommandError(f'--pity must be between 0 and {MAX_SIMULATION_PITY}.')
+
+        report = simulate_lootbox(
+            items, options['sessions'], options['opens'],
+            start_pity=start_pity, seed=options['seed'], workers=options['workers']
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{report["sessions"]} sessions x {report["opens_per_session"]} opens, start pity {report["start_pity"]} ({report["elapsed_seconds"]} s)'
+        ))
+        self.stdout.write(
+            f'{report["total_opens"]} opens in total; {report["pool_emptied_share"] * 100:.1f}% of sessions ran out of items (won items are not returned)'
+        )
+        self.stdout.write('Per-item hit rate:')
+        for item in report['items']:
+            self.stdout.write(f'  {item["name"]:>25} [{item["rarity"]:>9}] {item["weight_bp"] / 100:6.2f}% base -> {item["hit_rate"] * 100:6.2f}%')
+
+        self.stdout.write('Opens until first drop of each rarity:')
+        for rarity, stats in report['opens_until_first'].items():
+            mean = f'{stats["mean"]:.2f}' if stats['mean'] is not None else '-'
+            self.stdout.write(
+                f'  {rarity:>9}: mean {mean:>6}, p50 {stats["p50"]}, p90 {stats["p90"]}, seen in {stats["appeared_share"] * 100:.1f}% of sessions'
+            )
+
+        pity = report['pity']
+        self.stdout.write(f'Pity counter at open: mean {pity["mean"]:.2f}, p50 {pity["p50"]}, p90 {pity["p90"]}, p99 {pity["p99"]}, max {pity["max"]}')
@@ -0,0 +1,66 @@
+﻿import json
+from collections import Counter, defaultdict
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        'Summarizes the slow-query log (including rotated files) by query shape: count, total and max time, '
+        'routes, call sites and the captured plan. Usage: manage.py slow_queries_report [--log path] [--top N]'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', type=str, default=None, help='Log file, SLOW_QUERY_LOG by default')
+        parser.add_argument('--top', type=int, default=10, help='Shapes to show, by total time')
+
+    def handle(self, *args, **options):
+        path = Path(options['log'] or settings.SLOW_QUERY_LOG)
+        files = sorted(path.parent.glob(f'{path.name}.*'), key=lambda item: item.name, reverse=True) + [path]
+        shapes = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'routes': Counter(), 'frames': Counter(), 'sql': None})
+        plans = {}
+
+        for log_file in files:
+            if not log_file.is_file():
+                continue
+            with open(log_file, encoding='utf-8') as source:
+                for line in source:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('type') == 'plan':
+                        plans[entry['fingerprint']] = entry
+                        continue
+                    shape = shapes[entry['fingerprint']]
+                    shape['count'] += 1
+                    shape['total_ms'] += entry['duration_ms']
+                    shape['max_ms'] = max(shape['max_ms'], entry['duration_ms'])
+                    shape['routes'][entry['route']] += 1
+                    frame = entry.get('frame')
+                    if frame:
+                        shape['frames'][f'{frame["file"]}:{frame["line"]} {frame["function"]}'] += 1
+                    shape['sql'] = entry['sql']
+
+        if not shapes:
+            self.stdout.write(self.style.WARNING(f'No slow queries in {path}.'))
+            return
+
+        ranked = sorted(shapes.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:options['top']]
+        for fingerprint, shape in ranked:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{fingerprint}: {shape["count"]} queries, total {shape["total_ms"]:.1f} ms, max {shape["max_ms"]:.1f} ms'
+            ))
+            self.stdout.write(f'  routes: {", ".join(f"{route} ({count})" for route, count in shape["routes"].most_common(5))}')
+            for frame, count in shape['frames'].most_common(3):
+                self.stdout.write(f'  at {frame} ({count})')
+            self.stdout.write(f'  sql: {shape["sql"]}')
+            plan = plans.get(fingerprint)
+            if plan is None:
+                continue
+            if 'error' in plan:
+                self.stdout.write(self.style.WARNING(f'  plan: {plan["error"]}'))
+                continue
+            self.stdout.write(f'  plan ({plan["prefix"]}):')
+            for row in plan['rows']:
+                self.stdout.write(f'    {row}')
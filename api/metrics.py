@@ -0,0 +1,299 @@
+﻿"""
+Prometheus-style metrics without an external service. Every process keeps its
+samples in memory and a background thread writes them to the process's own
+JSON file in METRICS_DIR every METRICS_FLUSH_INTERVAL; /metrics sums the files
+of all gunicorn workers. Files of stopped workers are folded into archive.json
+on scrape so counters do not go backwards, which needs METRICS_DIR to be local
+to the host; empty the directory on deploy.
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, transaction
+from .instrumentation import QueryTimer
+
+try:
+    import fcntl
+except ImportError:  # Windows: no forked workers whose files need folding.
+    fcntl = None
+
+logger = logging.getLogger('api.metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+PROCESS_FILE_RE = re.compile(r'^(\d+)-[0-9a-f]{8}\.json$')
+ARCHIVE_FILE = 'archive.json'
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _read_snapshot(path):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+def _write_snapshot(path, snapshot):
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(handle, 'w', encoding='utf-8') as output:
+        json.dump(snapshot, output)
+    os.replace(temp_path, path)
+
+@contextmanager
+def _directory_lock(directory):
+    if fcntl is None:
+        yield
+        return
+    with open(directory / '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.samples = {}
+        self.pid = None
+        self.path = None
+        self.flusher_pid = None
+        self.dirty = False
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _process_samples(self):
+        pid = os.getpid()
+        if self.pid != pid:
+            # After a fork the inherited samples belong to the parent's file.
+            self.pid = pid
+            self.path = None
+            self.samples = {}
+        if self.flusher_pid != pid:
+            # Threads do not survive a fork either: one flusher per process.
+            self.flusher_pid = pid
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        return self.samples
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception('Could not write metrics to %s', settings.METRICS_DIR)
+
+    def update(self, metric, labels, apply):
+        if not settings.METRICS_ENABLED:
+            return
+        with self.lock:
+            samples = self._process_samples().setdefault(metric.name, {})
+            samples[labels] = apply(samples.get(labels))
+            self.dirty = True
+
+    def flush(self):
+        if not settings.METRICS_ENABLED:
+            return
+        # The file is written outside self.lock so requests never wait on disk.
+        with self.write_lock:
+            with self.lock:
+                self._process_samples()
+                if not self.dirty:
+                    return
+                directory = Path(settings.METRICS_DIR)
+                if self.path is None:
+                    self.path = directory / f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+                path = self.path
+                snapshot = {name: [[list(labels), value] for labels, value in samples.items()] for name, samples in self.samples.items()}
+                self.dirty = False
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _write_snapshot(path, snapshot)
+
+    def _merge(self, merged, snapshot):
+        for name, samples in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            for labels, value in samples:
+                labels = tuple(labels)
+                merged[name][labels] = metric.merge(merged[name].get(labels), value)
+
+    def _archive_stopped_processes(self, directory):
+        if fcntl is None:
+            return
+        stopped = [
+            path for path in directory.glob('*.json')
+            if (match := PROCESS_FILE_RE.match(path.name)) and not _process_alive(int(match.group(1)))
+        ]
+        if not stopped:
+            return
+        archived = {name: {} for name in self.metrics}
+        for path in [directory / ARCHIVE_FILE, *stopped]:
+            self._merge(archived, _read_snapshot(path) or {})
+        _write_snapshot(directory / ARCHIVE_FILE, {
+            name: [[list(labels), value] for labels, value in samples.items()]
+            for name, samples in archived.items() if samples
+        })
+        for path in stopped:
+            path.unlink(missing_ok=True)
+
+    def collect(self):
+        self.flush()
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        merged = {name: {} for name in self.metrics}
+        # Scrapes of different workers must not fold the same file twice.
+        with _directory_lock(directory):
+            self._archive_stopped_processes(directory)
+            for path in directory.glob('*.json'):
+                self._merge(merged, _read_snapshot(path) or {})
+        return merged
+
+    def render(self):
+        lines = []
+        for name, samples in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels in sorted(samples):
+                lines.extend(metric.render(labels, samples[labels]))
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.update(self, self._key(labels), lambda value: (value or 0) + amount)
+
+    def inc_on_commit(self, amount=1, **labels):
+        # Rolled back changes (an XP conflict, for one) must not be counted.
+        transaction.on_commit(lambda: self.inc(amount, **labels))
+
+    def merge(self, left, right):
+        return (left or 0) + right
+
+    def render(self, labels, value):
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}']
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+
+        def apply(sample):
+            # Per-bucket counts (the last one is +Inf) followed by the sum.
+            sample = sample or [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+            return sample
+
+        self.registry.update(self, self._key(labels), apply)
+
+    def merge(self, left, right):
+        return [a + b for a, b in zip(left, right)] if left else list(right)
+
+    def render(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], value[:-1]):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(value[-1])}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+REQUEST_LATENCY = Histogram('rpg_http_request_duration_seconds', 'Request latency by view and action.', ['view', 'action'])
+REQUESTS = Counter('rpg_http_requests_total', 'Requests by view, action and status code.', ['view', 'action', 'status'])
+DB_QUERIES = Counter('rpg_db_queries_total', 'SQL queries by view and action.', ['view', 'action'])
+DB_QUERY_SECONDS = Counter('rpg_db_query_seconds_total', 'Time spent in SQL queries by view and action.', ['view', 'action'])
+GOALS_COMPLETED = Counter('rpg_goals_completed_total', 'Goals marked as completed.', ['goal_type'])
+XP_GRANTED = Counter('rpg_xp_granted_total', 'XP granted to characters.', ['source'])
+LOOTBOXES_OPENED = Counter('rpg_lootboxes_opened_total', 'Lootboxes opened by the rarity of the reward.', ['rarity'])
+ACHIEVEMENTS_CLAIMED = Counter('rpg_achievements_claimed_total', 'Achievements claimed.', ['owner'])
+
+def get_view_labels(request, view_func):
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    view = view_class.__name__ if view_class else view_func.__name__
+    # DRF viewsets map each HTTP method to an action name.
+    actions = getattr(view_func, 'actions', None) or {}
+    return {'view': view, 'action': actions.get(request.method.lower(), request.method.lower())}
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._metrics_labels = None
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        labels = request._metrics_labels
+        if labels is not None:
+            REQUEST_LATENCY.observe(duration, **labels)
+            REQUESTS.inc(status=response.status_code, **labels)
+            if timer.count:
+                DB_QUERIES.inc(timer.count, **labels)
+                DB_QUERY_SECONDS.inc(timer.duration, **labels)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(getattr(view_func, 'view_class', None), 'skip_metrics', False):
+            request._metrics_labels = get_view_labels(request, view_func)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_goalhistory_goal_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
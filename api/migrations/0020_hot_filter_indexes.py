@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_character_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='goalcompletion',
+            index=models.Index(fields=['owner', 'completion_date', 'goal'], name='api_goalcomp_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goalhistory',
+            index=models.Index(fields=['owner', '-timestamp', '-id'], name='api_goalhist_owner_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goalhistory',
+            index=models.Index(fields=['owner', 'skill_id', '-timestamp', '-id'], name='api_goalhist_owner_skill_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lootitem',
+            index=models.Index(condition=models.Q(('received_date__isnull', True)), fields=['owner'], name='api_loot_owner_avail_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedreward',
+            index=models.Index(fields=['owner', '-received_date', '-id'], name='api_reward_owner_date_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:53
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+def forwards_func(apps, schema_editor):
+    LootItem = apps.get_model('api', 'LootItem')
+    items = list(LootItem.objects.only('id', 'base_chance'))
+    for item in items:
+        weight_bp = int((item.base_chance * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+        item.weight_bp = min(max(weight_bp, 0), 10000)
+    LootItem.objects.bulk_update(items, ['weight_bp'], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lootitem',
+            name='weight_bp',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:04
+
+from django.db import migrations, models
+from django.db.models import Min
+
+def forwards_func(apps, schema_editor):
+    Achievement = apps.get_model('api', 'Achievement')
+    unclaimed = Achievement.objects.filter(claimed_date__isnull=True)
+    for model_name, owner_field in (('Character', 'owner_character'), ('Skill', 'owner_skill')):
+        model = apps.get_model('api', model_name)
+        levels = unclaimed.filter(**{f'{owner_field}__isnull': False}).values(owner_field).annotate(level=Min('required_level'))
+        owners = []
+        for row in levels:
+            owner = model(pk=row[owner_field])
+            owner.next_achievement_level = row['level']
+            owners.append(owner)
+        model.objects.bulk_update(owners, ['next_achievement_level'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_lootitem_weight_bp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='next_achievement_level',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='skill',
+            name='next_achievement_level',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
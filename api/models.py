@@ -1,9 +1,13 @@
-﻿import datetime
+﻿import bisect
+import datetime
 import math
+import threading
+from decimal import Decimal, ROUND_HALF_UP
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.utils import timezone
+from .tracing import traced
 
 class GoalType(models.TextChoices):
     DAILY = 'DAILY', 'Ежедневная'
@@ -18,6 +22,118 @@ class LootRarity(models.TextChoices):
     UNIQUE = 'UNIQUE', 'Уникальный'
     LEGENDARY = 'LEGENDARY', 'Легендарный'
 
+class XPCurve:
+    """
+    Level resolution over a lazily grown table of cumulative XP, so crossing
+    any number of levels costs one bisect instead of a loop per level.
+    """
+    def __init__(self, xp_for_level):
+        self.xp_for_level = xp_for_level
+        # _cumulative[lvl] is the XP needed to get from level 1 to lvl.
+        self._cumulative = [0, 0]
+        self._lock = threading.Lock()
+
+    def _extend(self, total_xp=None, level=None):
+        with self._lock:
+            cumulative = self._cumulative
+            while (total_xp is not None and cumulative[-1] <= total_xp) or (level is not None and len(cumulative) <= level):
+                last_level = len(cumulative) - 1
+                cumulative.append(cumulative[-1] + self.xp_for_level(last_level))
+
+    def cumulative(self, level):
+        if level >= len(self._cumulative):
+            self._extend(level=level)
+        return self._cumulative[level]
+
+    def level_for_total(self, total_xp):
+        if total_xp >= self._cumulative[-1]:
+            self._extend(total_xp=total_xp)
+        return max(1, bisect.bisect_right(self._cumulative, total_xp) - 1)
+
+    def apply(self, level, current_xp, xp_to_next_level, amount):
+        """Returns (level, current_xp, xp_to_next_level, leveled_up) after adding amount."""
+        leveled_up = False
+        current_xp += amount
+
+        if amount > 0 and current_xp >= xp_to_next_level:
+            # The first step uses the stored threshold, as the stepwise version does.
+            level += 1
+            position = self.cumulative(level) + current_xp - xp_to_next_level
+            level = self.level_for_total(position)
+            current_xp = position - self.cumulative(level)
+            xp_to_next_level = self.xp_for_level(level)
+            leveled_up = True
+        elif amount < 0 and current_xp < 0:
+            if level > 1:
+                position = self.cumulative(level) + current_xp
+                if position < 0:
+                    level = 1
+                    current_xp = 0
+                else:
+                    level = self.level_for_total(position)
+                    current_xp = position - self.cumulative(level)
+                xp_to_next_level = self.xp_for_level(level)
+            else:
+                current_xp = 0
+
+        if current_xp < 0:
+            current_xp = 0
+
+        return level, current_xp, xp_to_next_level, leveled_up
+
+    def apply_stepwise(self, level, current_xp, xp_to_next_level, amount):
+        """Reference implementation: one loop iteration per level crossed."""
+        leveled_up = False
+        current_xp += amount
+
+        if amount > 0:
+            while current_xp >= xp_to_next_level:
+                current_xp -= xp_to_next_level
+                level += 1
+                xp_to_next_level = self.xp_for_level(level)
+                leveled_up = True
+        elif amount < 0:
+            while current_xp < 0:
+                if level <= 1:
+                    current_xp = 0
+                    break
+
+                level -= 1
+                xp_of_previous_level = self.xp_for_level(level)
+                current_xp += xp_of_previous_level
+                xp_to_next_level = xp_of_previous_level
+
+        if current_xp < 0:
+            current_xp = 0
+
+        return level, current_xp, xp_to_next_level, leveled_up
+
+def character_xp_for_level(lvl):
+    if lvl == 1: return 100
+    if lvl < 4: return lvl * 120
+    return round(100 * (lvl ** 1.5))
+
+def skill_xp_for_level(lvl):
+    return 100 * lvl
+
+CHARACTER_XP_CURVE = XPCurve(character_xp_for_level)
+SKILL_XP_CURVE = XPCurve(skill_xp_for_level)
+
+def save_without_db_maintained_fields(instance, field_names, kwargs):
+    if not instance._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+        kwargs['update_fields'] = [
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in field_names
+        ]
+
+def update_next_achievement_level(model, pk):
+    owner_field = 'owner_character' if model is Character else 'owner_skill'
+    next_level = Achievement.objects.filter(**{owner_field: pk, 'claimed_date__isnull': True}).aggregate(
+        level=models.Min('required_level')
+    )['level']
+    model.objects.filter(pk=pk).update(next_achievement_level=next_level)
+    return next_level
+
 class Group(models.Model):
     name = models.CharField(max_length=100, unique=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_groups')
@@ -35,39 +151,28 @@ class Character(models.Model):
     pity_counter = models.IntegerField(default=0)
     last_lootbox_date = models.DateField(null=True, blank=True)
     daily_reset_time = models.TimeField(default=datetime.time(3, 0))
+    version = models.PositiveBigIntegerField(default=0)
+    # Lowest required_level among unclaimed achievements, None when there are none.
+    next_achievement_level = models.IntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # version and next_achievement_level are only ever written in the database
+        # (see api/versioning.py and update_next_achievement_level), so a stale
+        # in-memory copy must not overwrite a newer value.
+        save_without_db_maintained_fields(self, ('version', 'next_achievement_level'), kwargs)
+        super().save(*args, **kwargs)
+
     def _get_xp_for_level(self, lvl):
-        if lvl == 1: return 100
-        if lvl < 4: return lvl * 120
-        return round(100 * (lvl ** 1.5))
+        return character_xp_for_level(lvl)
 
+    @traced('Character.add_xp')
     def add_xp(self, amount):
-        leveled_up = False
-        self.current_xp += amount
-        
-        if amount > 0:
-            while self.current_xp >= self.xp_to_next_level:
-                self.current_xp -= self.xp_to_next_level
-                self.level += 1
-                self.xp_to_next_level = self._get_xp_for_level(self.level)
-                leveled_up = True
-        elif amount < 0:
-            while self.current_xp < 0:
-                if self.level <= 1:
-                    self.current_xp = 0
-                    break
-
-                self.level -= 1
-                xp_of_previous_level = self._get_xp_for_level(self.level)
-                self.current_xp += xp_of_previous_level
-                self.xp_to_next_level = xp_of_previous_level
-
-        if self.current_xp < 0:
-            self.current_xp = 0
-
+        self.level, self.current_xp, self.xp_to_next_level, leveled_up = CHARACTER_XP_CURVE.apply(
+            self.level, self.current_xp, self.xp_to_next_level, amount
+        )
         return leveled_up
 
 class Skill(models.Model):
@@ -80,37 +185,23 @@ class Skill(models.Model):
     level = models.IntegerField(default=1)
     current_xp = models.IntegerField(default=0)
     xp_to_next_level = models.IntegerField(default=100)
+    next_achievement_level = models.IntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        save_without_db_maintained_fields(self, ('next_achievement_level',), kwargs)
+        super().save(*args, **kwargs)
     
     def _get_xp_for_level(self, lvl):
-        return 100 * lvl
+        return skill_xp_for_level(lvl)
 
+    @traced('Skill.add_xp')
     def add_xp(self, amount):
-        leveled_up = False
-        self.current_xp += amount
-
-        if amount > 0:
-            while self.current_xp >= self.xp_to_next_level:
-                self.current_xp -= self.xp_to_next_level
-                self.level += 1
-                self.xp_to_next_level = self._get_xp_for_level(self.level)
-                leveled_up = True
-        elif amount < 0:
-            while self.current_xp < 0:
-                if self.level <= 1:
-                    self.current_xp = 0
-                    break
-
-                self.level -= 1
-                xp_of_previous_level = self._get_xp_for_level(self.level)
-                self.current_xp += xp_of_previous_level
-                self.xp_to_next_level = xp_of_previous_level
-
-        if self.current_xp < 0:
-            self.current_xp = 0
-
+        self.level, self.current_xp, self.xp_to_next_level, leveled_up = SKILL_XP_CURVE.apply(
+            self.level, self.current_xp, self.xp_to_next_level, amount
+        )
         return leveled_up
 
 class Goal(models.Model):
@@ -133,6 +224,9 @@ class GoalCompletion(models.Model):
 
     class Meta:
         unique_together = ('goal', 'owner', 'completion_date')
+        indexes = [
+            models.Index(fields=['owner', 'completion_date', 'goal'], name='api_goalcomp_owner_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.goal.description} completed on {self.completion_date} by {self.owner.username}"
@@ -160,11 +254,35 @@ class LootItem(models.Model):
     name = models.CharField(max_length=100)
     rarity = models.CharField(max_length=10, choices=LootRarity.choices, default=LootRarity.COMMON)
     base_chance = models.DecimalField(max_digits=5, decimal_places=2)
+    # Шанс в базисных пунктах (1/100 процента), сумма по доступным предметам равна LOOT_WEIGHT_TOTAL.
+    weight_bp = models.PositiveIntegerField(default=0)
     received_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner'], condition=models.Q(received_date__isnull=True), name='api_loot_owner_avail_idx'),
+        ]
     
     def __str__(self):
         return f'{self.name} ({self.get_rarity_display()})'
 
+    def set_weight(self, weight_bp):
+        self.weight_bp = weight_bp
+        self.base_chance = Decimal(weight_bp) / 100
+
+    def save(self, *args, **kwargs):
+        self.weight_bp = chance_to_bp(self.base_chance)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'base_chance' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'weight_bp'}
+        super().save(*args, **kwargs)
+
+LOOT_WEIGHT_TOTAL = 10000
+
+def chance_to_bp(chance):
+    weight_bp = int((Decimal(str(chance)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    return min(max(weight_bp, 0), LOOT_WEIGHT_TOTAL)
+
 class ReceivedReward(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_rewards')
     description = models.CharField(max_length=255)
@@ -174,6 +292,9 @@ class ReceivedReward(models.Model):
     
     class Meta:
         ordering = ['-received_date']
+        indexes = [
+            models.Index(fields=['owner', '-received_date', '-id'], name='api_reward_owner_date_idx'),
+        ]
         
     def __str__(self):
         return f'"{self.description}" from {self.source_name}'
@@ -195,6 +316,10 @@ class GoalHistory(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['owner', '-timestamp', '-id'], name='api_goalhist_owner_ts_idx'),
+            models.Index(fields=['owner', 'skill_id', '-timestamp', '-id'], name='api_goalhist_owner_skill_idx'),
+        ]
         verbose_name = 'Goal History Entry'
         verbose_name_plural = 'Goal History Entries'
 
@@ -0,0 +1,93 @@
+﻿"""
+Starter content for new accounts, described by JSON kits in api/starter_kits/.
+
+A kit is read and its loot chances are normalized once per process. Applying
+it costs one bulk INSERT per model, however many accounts are onboarded together.
+"""
+import functools
+import json
+from decimal import Decimal
+from pathlib import Path
+from django.db import transaction
+from .logic import split_by_largest_remainder
+from .models import Character, Skill, Achievement, LootItem, LOOT_WEIGHT_TOTAL, chance_to_bp
+
+STARTER_KITS_DIR = Path(__file__).resolve().parent / 'starter_kits'
+DEFAULT_STARTER_KIT = 'default'
+
+def available_starter_kits():
+    return sorted(path.stem for path in STARTER_KITS_DIR.glob('*.json'))
+
+@functools.lru_cache(maxsize=None)
+def load_starter_kit(name=DEFAULT_STARTER_KIT):
+    path = STARTER_KITS_DIR / f'{name}.json'
+    if not path.is_file():
+        raise ValueError(f'Unknown starter kit "{name}". Available: {", ".join(available_starter_kits())}')
+
+    with open(path, encoding='utf-8') as kit_file:
+        kit = json.load(kit_file)
+
+    loot_items = kit.setdefault('loot_items', [])
+    weights = [chance_to_bp(item['base_chance']) for item in loot_items]
+    if loot_items and not any(weights):
+        weights = [1] * len(loot_items)
+    if loot_items:
+        for item, weight_bp in zip(loot_items, split_by_largest_remainder(weights, LOOT_WEIGHT_TOTAL)):
+            item['weight_bp'] = weight_bp
+
+    kit.setdefault('skills', [])
+    kit.setdefault('character_achievements', [])
+    for skill in kit['skills']:
+        skill.setdefault('achievements', [])
+    return kit
+
+def _lowest_level(achievements):
+    return min((achievement['required_level'] for achievement in achievements), default=None)
+
+def onboard_users(accounts, kit_name=DEFAULT_STARTER_KIT, batch_size=None):
+    """
+    accounts: iterable of (saved user, character name). Creates the characters
+    and the kit's skills, achievements and loot items; returns the characters.
+    """
+    kit = load_starter_kit(kit_name)
+    skill_kits = kit['skills']
+
+    with transaction.atomic():
+        characters = Character.objects.bulk_create([
+            Character(user=user, name=name, next_achievement_level=_lowest_level(kit['character_achievements']))
+            for user, name in accounts
+        ], batch_size=batch_size)
+
+        skills = Skill.objects.bulk_create([
+            Skill(
+                character=character,
+                name=skill_kit['name'],
+                unit_description=skill_kit['unit_description'],
+                xp_per_unit=skill_kit['xp_per_unit'],
+                next_achievement_level=_lowest_level(skill_kit['achievements'])
+            )
+            for character in characters for skill_kit in skill_kits
+        ], batch_size=batch_size)
+
+        achievements = [
+            Achievement(owner_character=character, required_level=achievement['required_level'], description=achievement['description'])
+            for character in characters for achievement in kit['character_achievements']
+        ]
+        achievements += [
+            Achievement(owner_skill=skill, required_level=achievement['required_level'], description=achievement['description'])
+            for skill, skill_kit in zip(skills, skill_kits * len(characters)) for achievement in skill_kit['achievements']
+        ]
+        Achievement.objects.bulk_create(achievements, batch_size=batch_size)
+
+        LootItem.objects.bulk_create([
+            LootItem(
+                owner_id=character.user_id,
+                name=item['name'],
+                rarity=item['rarity'],
+                weight_bp=item['weight_bp'],
+                base_chance=Decimal(item['weight_bp']) / 100
+            )
+            for character in characters for item in kit['loot_items']
+        ], batch_size=batch_size)
+
+    return characters
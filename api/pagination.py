@@ -0,0 +1,90 @@
+﻿import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering_field, id), newest first.
+
+    Pagination is only applied when one of the cursor/since/limit parameters
+    is present, so clients that expect the full list keep working.
+    """
+    ordering_field = None
+    page_size = 100
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    since_query_param = 'since'
+    page_size_query_param = 'limit'
+
+    def encode_cursor(self, obj):
+        value = f'{getattr(obj, self.ordering_field).isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value = base64.urlsafe_b64decode(cursor.encode()).decode()
+            position, pk = value.rsplit('|', 1)
+            position = parse_datetime(position)
+            if position is None:
+                raise ValueError
+            return position, int(pk)
+        except (ValueError, TypeError, UnicodeDecodeError):
+            raise ValidationError({'cursor': 'Некорректный курсор.'})
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (ValueError, TypeError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if not any(name in params for name in (self.cursor_query_param, self.since_query_param, self.page_size_query_param)):
+            return None
+
+        field = self.ordering_field
+        self.page_size_value = self.get_page_size(request)
+        self.since_mode = self.since_query_param in params
+
+        if self.since_mode:
+            position, pk = self.decode_cursor(params[self.since_query_param])
+            queryset = queryset.filter(Q(**{f'{field}__gt': position}) | Q(**{field: position, 'pk__gt': pk}))
+            queryset = queryset.order_by(field, 'pk')
+        else:
+            if self.cursor_query_param in params:
+                position, pk = self.decode_cursor(params[self.cursor_query_param])
+                queryset = queryset.filter(Q(**{f'{field}__lt': position}) | Q(**{field: position, 'pk__lt': pk}))
+            queryset = queryset.order_by(f'-{field}', '-pk')
+
+        rows = list(queryset[:self.page_size_value + 1])
+        self.has_more = len(rows) > self.page_size_value
+        self.page = rows[:self.page_size_value]
+        return self.page
+
+    def get_paginated_response(self, data):
+        next_cursor = None
+        sync_cursor = None
+        if self.page:
+            if self.since_mode:
+                sync_cursor = self.encode_cursor(self.page[-1])
+            else:
+                sync_cursor = self.encode_cursor(self.page[0])
+                if self.has_more:
+                    next_cursor = self.encode_cursor(self.page[-1])
+
+        return Response({
+            'results': data,
+            'next_cursor': next_cursor,
+            'sync_cursor': sync_cursor,
+            'has_more': self.has_more,
+        })
+
+class GoalHistoryPagination(KeysetPagination):
+    ordering_field = 'timestamp'
+
+class ReceivedRewardPagination(KeysetPagination):
+    ordering_field = 'received_date'
@@ -0,0 +1,173 @@
+﻿"""
+On-demand request profiler for staff: send `X-Profile: 1` (or `?_profile=1`)
+and the request runs under cProfile and a stack sampler. The profile is kept
+as a pstats dump plus a collapsed-stack file for flamegraph tools, in a
+directory bounded to the newest REQUEST_PROFILER_MAX_PROFILES entries.
+"""
+import cProfile
+import json
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+PROFILE_ID_RE = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+PROFILE_FILES = {'prof': 'application/octet-stream', 'collapsed': 'text/plain'}
+
+_profiler_lock = threading.Lock()
+
+def get_profile_dir():
+    return Path(settings.REQUEST_PROFILER_DIR)
+
+def list_profiles():
+    directory = get_profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+def get_profile_path(profile_id, kind):
+    if not PROFILE_ID_RE.match(profile_id) or kind not in PROFILE_FILES:
+        return None
+    path = get_profile_dir() / f'{profile_id}.{kind}'
+    return path if path.is_file() else None
+
+def prune_profiles(keep):
+    directory = get_profile_dir()
+    for meta in sorted(directory.glob('*.json'), reverse=True)[keep:]:
+        for kind in ('json', *PROFILE_FILES):
+            (directory / f'{meta.stem}.{kind}').unlink(missing_ok=True)
+
+def _frame_name(code):
+    parts = Path(code.co_filename).parts[-2:]
+    return f'{code.co_name} ({"/".join(parts)}:{code.co_firstlineno})'.replace(';', ',')
+
+class StackSampler(threading.Thread):
+    """
+    Samples the profiled thread's stack every `interval` seconds. cProfile only
+    keeps caller/callee pairs, so the collapsed stacks for flamegraphs come from here.
+    """
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(
+            f'{";".join(_frame_name(code) for code in stack)} {count}\n'
+            for stack, count in self.samples.items()
+        )
+
+def save_profile(profile, sampler, request, staff_user, user_id, response, duration):
+    directory = get_profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    created = timezone.now()
+    profile_id = f'{created:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+
+    stats = pstats.Stats(profile)
+    stats.dump_stats(directory / f'{profile_id}.prof')
+    (directory / f'{profile_id}.collapsed').write_text(sampler.collapsed(), encoding='utf-8')
+    (directory / f'{profile_id}.json').write_text(json.dumps({
+        'id': profile_id,
+        'created': created.isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 1),
+        'samples': sum(sampler.samples.values()),
+        'sample_interval_ms': sampler.interval * 1000,
+        'user_id': user_id,
+        'staff_user_id': staff_user.pk,
+    }, ensure_ascii=False), encoding='utf-8')
+
+    prune_profiles(settings.REQUEST_PROFILER_MAX_PROFILES)
+    return profile_id
+
+def get_staff_user(request):
+    """
+    (staff user, id of the user whose request it is) if the request may be
+    profiled, else None.
+
+    This middleware runs before ImpersonateMiddleware, so with a
+    django-impersonate session request.user is still the staff member here and
+    the target comes from the session. JWT impersonation (ImpersonateStartView)
+    authenticates as the target; its signed token names the impersonator, who
+    must still be staff.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return user, getattr(request, 'session', {}).get('_impersonate', user.pk)
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except APIException:
+        return None
+    if authenticated is None:
+        return None
+    user, token = authenticated
+    if user.is_staff:
+        return user, user.pk
+    staff_user = User.objects.filter(pk=token.get('impersonator_id'), is_staff=True).first()
+    return (staff_user, user.pk) if staff_user else None
+
+class RequestProfilerMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.headers.get('X-Profile') != '1' and request.GET.get('_profile') != '1':
+            return self.get_response(request)
+
+        profiling_users = get_staff_user(request)
+        # One profiled request at a time: the profiler hooks are per interpreter on newer Pythons.
+        if profiling_users is None or not _profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profile = cProfile.Profile()
+            sampler = StackSampler(threading.get_ident(), settings.REQUEST_PROFILER_SAMPLE_INTERVAL)
+            sampler.start()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.disable()
+                sampler.stop()
+            duration = time.perf_counter() - started
+        finally:
+            _profiler_lock.release()
+
+        response['X-Profile-Id'] = save_profile(profile, sampler, request, *profiling_users, response, duration)
+        return response
@@ -1,12 +1,14 @@
 ﻿from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Prefetch
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
-from .logic import recalculate_loot_chances
 from .models import *
-from .utils import get_user_current_date
+from .onboarding import onboard_users
+from .tracing import traced
+from .utils import get_completion_state
 
 class UserSearchSerializer(serializers.ModelSerializer):
     character_name = serializers.CharField(source='character.name', read_only=True, default='')
@@ -56,22 +58,8 @@ class GoalSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        
-        user = request.user
-        
-        if obj.goal_type == GoalType.DAILY:
-            tz_str = request.headers.get('X-Timezone', 'UTC')
-            user_today = get_user_current_date(user, tz_str)
-            return GoalCompletion.objects.filter(
-                goal=obj, 
-                owner=user, 
-                completion_date=user_today
-            ).exists()
-        else:
-            return GoalCompletion.objects.filter(
-                goal=obj, 
-                owner=user
-            ).exists()
+
+        return get_completion_state(request).is_completed(obj)
 
 class GoalHistorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -100,6 +88,10 @@ class SkillSerializer(serializers.ModelSerializer):
             'character': {'required': False, 'allow_null': True},
             'group': {'required': False, 'allow_null': True},
         }
+
+    @traced('SkillSerializer.to_representation')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
     
     def get_goals(self, obj):
         request = self.context.get('request')
@@ -107,10 +99,13 @@ class SkillSerializer(serializers.ModelSerializer):
             return []
         
         user = request.user
-        
-        queryset = obj.goals.filter(
-            Q(owner__isnull=True) | Q(owner=user)
-        ).distinct()
+
+        if hasattr(obj, 'visible_goals'):
+            queryset = obj.visible_goals
+        else:
+            queryset = obj.goals.filter(
+                Q(owner__isnull=True) | Q(owner=user)
+            ).distinct()
         
         return GoalSerializer(queryset, many=True, context=self.context).data
 
@@ -124,8 +119,13 @@ class CharacterSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'level', 'current_xp', 'xp_to_next_level', 
             'pity_counter', 'last_lootbox_date', 'daily_reset_time', 
-            'skills', 'achievements', 'is_staff'
+            'skills', 'achievements', 'is_staff', 'version'
         ]
+        read_only_fields = ['version']
+
+    @traced('CharacterSerializer.to_representation')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
 
     def get_skills(self, obj):
         user = obj.user
@@ -133,10 +133,24 @@ class CharacterSerializer(serializers.ModelSerializer):
         queryset = Skill.objects.filter(
             Q(character=obj) |
             Q(group__members=user)
-        ).distinct().order_by('id')
+        ).distinct().order_by('id').prefetch_related(
+            'notes',
+            'achievements',
+            Prefetch(
+                'goals',
+                queryset=Goal.objects.filter(Q(owner__isnull=True) | Q(owner=user)),
+                to_attr='visible_goals'
+            ),
+        )
 
         return SkillSerializer(queryset, many=True, context=self.context).data
 
+class CharacterStateSerializer(CharacterSerializer):
+    skills = None
+
+    class Meta(CharacterSerializer.Meta):
+        fields = [field for field in CharacterSerializer.Meta.fields if field != 'skills']
+
 class LootItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = LootItem
@@ -175,34 +189,13 @@ class RegisterSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        user = User.objects.create(
-            username=validated_data['username'],
-            email=validated_data.get('email', '')
-        )
-
-        user.set_password(validated_data['password'])
-        user.save()
-
-        character = Character.objects.create(
-            user=user, 
-            name=validated_data['character_name']
-        )
-
-        skill1 = Skill.objects.create(character=character, name='Чтение книг', unit_description='1 страницу', xp_per_unit=10)
-        Achievement.objects.create(owner_skill=skill1, required_level=10, description='Купить часы')
-
-        skill2 = Skill.objects.create(character=character, name='Езда на премиум такси', unit_description='1 поездку', xp_per_unit=20)
-        Achievement.objects.create(owner_skill=skill2, required_level=5, description='Купить дорогой парфюм')
-
-        Achievement.objects.create(owner_character=character, required_level=5, description='Начало пути')
-        Achievement.objects.create(owner_character=character, required_level=10, description='Опытный деятель')
-
-        LootItem.objects.create(owner=user, name='Лимонад', rarity=LootRarity.COMMON, base_chance='69.45')
-        LootItem.objects.create(owner=user, name='Мороженое', rarity=LootRarity.UNCOMMON, base_chance='19.65')
-        LootItem.objects.create(owner=user, name='Покупка цацки', rarity=LootRarity.RARE, base_chance='5.20')
-        LootItem.objects.create(owner=user, name='Luxury ресторан', rarity=LootRarity.UNIQUE, base_chance='4.05')
-        LootItem.objects.create(owner=user, name='Часы', rarity=LootRarity.LEGENDARY, base_chance='1.65')
-        
-        recalculate_loot_chances(user)
+        with transaction.atomic():
+            user = User(
+                username=validated_data['username'],
+                email=validated_data.get('email', '')
+            )
+            user.set_password(validated_data['password'])
+            user.save()
+            onboard_users([(user, validated_data['character_name'])])
 
         return user
@@ -0,0 +1,72 @@
+﻿from django.contrib.auth.models import User
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Character, Skill, Goal, GoalCompletion, Note, Achievement, LootItem, GoalHistory, ReceivedReward, Group, update_next_achievement_level
+from .versioning import mark_changed
+
+# User fields that appear in versioned payloads; last_login, password and the like do not.
+USER_PAYLOAD_FIELDS = ('username', 'is_staff')
+_DEFERRED = object()
+
+def _user_payload_values(instance):
+    # __dict__ so deferred fields are not loaded; a field assigned after a deferred load counts as changed.
+    return tuple(instance.__dict__.get(field, _DEFERRED) for field in USER_PAYLOAD_FIELDS)
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    instance._payload_values = _user_payload_values(instance)
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    loaded_values, instance._payload_values = instance._payload_values, _user_payload_values(instance)
+    if created:
+        return
+    if update_fields is not None:
+        changed = not update_fields.isdisjoint(USER_PAYLOAD_FIELDS)
+    else:
+        changed = loaded_values != instance._payload_values
+    if changed:
+        mark_changed(users=[instance.pk])
+
+@receiver(post_save, sender=Character)
+def character_saved(sender, instance, created, **kwargs):
+    if not created:
+        mark_changed(characters=[instance.pk])
+
+@receiver([post_save, post_delete], sender=Skill)
+def skill_changed(sender, instance, **kwargs):
+    mark_changed(characters=[instance.character_id], groups=[instance.group_id])
+
+@receiver([post_save, post_delete], sender=Goal)
+@receiver([post_save, post_delete], sender=Note)
+def skill_content_changed(sender, instance, **kwargs):
+    mark_changed(skills=[instance.skill_id])
+
+@receiver([post_save, post_delete], sender=Achievement)
+def achievement_changed(sender, instance, **kwargs):
+    if instance.owner_character_id:
+        update_next_achievement_level(Character, instance.owner_character_id)
+    if instance.owner_skill_id:
+        update_next_achievement_level(Skill, instance.owner_skill_id)
+    mark_changed(characters=[instance.owner_character_id], skills=[instance.owner_skill_id])
+
+@receiver([post_save, post_delete], sender=GoalCompletion)
+@receiver([post_save, post_delete], sender=LootItem)
+@receiver([post_save, post_delete], sender=GoalHistory)
+@receiver([post_save, post_delete], sender=ReceivedReward)
+def owned_record_changed(sender, instance, **kwargs):
+    mark_changed(users=[instance.owner_id])
+
+@receiver(m2m_changed, sender=Group.members.through)
+def group_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'pre_clear'):
+            mark_changed(users=[instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        mark_changed(users=pk_set or ())
+    elif action == 'pre_clear':
+        mark_changed(users=list(instance.members.values_list('pk', flat=True)))
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    mark_changed(users=list(instance.members.values_list('pk', flat=True)))
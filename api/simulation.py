@@ -0,0 +1,179 @@
+﻿"""
+Monte Carlo simulation of lootbox sessions with NumPy-vectorized draws.
+
+Each session starts with the given pity counter and opens the loot pool up to
+`opens` times; all sessions of a chunk are rolled in lockstep. The draw rules
+mirror api.logic.LootSampler, and like a real opening the won item leaves the
+session's pool and the remaining weights are renormalized the way
+recalculate_loot_chances does it. A session whose pool runs out stops early.
+This module avoids importing Django at the top level so chunks can run in
+spawned worker processes.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+CHUNK_SESSIONS = 100_000
+
+def _renormalize(weights, remaining, weight_total):
+    """
+    recalculate_loot_chances for every row: the remaining weights are scaled to
+    weight_total by the largest remainder method (all-zero pools split evenly).
+    """
+    item_count = weights.shape[1]
+    weights = np.where(remaining, weights, 0)
+    weights = np.where(weights.any(axis=1, keepdims=True), weights, remaining.astype(weights.dtype))
+    shares, remainders = np.divmod(weights * weight_total, np.maximum(weights.sum(axis=1, keepdims=True), 1))
+    missing = np.where(remaining.any(axis=1, keepdims=True), weight_total - shares.sum(axis=1, keepdims=True), 0)
+    # Largest remainder first, the lower index on ties, as heapq.nlargest over (remainder, -index).
+    order = np.argsort(-(remainders * item_count + (item_count - 1 - np.arange(item_count))), axis=1)
+    np.put_along_axis(shares, order, np.take_along_axis(shares, order, axis=1) + (np.arange(item_count) < missing), axis=1)
+    return shares
+
+def _simulate_chunk(weights_bp, non_common, resets, rarity_index, rarity_count, pity_bonus_bp, weight_total, sessions, opens, start_pity, seed):
+    rng = np.random.default_rng(seed)
+    item_count = len(weights_bp)
+    # weight * weight_total stays below 2**31: int32 halves the memory traffic of every step.
+    weights = np.tile(weights_bp.astype(np.int32), (sessions, 1))
+    remaining = np.ones((sessions, item_count), dtype=bool)
+
+    pity = np.full(sessions, start_pity, dtype=np.int64)
+    # Sparse: a session's pity is near 0 or near start_pity, never in between.
+    pity_counts = {}
+    item_hits = np.zeros(item_count, dtype=np.int64)
+    first_open = np.zeros((rarity_count, sessions), dtype=np.int32)
+
+    for step in range(1, opens + 1):
+        index = np.flatnonzero(remaining.any(axis=1))
+        if not len(index):
+            break
+        available = remaining[index]
+        pity_now = pity[index]
+        for value, count in zip(*np.unique(pity_now, return_counts=True)):
+            pity_counts[int(value)] = pity_counts.get(int(value), 0) + int(count)
+
+        # Weights are multiplied by the number of non-common items left so the pity bonus share stays whole.
+        bonus_items = available & non_common
+        scale = np.maximum(bonus_items.sum(axis=1), 1)
+        cumulative = np.cumsum(weights[index] * scale[:, None] + bonus_items * (pity_now * pity_bonus_bp)[:, None], axis=1)
+        totals = cumulative[:, -1]
+        rolls = rng.random(len(index)) * totals
+        # bisect_right; removed items have zero width and are stepped over.
+        won = (cumulative <= rolls[:, None]).sum(axis=1)
+        won = np.minimum(won, item_count - 1 - np.argmax(available[:, ::-1], axis=1))
+        empty_pool = totals <= 0
+        if empty_pool.any():
+            picks = rng.integers(available[empty_pool].sum(axis=1))
+            won[empty_pool] = np.argmax(np.cumsum(available[empty_pool], axis=1) > picks[:, None], axis=1)
+
+        item_hits += np.bincount(won, minlength=item_count)
+        won_rarity = rarity_index[won]
+        first_time = first_open[won_rarity, index] == 0
+        first_open[won_rarity[first_time], index[first_time]] = step
+        pity[index] = np.where(resets[won] & ~empty_pool, 0, pity_now + 1)
+
+        remaining[index, won] = False
+        weights[index] = _renormalize(weights[index], remaining[index], weight_total)
+
+    first_open_histograms = np.stack([np.bincount(row, minlength=opens + 1) for row in first_open])
+    emptied = int((~remaining.any(axis=1)).sum())
+    return item_hits, pity_counts, first_open_histograms, emptied
+
+def _percentile(histogram, share, offset=0):
+    total = histogram.sum()
+    if not total:
+        return None
+    return int(np.searchsorted(np.cumsum(histogram), share * total) + offset)
+
+def simulate_pool(pool, sessions, opens, start_pity=0, seed=None, workers=1):
+    """
+    pool: list of (name, rarity, weight_bp, is_common, resets_pity) tuples.
+    Returns a JSON-serializable report.
+    """
+    from .logic import PITY_BONUS_BP
+    from .models import LOOT_WEIGHT_TOTAL
+
+    started = time.perf_counter()
+    rarities = list(dict.fromkeys(rarity for _, rarity, *_ in pool))
+    weights_bp = np.array([weight_bp for _, _, weight_bp, _, _ in pool], dtype=np.int64)
+    non_common = np.array([not is_common for *_, is_common, _ in pool], dtype=bool)
+    resets = np.array([resets_pity for *_, resets_pity in pool], dtype=bool)
+    rarity_index = np.array([rarities.index(rarity) for _, rarity, *_ in pool], dtype=np.int64)
+
+    chunk_sizes = [CHUNK_SESSIONS] * (sessions // CHUNK_SESSIONS)
+    if sessions % CHUNK_SESSIONS:
+        chunk_sizes.append(sessions % CHUNK_SESSIONS)
+    # Chunk seeds do not depend on the number of workers, so results are reproducible.
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    chunk_args = [
+        (weights_bp, non_common, resets, rarity_index, len(rarities), PITY_BONUS_BP, LOOT_WEIGHT_TOTAL, size, opens, start_pity, chunk_seed)
+        for size, chunk_seed in zip(chunk_sizes, seeds)
+    ]
+
+    if workers > 1 and len(chunk_args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*chunk_args)))
+    else:
+        results = [_simulate_chunk(*args) for args in chunk_args]
+
+    item_hits = sum(result[0] for result in results)
+    pity_counts = {}
+    for result in results:
+        for value, count in result[1].items():
+            pity_counts[value] = pity_counts.get(value, 0) + count
+    # Sized from the values reached, not from start_pity.
+    pity_histogram = np.zeros(max(pity_counts, default=0) + 1, dtype=np.int64)
+    for value, count in pity_counts.items():
+        pity_histogram[value] = count
+    first_open_histograms = sum(result[2] for result in results)
+    emptied = sum(result[3] for result in results)
+    total_opens = int(item_hits.sum())
+
+    opens_until = {}
+    for rarity, histogram in zip(rarities, first_open_histograms):
+        appeared = histogram[1:]
+        appeared_count = int(appeared.sum())
+        opens_until[rarity] = {
+            'appeared_share': appeared_count / sessions if sessions else 0.0,
+            'mean': float((appeared * np.arange(1, opens + 1)).sum() / appeared_count) if appeared_count else None,
+            'p50': _percentile(appeared, 0.5, offset=1),
+            'p90': _percentile(appeared, 0.9, offset=1),
+        }
+
+    pity_values = np.arange(len(pity_histogram))
+    pity_total = pity_histogram.sum()
+    last_seen = int(np.nonzero(pity_histogram)[0].max()) if pity_total else 0
+
+    return {
+        'sessions': sessions,
+        'opens_per_session': opens,
+        'start_pity': start_pity,
+        'seed': seed,
+        # Won items are not returned to the pool: sessions may end before `opens`.
+        'total_opens': total_opens,
+        'pool_emptied_share': emptied / sessions if sessions else 0.0,
+        'items': [
+            {'name': name, 'rarity': rarity, 'weight_bp': int(weight_bp), 'hit_rate': int(hits) / total_opens if total_opens else 0.0}
+            for (name, rarity, weight_bp, _, _), hits in zip(pool, item_hits)
+        ],
+        'opens_until_first': opens_until,
+        'pity': {
+            'mean': float((pity_histogram * pity_values).sum() / pity_total) if pity_total else 0.0,
+            'p50': _percentile(pity_histogram, 0.5),
+            'p90': _percentile(pity_histogram, 0.9),
+            'p99': _percentile(pity_histogram, 0.99),
+            'max': last_seen,
+            'distribution': [int(count) / pity_total for count in pity_histogram[:last_seen + 1]] if pity_total else [],
+        },
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
+
+def simulate_lootbox(items, sessions, opens, start_pity=0, seed=None, workers=1):
+    from .logic import PITY_RESET_RARITIES
+    from .models import LootRarity
+
+    pool = [
+        (item.name, item.rarity, item.weight_bp, item.rarity == LootRarity.COMMON, item.rarity in PITY_RESET_RARITIES)
+        for item in items
+    ]
+    return simulate_pool(pool, sessions, opens, start_pity=start_pity, seed=seed, workers=workers)
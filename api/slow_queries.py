@@ -0,0 +1,159 @@
+﻿"""
+Slow-query log: every query slower than SLOW_QUERY_THRESHOLD_MS is written to
+a rotating JSONL file with its SQL, parameters, route and the application frame
+that issued it. The plan of each distinct query shape is captured once per
+process with EXPLAIN (EXPLAIN ANALYZE for SELECTs if SLOW_QUERY_EXPLAIN_ANALYZE)
+after the response, outside every execute wrapper, so it is not counted as one
+of the request's queries by the timing, metrics or tracing wrappers.
+"""
+import hashlib
+import json
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.utils import timezone
+from . import instrumentation, tracing
+from .instrumentation import close_jsonl_logger, get_jsonl_logger, get_route
+
+MAX_PARAM_LENGTH = 200
+MAX_EXPLAINED_SHAPES = 10000
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST_RE = re.compile(r'%s(?:\s*,\s*%s)+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# ANALYZE executes the query: a locking SELECT would take its row locks again.
+_LOCKING_RE = re.compile(r'\sFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b', re.IGNORECASE)
+
+# Execute wrappers sit between the ORM and the database; they are never the caller.
+WRAPPER_FILES = {__file__, instrumentation.__file__, tracing.__file__}
+
+LOGGER_NAME = 'api.slow_queries.file'
+
+_explained_shapes = set()
+
+def get_query_shape(sql):
+    """
+    SQL with literals and placeholder lists collapsed, so `id IN (%s, %s)` and
+    `id IN (%s, %s, %s)` are one shape.
+    """
+    shape = _LITERAL_RE.sub('?', sql)
+    shape = _PLACEHOLDER_LIST_RE.sub('%s...', shape)
+    return _WHITESPACE_RE.sub(' ', shape).strip()
+
+def get_fingerprint(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()[:16]
+
+def reset_slow_query_log():
+    close_jsonl_logger(LOGGER_NAME)
+    _explained_shapes.clear()
+
+def write_entry(entry):
+    get_jsonl_logger(
+        LOGGER_NAME, settings.SLOW_QUERY_LOG, settings.SLOW_QUERY_LOG_MAX_BYTES, settings.SLOW_QUERY_LOG_BACKUPS
+    ).info(json.dumps(entry, ensure_ascii=False, default=str))
+
+def _format_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _format_params(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_format_params(value) for value in params]
+    if isinstance(params, (int, float, bool)):
+        return params
+    return str(params)[:MAX_PARAM_LENGTH]
+
+def get_caller_frame():
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if frame.filename.startswith(base_dir) and frame.filename not in WRAPPER_FILES and 'site-packages' not in frame.filename:
+            return {'file': str(Path(frame.filename).relative_to(base_dir)), 'line': frame.lineno, 'function': frame.name, 'code': frame.line}
+    return None
+
+@contextmanager
+def _without_execute_wrappers():
+    wrappers, connection.execute_wrappers = connection.execute_wrappers, []
+    try:
+        yield
+    finally:
+        connection.execute_wrappers = wrappers
+
+def explain(sql, params):
+    options = {}
+    if settings.SLOW_QUERY_EXPLAIN_ANALYZE and sql.lstrip()[:6].upper() == 'SELECT' and not _LOCKING_RE.search(sql):
+        options['analyze'] = True
+    try:
+        try:
+            prefix = connection.ops.explain_query_prefix(**options)
+        except ValueError:
+            prefix = connection.ops.explain_query_prefix()
+        # The savepoint keeps a failed EXPLAIN from breaking an enclosing transaction.
+        with _without_execute_wrappers(), transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            rows = cursor.fetchall()
+    except (DatabaseError, NotSupportedError) as exc:
+        return {'error': str(exc)}
+    return {'prefix': prefix, 'rows': [list(row) if len(row) > 1 else row[0] for row in rows]}
+
+class SlowQueryRecorder:
+    def __init__(self, request, threshold_ms):
+        self.request = request
+        self.threshold = threshold_ms / 1000
+        self.pending_plans = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        # Failed queries are not recorded: EXPLAIN would run in an aborted transaction.
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            self.record(sql, params, many, duration)
+        return result
+
+    def record(self, sql, params, many, duration):
+        shape = get_query_shape(sql)
+        fingerprint = get_fingerprint(shape)
+        write_entry({
+            'type': 'query',
+            'timestamp': timezone.now().isoformat(),
+            'fingerprint': fingerprint,
+            'duration_ms': round(duration * 1000, 2),
+            'sql': sql,
+            'params': None if many else _format_params(params),
+            'many': many,
+            'route': get_route(self.request),
+            'method': self.request.method,
+            'path': self.request.path,
+            'frame': get_caller_frame(),
+        })
+
+        if many or fingerprint in _explained_shapes or len(_explained_shapes) >= MAX_EXPLAINED_SHAPES:
+            return
+        _explained_shapes.add(fingerprint)
+        self.pending_plans.append((fingerprint, shape, sql, params))
+
+    def explain_pending(self):
+        for fingerprint, shape, sql, params in self.pending_plans:
+            plan = explain(sql, params)
+            write_entry({'type': 'plan', 'timestamp': timezone.now().isoformat(), 'fingerprint': fingerprint, 'vendor': connection.vendor, 'shape': shape, **plan})
+        self.pending_plans = []
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'SLOW_QUERY_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = SlowQueryRecorder(request, settings.SLOW_QUERY_THRESHOLD_MS)
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        # Placed before the tracing, timing and metrics middleware, so the plans
+        # are captured after their measurements of the request are complete.
+        recorder.explain_pending()
+        return response
@@ -4,11 +4,50 @@ from django.utils import timezone
 from django.db.models import Sum, Q
 from decimal import Decimal
 from datetime import date
-from rest_framework.test import APITestCase
+import threading
+from io import StringIO
+from django.core.management import call_command
+from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from freezegun import freeze_time
-from .models import Character, Skill, Goal, GoalType, GoalCompletion, LootItem, LootRarity, Achievement
+from unittest.mock import patch
+from django.db import connection
+from django.test import TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from .models import Character, Skill, Goal, GoalType, GoalCompletion, LootItem, LootRarity, Achievement, Group, Note, GoalHistory, GoalHistoryAction, ReceivedReward, CHARACTER_XP_CURVE, SKILL_XP_CURVE
+from .serializers import SkillSerializer
 from .utils import get_user_current_date
+from .views import LootboxAPIView, claim_achievements
+from .logic import apply_xp, update_xp_row_steps
+from .onboarding import available_starter_kits, load_starter_kit, onboard_users
+
+class FreshUserAPIClient(APIClient):
+    """
+    force_authenticate передает во все запросы один и тот же объект пользователя,
+    и request.user.character переживает запросы. Как и при настоящей аутентификации,
+    каждый запрос получает свой экземпляр без закешированных связей (без запроса к БД).
+    """
+    def request(self, **kwargs):
+        user = self.handler._force_user
+        if user is not None:
+            fields = [field.attname for field in User._meta.concrete_fields]
+            self.handler._force_user = User.from_db(user._state.db, fields, [getattr(user, field) for field in fields])
+        return super().request(**kwargs)
+
+def concurrent_xp_before_update(skill, amount):
+    """
+    Патч для update_xp_row_steps в api.views: перед первой записью пакета
+    "параллельный" запрос начисляет amount опыта навыку skill и его персонажу.
+    """
+    done = False
+
+    def concurrent_then_update(instance, amounts):
+        nonlocal done
+        if not done:
+            done = True
+            apply_xp(Skill.objects.get(pk=skill.pk), Character.objects.get(pk=skill.character_id), amount)
+        return update_xp_row_steps(instance, amounts)
+    return patch('api.views.update_xp_row_steps', side_effect=concurrent_then_update)
 
 class APITests(APITestCase):
     def setUp(self):
@@ -190,3 +229,573 @@ class APITests(APITestCase):
         
         # Убедимся, что невыполненный дейлик отмечен как False
         self.assertFalse(goals_map[self.daily_goal3.id]['is_completed'], "Невыполненная цель должна быть is_completed=False")
+
+
+class CharacterSnapshotQueryTests(APITestCase):
+    """
+    Проверяем, что GET /api/character/ выполняет фиксированное число запросов
+    независимо от количества навыков, целей, заметок и достижений.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='snapshot_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Снапшот')
+        self.group_owner = User.objects.create_user(username='snapshot_owner', password='password')
+        self.group = Group.objects.create(name='Снапшот группа', owner=self.group_owner)
+        self.group.members.add(self.user)
+        self.url = reverse('character-detail')
+
+    def _populate(self, skills_count):
+        for i in range(skills_count):
+            skill = Skill.objects.create(character=self.character, name=f'Навык {i}')
+            daily = Goal.objects.create(skill=skill, owner=self.user, description=f'Дейлик {i}', goal_type=GoalType.DAILY)
+            long_term = Goal.objects.create(skill=skill, owner=self.user, description=f'Цель {i}', goal_type=GoalType.RED)
+            Goal.objects.create(skill=skill, owner=self.group_owner, description=f'Чужая цель {i}')
+            Note.objects.create(skill=skill, text=f'Заметка {i}')
+            Achievement.objects.create(owner_skill=skill, required_level=5, description=f'Награда {i}')
+            GoalCompletion.objects.create(goal=daily, owner=self.user, completion_date=date(2024, 5, 21))
+            GoalCompletion.objects.create(goal=long_term, owner=self.user, completion_date=date(2024, 1, 1))
+
+            group_skill = Skill.objects.create(group=self.group, name=f'Групповой навык {i}')
+            Goal.objects.create(skill=group_skill, description=f'Общая цель {i}')
+
+    @freeze_time("2024-05-21 12:00:00")
+    def test_query_count_does_not_depend_on_data_size(self):
+        self.client.force_authenticate(user=self.user)
+        total = 0
+        for skills_count in (1, 10, 40):
+            self._populate(skills_count - total)
+            total = skills_count
+            self.user.refresh_from_db()
+            with self.assertNumQueries(7):
+                response = self.client.get(self.url, HTTP_X_TIMEZONE='UTC')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['skills']), skills_count * 2)
+
+    @freeze_time("2024-05-21 12:00:00")
+    def test_snapshot_matches_per_skill_serialization(self):
+        self._populate(3)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url, HTTP_X_TIMEZONE='UTC')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        request = response.wsgi_request
+        for skill_data in response.data['skills']:
+            skill = Skill.objects.get(pk=skill_data['id'])
+            expected = SkillSerializer(skill, context={'request': request}).data
+            self.assertEqual(skill_data, expected)
+
+        completed = [goal['id'] for skill in response.data['skills'] for goal in skill['goals'] if goal['is_completed']]
+        self.assertEqual(len(completed), 6)
+        self.assertFalse(any(goal['owner'] == self.group_owner.id for skill in response.data['skills'] for goal in skill['goals']))
+
+
+class DeltaResponseTests(APITestCase):
+    """
+    Проверяем режим ответа "delta" у мутирующих эндпоинтов.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='delta_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Дельта')
+        self.skill = Skill.objects.create(character=self.character, name='Навык')
+        self.other_skill = Skill.objects.create(character=self.character, name='Другой навык')
+        self.goal = Goal.objects.create(skill=self.skill, owner=self.user, description='Дейлик', goal_type=GoalType.DAILY, xp_reward=25)
+        self.client.force_authenticate(user=self.user)
+        self.delta = {'HTTP_X_RESPONSE_MODE': 'delta'}
+
+    def test_toggle_complete_returns_only_changed_parts(self):
+        initial_version = Character.objects.get(pk=self.character.pk).version
+        url = reverse('goal-toggle-complete', kwargs={'pk': self.goal.id})
+        response = self.client.post(url, **self.delta)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], initial_version + 1)
+        self.assertNotIn('skills', response.data['character'])
+        self.assertEqual(response.data['character']['current_xp'], 25)
+        self.assertEqual([skill['id'] for skill in response.data['skills']], [self.skill.id])
+        self.assertEqual(len(response.data['goals']), 1)
+        self.assertTrue(response.data['goals'][0]['is_completed'])
+
+    def test_version_increases_monotonically(self):
+        versions = []
+        url = reverse('goal-toggle-complete', kwargs={'pk': self.goal.id})
+        for _ in range(3):
+            versions.append(self.client.post(url, **self.delta).data['version'])
+        versions.append(self.client.post(reverse('skill-add-progress', kwargs={'pk': self.skill.id}), {'units': 1}, **self.delta).data['version'])
+        self.assertEqual(versions, sorted(set(versions)))
+
+        full = self.client.get(reverse('character-detail'))
+        self.assertEqual(full.data['version'], versions[-1])
+
+    def test_query_parameter_selects_delta_mode(self):
+        url = reverse('skill-detail', kwargs={'pk': self.other_skill.id}) + '?response_mode=delta'
+        response = self.client.delete(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['removed_skill_ids'], [self.other_skill.id])
+        self.assertEqual(response.data['skills'], [])
+
+    def test_full_response_is_default(self):
+        url = reverse('goal-toggle-complete', kwargs={'pk': self.goal.id})
+        response = self.client.post(url)
+        self.assertIn('skills', response.data['character'])
+        self.assertNotIn('version', response.data)
+
+    def test_stale_character_save_does_not_roll_back_version(self):
+        stale = Character.objects.get(pk=self.character.pk)
+        Note.objects.create(skill=self.skill, text='Новая заметка')
+        expected_version = Character.objects.get(pk=self.character.pk).version
+        stale.name = 'Новое имя'
+        stale.save()
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.version, expected_version + 1)
+        self.assertEqual(self.character.name, 'Новое имя')
+
+    def test_only_payload_user_fields_bump_version(self):
+        def version():
+            return Character.objects.get(pk=self.character.pk).version
+
+        initial_version = version()
+        user = User.objects.get(pk=self.user.pk)
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        user.set_password('другой пароль')
+        user.save()
+        self.assertTrue(self.client.login(username='delta_user', password='другой пароль'))
+        self.assertEqual(version(), initial_version)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(version(), initial_version + 1)
+        user.username = 'delta_renamed'
+        user.save(update_fields=['username'])
+        self.assertEqual(version(), initial_version + 2)
+
+
+class CharacterETagTests(APITestCase):
+    """
+    Проверяем ETag / If-None-Match для эндпоинтов, которые опрашивает фронтенд.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='etag_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='ETag')
+        self.skill = Skill.objects.create(character=self.character, name='Навык')
+        self.goal = Goal.objects.create(skill=self.skill, owner=self.user, description='Дейлик', goal_type=GoalType.DAILY)
+        LootItem.objects.create(owner=self.user, name='Награда', rarity=LootRarity.COMMON, base_chance='100.00')
+        self.client.force_authenticate(user=self.user)
+        self.urls = [reverse('character-detail'), reverse('lootbox-api'), reverse('goalhistory-list')]
+
+    def _etags(self):
+        return [self.client.get(url)['ETag'] for url in self.urls]
+
+    def test_matching_etag_returns_not_modified_without_serialization(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+
+    def test_writes_change_etag(self):
+        before = self._etags()
+        self.client.post(reverse('goal-toggle-complete', kwargs={'pk': self.goal.id}))
+        after_toggle = self._etags()
+        self.assertTrue(all(a != b for a, b in zip(before, after_toggle)))
+
+        Note.objects.create(skill=self.skill, text='Заметка')
+        after_note = self._etags()
+        self.assertTrue(all(a != b for a, b in zip(after_toggle, after_note)))
+
+        LootItem.objects.create(owner=self.user, name='Еще награда', rarity=LootRarity.RARE, base_chance='10.00')
+        self.assertTrue(all(a != b for a, b in zip(after_note, self._etags())))
+
+    def test_group_skill_change_changes_member_etag(self):
+        owner = User.objects.create_user(username='etag_owner', password='password')
+        group = Group.objects.create(name='ETag группа', owner=owner)
+        before = self.client.get(self.urls[0])['ETag']
+        group.members.add(self.user)
+        after_join = self.client.get(self.urls[0])['ETag']
+        self.assertNotEqual(before, after_join)
+
+        Skill.objects.create(group=group, name='Групповой навык')
+        self.assertNotEqual(after_join, self.client.get(self.urls[0])['ETag'])
+
+    def test_etag_changes_when_game_day_rolls_over(self):
+        with freeze_time("2024-05-21 02:00:00"):
+            before_reset = self.client.get(self.urls[0], HTTP_X_TIMEZONE='UTC')['ETag']
+        with freeze_time("2024-05-21 04:00:00"):
+            after_reset = self.client.get(self.urls[0], HTTP_X_TIMEZONE='UTC')['ETag']
+        self.assertNotEqual(before_reset, after_reset)
+
+
+class SingleItemQueryTests(APITestCase):
+    """
+    Фиксируем число запросов у add_progress и toggle_complete.
+    """
+    client_class = FreshUserAPIClient
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='single_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Один')
+        self.skill = Skill.objects.create(character=self.character, name='Навык', xp_per_unit=10)
+        self.goal = Goal.objects.create(skill=self.skill, owner=self.user, description='Дейлик', goal_type=GoalType.DAILY, xp_reward=25)
+        self.client.force_authenticate(user=self.user)
+
+    def test_add_progress_query_count(self):
+        url = reverse('skill-add-progress', kwargs={'pk': self.skill.id})
+        # Навык, персонаж, две записи опыта, история и версия (UPDATE ... RETURNING, без
+        # перечитывания); остальное — сериализация ответа.
+        with self.assertNumQueries(11):
+            response = self.client.post(url + '?response_mode=delta', {'units': 1})
+        self.assertEqual(response.data['version'], Character.objects.get(pk=self.character.pk).version)
+        with self.assertNumQueries(15):
+            response = self.client.post(url, {'units': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_toggle_complete_query_count(self):
+        url = reverse('goal-toggle-complete', kwargs={'pk': self.goal.id})
+        # Цель, навык, персонаж под блокировкой, отметка, две записи опыта, история, версия
+        # и точки сохранения транзакции.
+        for expected in (20, 20):
+            with self.assertNumQueries(expected):
+                response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Character.objects.get(pk=self.character.pk).current_xp, 0)
+
+
+class BulkProgressTests(APITestCase):
+    """
+    Проверяем пакетное добавление прогресса по нескольким навыкам.
+    """
+    client_class = FreshUserAPIClient
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulk_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Пакет')
+        self.reading = Skill.objects.create(character=self.character, name='Чтение', xp_per_unit=30)
+        self.running = Skill.objects.create(character=self.character, name='Бег', xp_per_unit=45)
+        Achievement.objects.create(owner_skill=self.reading, required_level=2, description='Книга')
+        Achievement.objects.create(owner_character=self.character, required_level=2, description='Старт')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('skill-bulk-progress')
+
+    def test_bulk_progress_matches_sequential_calls(self):
+        entries = [{'skill': self.reading.id, 'units': 3}, {'skill': self.running.id, 'units': 2}, {'skill': self.reading.id, 'units': 2}]
+        response = self.client.post(self.url, {'entries': entries}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        expected_character = Character(level=1, current_xp=0, xp_to_next_level=100)
+        expected_reading = Skill(level=1, current_xp=0, xp_to_next_level=100)
+        expected_running = Skill(level=1, current_xp=0, xp_to_next_level=100)
+        for skill, xp in ((expected_reading, 90), (expected_running, 90), (expected_reading, 60)):
+            skill.add_xp(xp)
+            expected_character.add_xp(xp)
+
+        self.character.refresh_from_db()
+        self.reading.refresh_from_db()
+        self.running.refresh_from_db()
+        self.assertEqual((self.character.level, self.character.current_xp), (expected_character.level, expected_character.current_xp))
+        self.assertEqual((self.reading.level, self.reading.current_xp), (expected_reading.level, expected_reading.current_xp))
+        self.assertEqual((self.running.level, self.running.current_xp), (expected_running.level, expected_running.current_xp))
+
+        self.assertEqual(GoalHistory.objects.filter(owner=self.user).count(), 3)
+        self.assertEqual(len(response.data['new_rewards']), 2)
+        self.assertEqual(len(response.data['skills']), 2)
+
+    def test_invalid_entry_rejects_whole_batch(self):
+        other_user = User.objects.create_user(username='bulk_other', password='password')
+        other_skill = Skill.objects.create(character=Character.objects.create(user=other_user, name='Чужой'), name='Чужой навык')
+
+        response = self.client.post(self.url, {'entries': [{'skill': self.reading.id, 'units': 1}, {'skill': other_skill.id, 'units': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(self.url, {'entries': [{'skill': self.reading.id, 'units': 0}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.reading.refresh_from_db()
+        self.assertEqual(self.reading.current_xp, 0)
+        self.assertFalse(GoalHistory.objects.filter(owner=self.user).exists())
+
+    def test_query_count_does_not_grow_with_entries(self):
+        Achievement.objects.all().delete()
+        counts = []
+        for size in (2, 20):
+            entries = [{'skill': self.running.id, 'units': 3}] * size
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.url + '?response_mode=delta', {'entries': entries}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_concurrent_add_progress_is_not_overwritten(self):
+        """
+        add_progress не берет блокировку строк: если он успел записать опыт
+        между чтением строк и записью пакета, пакет пересчитывается от свежих данных.
+        """
+        with concurrent_xp_before_update(self.reading, 70):
+            response = self.client.post(self.url, {'entries': [{'skill': self.reading.id, 'units': 3}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.character.refresh_from_db()
+        self.reading.refresh_from_db()
+        self.assertEqual(SKILL_XP_CURVE.cumulative(self.reading.level) + self.reading.current_xp, 160)
+        self.assertEqual(CHARACTER_XP_CURVE.cumulative(self.character.level) + self.character.current_xp, 160)
+
+
+class BulkToggleTests(APITestCase):
+    """
+    Проверяем пакетное выполнение и отмену целей.
+    """
+    client_class = FreshUserAPIClient
+
+    def _make_user(self, username):
+        user = User.objects.create_user(username=username, password='password')
+        character = Character.objects.create(user=user, name=username)
+        reading = Skill.objects.create(character=character, name='Чтение')
+        running = Skill.objects.create(character=character, name='Бег')
+        Achievement.objects.create(owner_skill=reading, required_level=2, description='Книга')
+        Achievement.objects.create(owner_character=character, required_level=2, description='Старт')
+        goals = [
+            Goal.objects.create(skill=reading, description='Страница', goal_type=GoalType.DAILY, xp_reward=60),
+            Goal.objects.create(skill=reading, description='Глава', goal_type=GoalType.RED, xp_reward=50),
+            Goal.objects.create(skill=running, description='Пробежка', goal_type=GoalType.DAILY, xp_reward=70),
+            Goal.objects.create(skill=running, description='Марафон', goal_type=GoalType.BLUE, xp_reward=40),
+        ]
+        return user, goals
+
+    def _snapshot(self, user):
+        character = Character.objects.get(user=user)
+        skills = sorted((s.name, s.level, s.current_xp, s.xp_to_next_level) for s in Skill.objects.filter(character=character))
+        history = list(GoalHistory.objects.filter(owner=user).order_by('id').values_list('goal_description', 'action', 'xp_amount'))
+        completions = sorted(GoalCompletion.objects.filter(owner=user).values_list('goal__description', flat=True))
+        rewards = ReceivedReward.objects.filter(owner=user).count()
+        return (character.level, character.current_xp), skills, history, completions, rewards
+
+    def test_bulk_toggle_matches_sequential_toggles(self):
+        sequential_user, sequential_goals = self._make_user('sequential')
+        bulk_user, bulk_goals = self._make_user('bulk')
+        order = [0, 2, 1, 0, 3, 0, 2]
+
+        self.client.force_authenticate(user=sequential_user)
+        for index in order:
+            response = self.client.post(reverse('goal-toggle-complete', kwargs={'pk': sequential_goals[index].id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=bulk_user)
+        response = self.client.post(reverse('goal-bulk-toggle'), {'goal_ids': [bulk_goals[index].id for index in order]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['skills']), 2)
+
+        self.assertEqual(self._snapshot(sequential_user), self._snapshot(bulk_user))
+
+    def test_concurrent_add_progress_is_not_overwritten(self):
+        user, goals = self._make_user('concurrent')
+        self.client.force_authenticate(user=user)
+        reading = goals[0].skill
+
+        with concurrent_xp_before_update(reading, 30):
+            response = self.client.post(reverse('goal-bulk-toggle'), {'goal_ids': [goals[0].id, goals[1].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        reading.refresh_from_db()
+        character = Character.objects.get(user=user)
+        self.assertEqual(SKILL_XP_CURVE.cumulative(reading.level) + reading.current_xp, 140)
+        self.assertEqual(CHARACTER_XP_CURVE.cumulative(character.level) + character.current_xp, 140)
+
+    def test_complete_and_uncomplete_modes_skip_goals_in_target_state(self):
+        user, goals = self._make_user('modes')
+        self.client.force_authenticate(user=user)
+        url = reverse('goal-bulk-toggle')
+        goal_ids = [goal.id for goal in goals]
+
+        self.client.post(url, {'goal_ids': goal_ids[:2], 'mode': 'complete'}, format='json')
+        response = self.client.post(url, {'goal_ids': goal_ids, 'mode': 'complete'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(GoalCompletion.objects.filter(owner=user).count(), 4)
+        self.assertEqual(GoalHistory.objects.filter(owner=user, action=GoalHistoryAction.COMPLETED).count(), 4)
+
+        self.client.post(url, {'goal_ids': goal_ids, 'mode': 'uncomplete'}, format='json')
+        self.assertFalse(GoalCompletion.objects.filter(owner=user).exists())
+        self.assertEqual(GoalHistory.objects.filter(owner=user, action=GoalHistoryAction.REVERTED).count(), 4)
+
+    def test_invalid_request_changes_nothing(self):
+        user, goals = self._make_user('invalid')
+        self.client.force_authenticate(user=user)
+        _, foreign_goals = self._make_user('foreign')
+        url = reverse('goal-bulk-toggle')
+
+        response = self.client.post(url, {'goal_ids': [goals[0].id, foreign_goals[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(url, {'goal_ids': [goals[0].id], 'mode': 'flip'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {'goal_ids': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertFalse(GoalCompletion.objects.filter(owner=user).exists())
+        self.assertFalse(GoalHistory.objects.filter(owner=user).exists())
+
+
+class AchievementThresholdTests(APITestCase):
+    """
+    Порог ближайшего невыполненного достижения хранится у персонажа и навыка.
+    """
+    client_class = FreshUserAPIClient
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='threshold_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Порог')
+        self.skill = Skill.objects.create(character=self.character, name='Навык')
+        for level in (3, 5, 8, 20):
+            Achievement.objects.create(owner_character=self.character, required_level=level, description=f'Персонаж {level}')
+            Achievement.objects.create(owner_skill=self.skill, required_level=level, description=f'Навык {level}')
+        self.character.refresh_from_db()
+        self.skill.refresh_from_db()
+
+    def test_signals_keep_threshold_in_sync(self):
+        self.assertEqual(self.character.next_achievement_level, 3)
+        self.assertEqual(self.skill.next_achievement_level, 3)
+
+        Achievement.objects.filter(owner_character=self.character, required_level=3).get().delete()
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.next_achievement_level, 5)
+
+    def test_check_without_crossed_threshold_runs_no_queries(self):
+        # Пороги берутся из уже загруженных строк персонажа и навыка.
+        with self.assertNumQueries(0):
+            self.assertEqual(claim_achievements(self.character, [self.skill]), [])
+
+    def test_request_sees_threshold_of_new_achievement(self):
+        """
+        Достижение, добавленное после загрузки пользователя, учитывается следующим
+        запросом: персонаж читается заново в каждом запросе.
+        """
+        self.client.force_authenticate(user=self.user)
+        self.client.get(reverse('character-detail'))
+        Achievement.objects.create(owner_character=self.character, required_level=2, description='Персонаж 2')
+
+        response = self.client.post(reverse('skill-add-progress', kwargs={'pk': self.skill.id}), {'units': 10})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([reward['description'] for reward in response.data['new_rewards']], ['Ур. 2: Персонаж 2'])
+
+    def test_big_grant_claims_all_crossed_levels_in_bulk(self):
+        self.character.level = 10
+        self.skill.level = 9
+
+        # Выборка и обновление порога на владельца, затем bulk_update, bulk_create и версия.
+        with self.assertNumQueries(7):
+            rewards = claim_achievements(self.character, [self.skill])
+
+        self.assertEqual(len(rewards), 6)
+        self.assertEqual(ReceivedReward.objects.filter(owner=self.user).count(), 6)
+        self.assertEqual(Achievement.objects.filter(claimed_date__isnull=False).count(), 6)
+        self.character.refresh_from_db()
+        self.skill.refresh_from_db()
+        self.assertEqual((self.character.next_achievement_level, self.skill.next_achievement_level), (20, 20))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(claim_achievements(self.character, [self.skill]), [])
+
+
+class OnboardingTests(APITestCase):
+    """
+    Стартовый набор применяется пакетно и не требует пересчета шансов.
+    """
+    def test_registration_costs_fixed_number_of_queries(self):
+        data = {'username': 'kit_user', 'password': 'StrongPassword123!', 'password2': 'StrongPassword123!', 'character_name': 'Новичок'}
+        # Проверка уникальности логина, пользователь, персонаж, навыки, достижения, предметы
+        # и точки сохранения транзакций.
+        with self.assertNumQueries(10):
+            response = self.client.post(reverse('register'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        user = User.objects.get(username='kit_user')
+        self.assertTrue(user.check_password('StrongPassword123!'))
+        self.assertEqual(user.character.next_achievement_level, 5)
+        self.assertEqual(
+            sorted(Skill.objects.filter(character__user=user).values_list('name', 'next_achievement_level')),
+            [('Езда на премиум такси', 5), ('Чтение книг', 10)]
+        )
+        items = LootItem.objects.filter(owner=user)
+        self.assertEqual(sum(item.weight_bp for item in items), 10000)
+        self.assertEqual(sum(item.base_chance for item in items), Decimal('100.00'))
+
+    def test_starter_kit_chances_are_normalized(self):
+        for kit_name in available_starter_kits():
+            kit = load_starter_kit(kit_name)
+            if kit['loot_items']:
+                self.assertEqual(sum(item['weight_bp'] for item in kit['loot_items']), 10000, kit_name)
+
+    def test_many_accounts_share_the_same_bulk_inserts(self):
+        users = [User.objects.create_user(username=f'kit_{k}') for k in range(20)]
+        with self.assertNumQueries(6):
+            characters = onboard_users([(user, f'Герой {k}') for k, user in enumerate(users)])
+        self.assertEqual(len(characters), 20)
+        self.assertEqual(Skill.objects.filter(character__in=characters).count(), 40)
+        self.assertEqual(Achievement.objects.filter(Q(owner_character__in=characters) | Q(owner_skill__character__in=characters)).count(), 80)
+
+    def test_create_test_user_uses_e2e_kit(self):
+        call_command('create_test_user', 'e2e_user_1', stdout=StringIO())
+        user = User.objects.get(username='e2e_user_1')
+        self.assertEqual(list(Skill.objects.filter(character__user=user).values_list('name', flat=True)), ['Тестирование E2E'])
+        self.assertEqual(sorted(LootItem.objects.filter(owner=user).values_list('weight_bp', flat=True)), [1000, 2000, 7000])
+
+
+class LootboxConcurrencyTests(TransactionTestCase):
+    """
+    Параллельные открытия лутбокса в один игровой день: успешно только одно.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='race_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Гонщик')
+        skill = Skill.objects.create(character=self.character, name='Навык')
+        today = get_user_current_date(self.user, 'UTC')
+        for k in range(3):
+            goal = Goal.objects.create(skill=skill, description=f'Дейлик {k}', goal_type=GoalType.DAILY, xp_reward=10)
+            GoalCompletion.objects.create(goal=goal, owner=self.user, completion_date=today)
+        for k in range(5):
+            LootItem.objects.create(owner=self.user, name=f'Награда {k}', rarity=LootRarity.COMMON, base_chance='20.00')
+
+    def _post(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        return client.post(reverse('lootbox-api'), HTTP_X_TIMEZONE='UTC').status_code
+
+    def _assert_single_open(self, results):
+        self.assertEqual(results.count(status.HTTP_200_OK), 1, results)
+        self.assertEqual(ReceivedReward.objects.filter(owner=self.user, source_name='Лутбокс').count(), 1)
+        self.assertEqual(LootItem.objects.filter(owner=self.user, received_date__isnull=False).count(), 1)
+        self.assertEqual(sum(LootItem.objects.filter(owner=self.user, received_date__isnull=True).values_list('weight_bp', flat=True)), 10000)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_parallel_opens_succeed_once_per_day(self):
+        thread_count = 6
+        barrier = threading.Barrier(thread_count)
+        results = []
+
+        def open_lootbox():
+            try:
+                barrier.wait()
+                results.append(self._post())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=open_lootbox) for _ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self._assert_single_open(results)
+
+    def test_stale_status_check_cannot_open_twice(self):
+        """
+        Оба запроса прошли проверку статуса до фиксации первого (как при гонке),
+        но условное обновление даты пропускает только одно открытие.
+        """
+        stale_status = {'completed_dailies': 3, 'required_dailies': 3, 'can_open': True, 'is_opened_today': False}
+        with patch.object(LootboxAPIView, 'get_status', return_value=stale_status):
+            results = [self._post(), self._post()]
+
+        self.assertEqual(results[1], status.HTTP_400_BAD_REQUEST)
+        self._assert_single_open(results)
@@ -0,0 +1,102 @@
+﻿from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from freezegun import freeze_time
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .cache import BoundedLocMemCache, payload_cache
+from .models import Character, Skill, Goal, GoalType, Note
+
+PAYLOAD_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'payloads': {
+        'BACKEND': 'api.cache.BoundedLocMemCache',
+        'LOCATION': 'tests-payloads',
+        'OPTIONS': {'MAX_ENTRIES': 100, 'MAX_BYTES': 1024 * 1024},
+    },
+}
+
+class BoundedLocMemCacheTests(TestCase):
+    """
+    Тесты для BoundedLocMemCache: вытеснение по LRU при превышении лимита памяти.
+    """
+    def setUp(self):
+        self.cache = BoundedLocMemCache('tests-bounded', {'OPTIONS': {'MAX_ENTRIES': 100, 'MAX_BYTES': 3000}})
+        self.cache.clear()
+
+    def test_evicts_least_recently_used_over_byte_limit(self):
+        self.cache.set('a', 'x' * 1000)
+        self.cache.set('b', 'x' * 1000)
+        self.cache.get('a')
+        self.cache.set('c', 'x' * 1000)
+
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertLessEqual(self.cache.total_bytes, 3000)
+
+    def test_oversized_value_is_not_stored(self):
+        self.cache.set('big', 'x' * 5000)
+        self.assertIsNone(self.cache.get('big'))
+        self.assertEqual(self.cache.total_bytes, 0)
+
+@override_settings(CACHES=PAYLOAD_CACHES, PAYLOAD_CACHE_ALIAS='payloads')
+class PayloadCacheTests(APITestCase):
+    """
+    Проверяем кэширование отрендеренных данных персонажа и навыков.
+    """
+    def setUp(self):
+        caches['payloads'].clear()
+        payload_cache.reset_stats()
+        self.user = User.objects.create_user(username='cache_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Кэш')
+        self.skill = Skill.objects.create(character=self.character, name='Навык')
+        Goal.objects.create(skill=self.skill, owner=self.user, description='Дейлик', goal_type=GoalType.DAILY)
+
+    def _get(self, url, **extra):
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        return self.client.get(url, **extra)
+
+    def test_character_payload_is_served_from_cache_until_version_changes(self):
+        url = reverse('character-detail')
+        first = self._get(url)
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(payload_cache.stats()['hits'], 1)
+
+        Note.objects.create(skill=self.skill, text='Новая заметка')
+        third = self._get(url)
+        self.assertEqual(third.data['skills'][0]['notes'][0]['text'], 'Новая заметка')
+        self.assertEqual(payload_cache.stats()['misses'], 2)
+
+    def test_game_day_and_timezone_are_part_of_the_key(self):
+        url = reverse('character-detail')
+        with freeze_time("2024-05-21 02:00:00"):
+            self._get(url, HTTP_X_TIMEZONE='UTC')
+            self._get(url, HTTP_X_TIMEZONE='Europe/Moscow')
+        with freeze_time("2024-05-21 04:00:00"):
+            self._get(url, HTTP_X_TIMEZONE='UTC')
+        self.assertEqual(payload_cache.stats()['hits'], 0)
+        self.assertEqual(payload_cache.stats()['misses'], 3)
+
+    def test_skill_payload_is_cached(self):
+        url = reverse('skill-detail', kwargs={'pk': self.skill.id})
+        first = self._get(url)
+        second = self._get(url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(payload_cache.stats()['hits'], 1)
+
+    def test_stats_endpoint_is_admin_only(self):
+        url = reverse('cache-stats')
+        response = self._get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_user(username='cache_admin', password='password', is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_rate', response.data)
+        self.assertIn('bytes', response.data)
@@ -0,0 +1,168 @@
+﻿import csv
+import json
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from .models import Character, Skill, LootItem, GoalCompletion, GoalHistory
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportUsersCommandTests(TestCase):
+    """
+    Тесты команды import_users.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        User.objects.create_user(username='taken')
+
+    def _write_csv(self, rows):
+        path = os.path.join(self.directory.name, 'users.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as source:
+            writer = csv.writer(source)
+            writer.writerow(['username', 'password', 'character_name', 'email'])
+            writer.writerows(rows)
+        return path
+
+    def _run(self, path, *args):
+        call_command('import_users', path, '--workers', '1', *args, stdout=StringIO())
+
+    def test_import_creates_accounts_and_reports_bad_rows(self):
+        path = self._write_csv([
+            ['alice', 'secret-1', 'Алиса', 'alice@example.com'],
+            ['bob', 'secret-2', 'Боб', ''],
+            ['alice', 'secret-3', 'Дубль', ''],
+            ['taken', 'secret-4', 'Занято', ''],
+            ['bad name!', 'secret-5', 'Плохое имя', ''],
+            ['carol', '', 'Без пароля', ''],
+        ])
+        self._run(path, '--chunk-size', '4')
+
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password('secret-1'))
+        self.assertEqual(alice.email, 'alice@example.com')
+        self.assertEqual(Character.objects.get(user=alice).name, 'Алиса')
+        self.assertEqual(Skill.objects.filter(character__user__username='bob').count(), 2)
+        self.assertEqual(sum(LootItem.objects.filter(owner=alice).values_list('weight_bp', flat=True)), 10000)
+
+        with open(f'{path}.import-errors.csv', encoding='utf-8') as report:
+            rejected = [(row['row'], row['username']) for row in csv.DictReader(report)]
+        self.assertEqual(rejected, [('3', 'alice'), ('4', 'taken'), ('5', 'bad name!'), ('6', 'carol')])
+
+        with open(f'{path}.import-state.json', encoding='utf-8') as state:
+            self.assertEqual(json.load(state), {'rows_done': 6, 'created': 2, 'errors': 4})
+
+    def test_import_resumes_after_saved_progress(self):
+        path = self._write_csv([[f'user_{k}', 'secret', f'Герой {k}', ''] for k in range(5)])
+        with open(f'{path}.import-state.json', 'w', encoding='utf-8') as state:
+            json.dump({'rows_done': 3, 'created': 3, 'errors': 0}, state)
+
+        self._run(path, '--chunk-size', '2')
+
+        self.assertEqual(sorted(User.objects.filter(username__startswith='user_').values_list('username', flat=True)), ['user_3', 'user_4'])
+        with open(f'{path}.import-state.json', encoding='utf-8') as state:
+            self.assertEqual(json.load(state)['created'], 5)
+
+    def test_import_reads_jsonl(self):
+        path = os.path.join(self.directory.name, 'users.jsonl')
+        with open(path, 'w', encoding='utf-8') as source:
+            source.write(json.dumps({'username': 'dave', 'password': 'secret', 'character_name': 'Дейв'}) + '\n')
+            source.write('{broken\n')
+
+        self._run(path, '--kit', 'e2e')
+
+        self.assertEqual(list(Skill.objects.filter(character__user__username='dave').values_list('name', flat=True)), ['Тестирование E2E'])
+        with open(f'{path}.import-errors.csv', encoding='utf-8') as report:
+            self.assertEqual(len(list(csv.DictReader(report))), 1)
+
+
+class SeedLoadDataCommandTests(TestCase):
+    """
+    Тесты генератора нагрузочных данных.
+    """
+    def _seed(self, prefix, *args):
+        call_command(
+            'seed_load_data', '--users', '3', '--prefix', prefix, '--history-days', '30',
+            '--end-date', '2025-01-31', '--chunk-users', '2', *args, stdout=StringIO()
+        )
+        users = User.objects.filter(username__startswith=f'{prefix}_').order_by('username')
+        return [
+            (
+                user.character.level,
+                user.character.current_xp,
+                sorted(Skill.objects.filter(character__user=user).values_list('name', 'level', 'current_xp')),
+                list(GoalCompletion.objects.filter(owner=user).order_by('completion_date', 'goal__description', 'goal__skill__name').values_list('completion_date', flat=True)),
+                list(LootItem.objects.filter(owner=user).order_by('name').values_list('rarity', 'weight_bp')),
+            )
+            for user in users
+        ]
+
+    def test_same_seed_gives_same_dataset(self):
+        first = self._seed('seed_a', '--seed', '7')
+        second = self._seed('seed_b', '--seed', '7')
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, self._seed('seed_c', '--seed', '8'))
+
+    def test_generated_data_is_consistent(self):
+        self._seed('seed_d')
+        users = User.objects.filter(username__startswith='seed_d_')
+        self.assertEqual(users.count(), 3)
+        self.assertTrue(users[0].check_password('password123'))
+        self.assertEqual(len(set(users.values_list('password', flat=True))), 1)
+        for user in users:
+            available = LootItem.objects.filter(owner=user, received_date__isnull=True)
+            if available.exists():
+                self.assertEqual(sum(available.values_list('weight_bp', flat=True)), 10000)
+        self.assertTrue(GoalHistory.objects.filter(owner__in=users, timestamp__date__lte=date(2025, 1, 31)).exists())
+        self.assertFalse(GoalCompletion.objects.filter(owner__in=users, completion_date__gt=date(2025, 1, 31)).exists())
+
+        with self.assertRaises(CommandError):
+            self._seed('seed_d')
+        self._seed('seed_d', '--replace')
+        self.assertEqual(User.objects.filter(username__startswith='seed_d_').count(), 3)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchEndpointsCommandTests(TestCase):
+    """
+    Тесты бенчмарка эндпоинтов.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.output = os.path.join(self.directory.name, 'run.json')
+
+    def _bench(self, *args):
+        call_command(
+            'bench_endpoints', '--users', '1', '--history-days', '10', '--iterations', '2', '--warmup', '0',
+            '--output', self.output, *args, stdout=StringIO()
+        )
+        with open(self.output, encoding='utf-8') as result:
+            return json.load(result)
+
+    def test_reports_every_route_and_rolls_back(self):
+        report = self._bench()
+        routes = report['routes']
+        for name in ('character', 'skills.list', 'goals.toggle-complete', 'lootbox.status', 'users.list'):
+            self.assertIn(name, routes)
+        for result in routes.values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['bytes'], 0)
+        self.assertEqual(routes['character']['status'], [200])
+        self.assertFalse(User.objects.filter(username__startswith='bench_ep_').exists())
+
+    def test_regression_against_baseline_fails(self):
+        baseline = self._bench('--routes', 'character')
+        for result in baseline['routes'].values():
+            result['queries'] = 0
+        baseline_path = os.path.join(self.directory.name, 'baseline.json')
+        with open(baseline_path, 'w', encoding='utf-8') as target:
+            json.dump(baseline, target)
+
+        with self.assertRaises(CommandError):
+            self._bench('--routes', 'character', '--compare', baseline_path, '--threshold', '1000000')
+        self._bench('--routes', 'character', '--compare', baseline_path, '--threshold', '1000000', '--query-threshold', '1000')
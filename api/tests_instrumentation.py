@@ -0,0 +1,43 @@
+﻿import json
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import Character, Skill
+
+class RequestTimingMiddlewareTests(APITestCase):
+    """
+    Тесты для RequestTimingMiddleware: заголовки Server-Timing и журнал превышений бюджета.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='timing_user', password='password')
+        character = Character.objects.create(user=self.user, name='Хронометрист')
+        Skill.objects.create(character=character, name='Скорость')
+        self.client.force_authenticate(user=self.user)
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('character-detail'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_QUERY_BUDGET=100, REQUEST_TIMING_LATENCY_BUDGET_MS=60000)
+    def test_reports_server_timing(self):
+        with self.assertNoLogs('api.timing'):
+            response = self.client.get(reverse('character-detail'))
+
+        metrics = {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(metrics), {'total', 'db', 'view', 'render'})
+        self.assertRegex(metrics['db'], r'^db;dur=\d+\.\d;desc="[1-9]\d* queries"$')
+
+    @override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_QUERY_BUDGET=0, REQUEST_TIMING_LATENCY_BUDGET_MS=60000)
+    def test_logs_requests_over_budget(self):
+        with self.assertLogs('api.timing', level='WARNING') as logs:
+            self.client.get(reverse('skill-list'))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'skill-list')
+        self.assertEqual(record['method'], 'GET')
+        self.assertEqual(record['over_budget'], ['queries'])
+        self.assertGreater(record['queries'], 0)
+        self.assertIn('view_ms', record)
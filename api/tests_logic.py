@@ -1,9 +1,10 @@
-﻿from django.test import TestCase
+﻿import random
+from django.test import TestCase
 from django.contrib.auth.models import User
 from decimal import Decimal
 from unittest.mock import patch
-from .models import User, LootItem, LootRarity
-from .logic import recalculate_loot_chances, get_weighted_random_award
+from .models import User, LootItem, LootRarity, Character, Skill, CHARACTER_XP_CURVE, SKILL_XP_CURVE
+from .logic import recalculate_loot_chances, get_weighted_random_award, LootSampler, apply_xp, update_xp_row
 
 class LogicTests(TestCase):
     """
@@ -95,6 +96,41 @@ class LogicTests(TestCase):
 
         self.assertEqual(total_chance, Decimal('100.00'))
 
+    def test_recalculate_totals_stay_exact_for_random_pools(self):
+        """
+        Проверяем на случайных наборах, что после пересчета сумма весов равна
+        ровно 10000 б.п., а сумма шансов - ровно 100.00%.
+        """
+        rng = random.Random(11)
+        for _ in range(40):
+            LootItem.objects.filter(owner=self.user).delete()
+            items = [
+                LootItem.objects.create(owner=self.user, name=f'Item {k}', rarity=LootRarity.COMMON, base_chance=Decimal(rng.randint(0, 9999)) / 100)
+                for k in range(rng.randint(1, 12))
+            ]
+            fixed_item = rng.choice(items + [None])
+            new_chance = Decimal(rng.randint(0, 10000)) / 100 if fixed_item else Decimal('0.0')
+
+            recalculate_loot_chances(self.user, fixed_item=fixed_item, new_chance_for_fixed=new_chance)
+
+            stored = list(LootItem.objects.filter(owner=self.user))
+            self.assertEqual(sum(item.weight_bp for item in stored), 10000)
+            self.assertEqual(sum(item.base_chance for item in stored), Decimal('100.00'))
+            for item in stored:
+                self.assertEqual(item.base_chance * 100, item.weight_bp)
+            if fixed_item and len(items) > 1:
+                self.assertEqual(LootItem.objects.get(pk=fixed_item.pk).base_chance, new_chance)
+
+    def test_recalculate_writes_all_items_in_one_query(self):
+        """
+        Проверяем, что пересчет читает и сохраняет предметы фиксированным числом запросов.
+        """
+        for k in range(10):
+            LootItem.objects.create(owner=self.user, name=f'Item {k}', rarity=LootRarity.COMMON, base_chance=Decimal('7.00'))
+        # Чтение, один bulk_update и увеличение версии персонажа.
+        with self.assertNumQueries(3):
+            recalculate_loot_chances(self.user)
+
     # --- Тесты для get_weighted_random_award ---
 
     def test_get_award_empty_list_returns_none(self):
@@ -155,3 +191,95 @@ class LogicTests(TestCase):
         mock_uniform.return_value = 75.0
         won_item, _ = get_weighted_random_award(available_items, pity_counter=0)
         self.assertEqual(won_item.name, 'B')
+
+    def _expected_probabilities(self, items, pity_counter):
+        # Формула распределения из исходной реализации на Decimal.
+        non_common = [item for item in items if item.rarity != LootRarity.COMMON]
+        bonus = pity_counter * Decimal('0.005') / len(non_common) * 100 if non_common else Decimal('0')
+        chances = [item.base_chance + (bonus if item.rarity != LootRarity.COMMON else 0) for item in items]
+        total = sum(chances)
+        return [float(chance / total) for chance in chances]
+
+    def test_sampler_matches_pity_adjusted_distribution(self):
+        """
+        Хи-квадрат: частоты выпадений семплера совпадают с распределением
+        с учетом жалости (df=3, критическое значение 16.27 при p=0.001).
+        """
+        items = [
+            LootItem.objects.create(owner=self.user, name='Common', rarity=LootRarity.COMMON, base_chance=Decimal('69.45')),
+            LootItem.objects.create(owner=self.user, name='Uncommon', rarity=LootRarity.UNCOMMON, base_chance=Decimal('19.65')),
+            LootItem.objects.create(owner=self.user, name='Rare', rarity=LootRarity.RARE, base_chance=Decimal('9.25')),
+            LootItem.objects.create(owner=self.user, name='Legendary', rarity=LootRarity.LEGENDARY, base_chance=Decimal('1.65')),
+        ]
+        draws = 60000
+        for pity_counter in (0, 7, 40):
+            sampler = LootSampler(items, pity_counter)
+            rng = random.Random(pity_counter)
+            counts = {item.pk: 0 for item in items}
+            for _ in range(draws):
+                counts[sampler.draw(rng).pk] += 1
+
+            expected = self._expected_probabilities(items, pity_counter)
+            chi_square = sum((counts[item.pk] - p * draws) ** 2 / (p * draws) for item, p in zip(items, expected))
+            self.assertLess(chi_square, 16.27, (pity_counter, counts))
+
+    def test_award_is_reproducible_with_seeded_rng(self):
+        """
+        Проверяем, что с одинаковым seed последовательность наград повторяется.
+        """
+        items = [
+            LootItem.objects.create(owner=self.user, name='Common', rarity=LootRarity.COMMON, base_chance=Decimal('80.00')),
+            LootItem.objects.create(owner=self.user, name='Rare', rarity=LootRarity.RARE, base_chance=Decimal('20.00')),
+        ]
+
+        def roll_sequence(seed):
+            rng = random.Random(seed)
+            pity_counter = 0
+            names = []
+            for _ in range(50):
+                won_item, pity_counter = get_weighted_random_award(items, pity_counter, rng=rng)
+                names.append(won_item.name)
+            return names
+
+        self.assertEqual(roll_sequence(5), roll_sequence(5))
+
+
+class ApplyXPTests(TestCase):
+    """
+    Тесты начисления опыта через условное обновление (compare-and-swap).
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='xp_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Опыт')
+        self.skill = Skill.objects.create(character=self.character, name='Навык')
+
+    def test_stale_copies_do_not_lose_updates(self):
+        """
+        Две копии, загруженные до изменений (как в двух параллельных запросах),
+        обе начисляют опыт: второе начисление пересчитывается от свежих данных.
+        """
+        first_skill, second_skill = Skill.objects.get(pk=self.skill.pk), Skill.objects.get(pk=self.skill.pk)
+        first_character, second_character = Character.objects.get(pk=self.character.pk), Character.objects.get(pk=self.character.pk)
+
+        apply_xp(first_skill, first_character, 150)
+        self.assertEqual(update_xp_row(second_skill, 150)[1], 2)
+        self.assertEqual(update_xp_row(second_character, 150)[1], 2)
+
+        self.skill.refresh_from_db()
+        self.character.refresh_from_db()
+        self.assertEqual(SKILL_XP_CURVE.cumulative(self.skill.level) + self.skill.current_xp, 300)
+        self.assertEqual(CHARACTER_XP_CURVE.cumulative(self.character.level) + self.character.current_xp, 300)
+        self.assertEqual((second_skill.level, second_skill.current_xp), (self.skill.level, self.skill.current_xp))
+
+    def test_only_xp_fields_are_written(self):
+        """
+        Начисление опыта не перезаписывает другие поля персонажа.
+        """
+        stale_character = Character.objects.get(pk=self.character.pk)
+        Character.objects.filter(pk=self.character.pk).update(name='Новое имя')
+
+        apply_xp(self.skill, stale_character, 40)
+
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.name, 'Новое имя')
+        self.assertEqual(self.character.current_xp, 40)
@@ -0,0 +1,116 @@
+﻿import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from unittest import skipIf
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .metrics import REGISTRY, ARCHIVE_FILE, fcntl
+from .models import Achievement, Character, Skill, Goal, GoalType, LootItem, LootRarity
+
+def parse_metrics(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+class MetricsTests(APITestCase):
+    """
+    Тесты метрик: гистограммы запросов, счетчики SQL и доменных событий, сложение по процессам.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(METRICS_ENABLED=True, METRICS_DIR=self.directory.name, METRICS_TOKEN='secret')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Сбрасываем накопленное процессом: следующее обновление начнет новый файл.
+        REGISTRY.pid = None
+
+        self.user = User.objects.create_user(username='metrics_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Метролог')
+        self.skill = Skill.objects.create(character=self.character, name='Измерения')
+        self.goal = Goal.objects.create(skill=self.skill, description='Большая цель', goal_type=GoalType.YELLOW, xp_reward=150)
+        Achievement.objects.create(owner_character=self.character, required_level=2, description='Второй уровень')
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+
+    def _scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return parse_metrics(response.content.decode())
+
+    def test_request_and_domain_metrics(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('goal-toggle-complete', kwargs={'pk': self.goal.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        samples = self._scrape()
+        labels = '{view="GoalViewSet",action="toggle_complete"}'
+        self.assertEqual(samples[f'rpg_http_request_duration_seconds_count{labels}'], 1)
+        self.assertEqual(samples['rpg_http_request_duration_seconds_bucket{view="GoalViewSet",action="toggle_complete",le="+Inf"}'], 1)
+        self.assertEqual(samples['rpg_http_requests_total{view="GoalViewSet",action="toggle_complete",status="200"}'], 1)
+        self.assertGreater(samples[f'rpg_db_queries_total{labels}'], 0)
+        self.assertEqual(samples[f'rpg_goals_completed_total{{goal_type="{GoalType.YELLOW}"}}'], 1)
+        self.assertEqual(samples['rpg_xp_granted_total{source="goal"}'], 150)
+        self.assertEqual(samples['rpg_achievements_claimed_total{owner="character"}'], 1)
+        self.assertFalse(any('MetricsView' in name for name in samples))
+
+    def test_lootbox_and_rolled_back_changes(self):
+        LootItem.objects.create(owner=self.user, name='Сундук', rarity=LootRarity.RARE, base_chance='100.00')
+        for i in range(3):
+            Goal.objects.create(skill=self.skill, description=f'Дейлик {i}', goal_type=GoalType.DAILY, xp_reward=10)
+        daily_ids = list(Goal.objects.filter(goal_type=GoalType.DAILY).values_list('id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('goal-bulk-toggle'), {'goal_ids': daily_ids}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('lootbox-api'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        samples = self._scrape()
+        self.assertEqual(samples[f'rpg_goals_completed_total{{goal_type="{GoalType.DAILY}"}}'], 3)
+        self.assertEqual(samples['rpg_xp_granted_total{source="goal"}'], 30)
+        self.assertEqual(samples[f'rpg_lootboxes_opened_total{{rarity="{LootRarity.RARE}"}}'], 1)
+
+    def test_aggregates_files_of_all_processes(self):
+        self.client.get(reverse('character-detail'))
+        labels = '{view="CharacterView",action="get"}'
+        # Файл другого (живого) воркера gunicorn.
+        with open(os.path.join(self.directory.name, f'{os.getppid()}-0000abcd.json'), 'w', encoding='utf-8') as other:
+            json.dump({
+                'rpg_http_request_duration_seconds': [[['CharacterView', 'get'], [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2, 40.0]]],
+                'rpg_db_queries_total': [[['CharacterView', 'get'], 5]],
+                'rpg_unknown_total': [[[], 1]],
+            }, other)
+
+        samples = self._scrape()
+        own_queries = samples[f'rpg_db_queries_total{labels}'] - 5
+        self.assertGreater(own_queries, 0)
+        self.assertEqual(samples[f'rpg_http_request_duration_seconds_count{labels}'], 3)
+        self.assertGreaterEqual(samples[f'rpg_http_request_duration_seconds_sum{labels}'], 40.0)
+        self.assertFalse(any(name.startswith('rpg_unknown') for name in samples))
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if re.match(r'^\d+-[0-9a-f]{8}\.json$', name)]), 2)
+
+    @skipIf(fcntl is None, 'файлы остановленных воркеров сворачиваются только на POSIX')
+    def test_stopped_process_files_are_archived(self):
+        stopped = subprocess.Popen([sys.executable, '-c', 'pass'])
+        stopped.wait()
+        with open(os.path.join(self.directory.name, f'{stopped.pid}-0000abcd.json'), 'w', encoding='utf-8') as other:
+            json.dump({'rpg_xp_granted_total': [[['goal'], 70]]}, other)
+
+        for _ in range(2):
+            self.assertEqual(self._scrape()['rpg_xp_granted_total{source="goal"}'], 70)
+        self.assertEqual(sorted(name for name in os.listdir(self.directory.name) if name.endswith('.json')), [ARCHIVE_FILE])
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
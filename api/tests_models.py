@@ -1,6 +1,7 @@
-﻿from django.test import TestCase
+﻿import random
+from django.test import TestCase, SimpleTestCase
 from django.contrib.auth.models import User
-from .models import Character, Skill
+from .models import Character, Skill, CHARACTER_XP_CURVE, SKILL_XP_CURVE
 
 class ModelXPTests(TestCase):
     """
@@ -243,3 +244,39 @@ class ModelXPTests(TestCase):
         self.assertFalse(leveled_up)
         self.assertEqual(self.skill.level, 1, "Уровень навыка не должен быть ниже 1.")
         self.assertEqual(self.skill.current_xp, 0, "Опыт навыка должен сброситься в 0.")
+
+
+class XPCurveEquivalenceTests(SimpleTestCase):
+    """
+    Свойство: расчет уровня через таблицу накопленного опыта дает тот же
+    результат, что и пошаговый цикл, для любых состояний и приращений.
+    """
+    def _check_curve(self, curve, seed):
+        rng = random.Random(seed)
+        for _ in range(3000):
+            level = rng.randint(1, 60)
+            xp_to_next_level = curve.xp_for_level(level)
+            if rng.random() < 0.1:
+                # Рассинхронизированная планка, как у старых записей.
+                xp_to_next_level = rng.randint(1, 5000)
+            current_xp = rng.randint(0, max(0, xp_to_next_level - 1))
+            amount = rng.choice([
+                rng.randint(-50, 50),
+                rng.randint(-20000, 20000),
+                rng.randint(-2000000, 2000000),
+                0,
+            ])
+            state = (level, current_xp, xp_to_next_level, amount)
+            self.assertEqual(curve.apply(*state), curve.apply_stepwise(*state), state)
+
+    def test_character_curve_matches_stepwise(self):
+        self._check_curve(CHARACTER_XP_CURVE, seed=1)
+
+    def test_skill_curve_matches_stepwise(self):
+        self._check_curve(SKILL_XP_CURVE, seed=2)
+
+    def test_round_trip_restores_state(self):
+        for curve in (CHARACTER_XP_CURVE, SKILL_XP_CURVE):
+            level, current_xp, xp_to_next_level, _ = curve.apply(1, 0, 100, 1234567)
+            self.assertGreater(level, 1)
+            self.assertEqual(curve.apply(level, current_xp, xp_to_next_level, -1234567)[:3], (1, 0, 100))
@@ -0,0 +1,91 @@
+﻿from datetime import timedelta
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import GoalHistory, GoalHistoryAction, ReceivedReward
+
+class KeysetPaginationTests(APITestCase):
+    """
+    Тесты курсорной (keyset) пагинации истории целей и наград.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='pagination_user', password='password')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('goalhistory-list')
+        self.base_time = timezone.now() - timedelta(days=1)
+        # Половина записей с одинаковым временем, чтобы проверить разрешение "ничьих" по id.
+        for i in range(25):
+            self._history(self.base_time + timedelta(minutes=i // 2), skill_id=1 if i % 2 else 2)
+
+    def _history(self, timestamp, skill_id=1):
+        return GoalHistory.objects.create(
+            owner=self.user, goal_description='Цель', skill_name='Навык', skill_id=skill_id,
+            xp_amount=10, action=GoalHistoryAction.COMPLETED, timestamp=timestamp
+        )
+
+    def _walk(self, params):
+        ids = []
+        cursor = None
+        while True:
+            query = dict(params)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get(self.url, query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(row['id'] for row in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_without_parameters_returns_full_list(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 25)
+
+    def test_pages_cover_all_rows_in_order_without_duplicates(self):
+        ids = self._walk({'limit': 10})
+        expected = list(
+            GoalHistory.objects.filter(owner=self.user).order_by('-timestamp', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_concurrent_inserts_do_not_shift_pages(self):
+        expected = list(
+            GoalHistory.objects.filter(owner=self.user).order_by('-timestamp', '-id').values_list('id', flat=True)
+        )
+        first = self.client.get(self.url, {'limit': 10}).data
+        self._history(timezone.now())
+        second = self.client.get(self.url, {'limit': 10, 'cursor': first['next_cursor']}).data
+
+        self.assertEqual([row['id'] for row in first['results']], expected[:10])
+        self.assertEqual([row['id'] for row in second['results']], expected[10:20])
+
+    def test_since_returns_only_newer_rows(self):
+        sync_cursor = self.client.get(self.url, {'limit': 5}).data['sync_cursor']
+        newer = [self._history(timezone.now()).id, self._history(timezone.now()).id]
+
+        response = self.client.get(self.url, {'since': sync_cursor})
+        self.assertEqual([row['id'] for row in response.data['results']], newer)
+
+        response = self.client.get(self.url, {'since': response.data['sync_cursor']})
+        self.assertEqual(response.data['results'], [])
+
+    def test_skill_filter_is_kept(self):
+        ids = self._walk({'limit': 4, 'skill_id': 1})
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(set(GoalHistory.objects.filter(id__in=ids).values_list('skill_id', flat=True)), {1})
+
+    def test_invalid_cursor_returns_bad_request(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rewards_history_is_paginated(self):
+        for i in range(7):
+            ReceivedReward.objects.create(owner=self.user, description=f'Награда {i}', source_name='Тест')
+        url = reverse('rewardhistory-list')
+        first = self.client.get(url, {'limit': 5}).data
+        second = self.client.get(url, {'limit': 5, 'cursor': first['next_cursor']}).data
+        self.assertEqual(len(first['results']), 5)
+        self.assertEqual(len(second['results']), 2)
+        self.assertFalse(second['has_more'])
@@ -0,0 +1,120 @@
+﻿import os
+import pstats
+import tempfile
+import threading
+import time
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import Character, Skill
+from .profiling import StackSampler
+
+class RequestProfilerTests(APITestCase):
+    """
+    Тесты профилировщика запросов: доступен только персоналу, профили хранятся с ограничением.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(REQUEST_PROFILER_ENABLED=True, REQUEST_PROFILER_DIR=self.directory.name, REQUEST_PROFILER_MAX_PROFILES=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.admin = User.objects.create_user(username='profiler_admin', password='password', is_staff=True)
+        self.user = User.objects.create_user(username='profiler_user', password='password')
+        for user in (self.admin, self.user):
+            character = Character.objects.create(user=user, name=f'Герой {user.username}')
+            Skill.objects.create(character=character, name='Профилирование')
+
+    def _get_character(self, token, **extra):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.client.get(reverse('character-detail'), **extra)
+
+    def test_staff_request_is_profiled(self):
+        response = self._get_character(AccessToken.for_user(self.admin), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+
+        stats = pstats.Stats(os.path.join(self.directory.name, f'{profile_id}.prof'))
+        self.assertTrue(any(name == 'get_skills' for _, _, name in stats.stats))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name, f'{profile_id}.collapsed')))
+
+        profiles = self.client.get(reverse('profile-list')).json()
+        self.assertEqual(profiles[0]['id'], profile_id)
+        self.assertEqual(profiles[0]['path'], reverse('character-detail'))
+
+        download = self.client.get(reverse('profile-download', kwargs={'profile_id': profile_id, 'kind': 'prof'}))
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        self.assertTrue(b''.join(download.streaming_content))
+        missing = self.client.get(reverse('profile-download', kwargs={'profile_id': '..', 'kind': 'prof'}))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_regular_user_and_untoggled_requests_are_not_profiled(self):
+        response = self._get_character(AccessToken.for_user(self.user), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+
+        response = self._get_character(AccessToken.for_user(self.admin))
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.client.get(reverse('profile-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_impersonated_request_is_profiled_while_impersonator_is_staff(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin)}')
+        tokens = self.client.post(reverse('impersonate-start'), {'user_id': self.user.pk}, format='json').json()
+
+        response = self._get_character(tokens['access'], QUERY_STRING='_profile=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], f'Герой {self.user.username}')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin)}')
+        [profile] = self.client.get(reverse('profile-list')).json()
+        self.assertEqual(profile['id'], response['X-Profile-Id'])
+        self.assertEqual((profile['user_id'], profile['staff_user_id']), (self.user.pk, self.admin.pk))
+
+        # Права проверяются по БД на каждый запрос, а не только при выдаче токена.
+        User.objects.filter(pk=self.admin.pk).update(is_staff=False)
+        response = self._get_character(tokens['access'], QUERY_STRING='_profile=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_profile_store_is_bounded(self):
+        token = AccessToken.for_user(self.admin)
+        profile_ids = [self._get_character(token, QUERY_STRING='_profile=1')['X-Profile-Id'] for _ in range(3)]
+
+        profiles = self.client.get(reverse('profile-list')).json()
+        self.assertEqual([profile['id'] for profile in profiles], sorted(profile_ids, reverse=True)[:2])
+        self.assertEqual((profiles[0]['user_id'], profiles[0]['staff_user_id']), (self.admin.pk, self.admin.pk))
+        self.assertEqual(len(os.listdir(self.directory.name)), 6)
+
+    @override_settings(REQUEST_PROFILER_ENABLED=False)
+    def test_disabled_profiler_ignores_toggle(self):
+        response = self._get_character(AccessToken.for_user(self.admin), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+
+
+class StackSamplerTests(SimpleTestCase):
+    """
+    Тесты StackSampler: свернутые стеки в формате flamegraph.
+    """
+    def test_collects_collapsed_stacks(self):
+        def busy_profiled_function():
+            deadline = time.perf_counter() + 0.2
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_profiled_function()
+        sampler.stop()
+
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(any('busy_profiled_function (api/tests_profiling.py:' in line for line in lines))
+        for line in lines:
+            self.assertRegex(line, r'^[^;]+(;[^;]+)* \d+$')
@@ -0,0 +1,91 @@
+﻿from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import Character, LootItem, LootRarity
+from .simulation import simulate_lootbox
+
+class LootboxSimulationTests(APITestCase):
+    """
+    Тесты симулятора лутбоксов.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='sim_user', password='password')
+        self.character = Character.objects.create(user=self.user, name='Симулятор')
+        self.items = [
+            LootItem.objects.create(owner=self.user, name='Common', rarity=LootRarity.COMMON, base_chance=Decimal('70.00')),
+            LootItem.objects.create(owner=self.user, name='Uncommon', rarity=LootRarity.UNCOMMON, base_chance=Decimal('20.00')),
+            LootItem.objects.create(owner=self.user, name='Rare', rarity=LootRarity.RARE, base_chance=Decimal('10.00')),
+        ]
+
+    def test_first_open_hit_rates_match_base_chances(self):
+        """
+        При одном открытии без жалости частоты совпадают с базовыми шансами.
+        """
+        report = simulate_lootbox(self.items, sessions=200_000, opens=1, seed=1)
+        for item, expected in zip(report['items'], (0.70, 0.20, 0.10)):
+            self.assertAlmostEqual(item['hit_rate'], expected, delta=0.005)
+        self.assertEqual(report['pity']['max'], 0)
+        self.assertAlmostEqual(report['opens_until_first']['RARE']['appeared_share'], 0.10, delta=0.005)
+
+    def test_pity_raises_rare_rate(self):
+        report = simulate_lootbox(self.items, sessions=20_000, opens=1, start_pity=40, seed=7)
+        self.assertGreater(report['items'][2]['hit_rate'], 0.15)
+
+    def test_won_items_leave_the_pool_and_runs_are_reproducible(self):
+        """
+        Выигранный предмет уходит из пула, как при настоящем открытии: за 40 открытий
+        каждый из трех предметов выпадает ровно один раз. Одинаковый seed дает одинаковый отчет.
+        """
+        first = simulate_lootbox(self.items, sessions=5_000, opens=40, seed=7)
+        second = simulate_lootbox(self.items, sessions=5_000, opens=40, seed=7)
+        first.pop('elapsed_seconds')
+        second.pop('elapsed_seconds')
+        self.assertEqual(first, second)
+
+        self.assertEqual(first['total_opens'], 15_000)
+        self.assertEqual(first['pool_emptied_share'], 1.0)
+        for item in first['items']:
+            self.assertAlmostEqual(item['hit_rate'], 1 / 3)
+        self.assertEqual(first['opens_until_first']['RARE']['appeared_share'], 1.0)
+        self.assertLessEqual(first['pity']['max'], 2)
+        self.assertAlmostEqual(sum(first['pity']['distribution']), 1.0)
+
+    def test_remaining_chances_are_renormalized(self):
+        """
+        После выигрыша шансы оставшихся предметов пересчитываются пропорционально:
+        вторым открытием Rare выпадает с вероятностью 0.7 * 10/30 + 0.2 * 10/80
+        (с точностью до бонуса жалости).
+        """
+        report = simulate_lootbox(self.items, sessions=200_000, opens=2, seed=3)
+        second_open_rare = report['items'][2]['hit_rate'] * 2 - 0.10
+        self.assertAlmostEqual(second_open_rare, 0.7 * 10 / 30 + 0.2 * 10 / 80, delta=0.01)
+
+    def test_endpoint_is_admin_only(self):
+        url = reverse('lootbox-simulate')
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_user(username='sim_admin', password='password', is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(url, {'user_id': self.user.id, 'sessions': 1000, 'opens': 5, 'seed': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['sessions'], 1000)
+        self.assertEqual([item['name'] for item in response.data['items']], ['Common', 'Uncommon', 'Rare'])
+
+        response = self.client.get(url, {'user_id': self.user.id, 'sessions': 1_000_000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'user_id': self.user.id, 'opens': 200})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'user_id': self.user.id, 'pity': 10_000_000_000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pity_histogram_covers_reached_values_only(self):
+        report = simulate_lootbox(self.items, sessions=1000, opens=3, start_pity=1000, seed=2)
+        self.assertGreaterEqual(report['pity']['max'], 1000)
+        self.assertAlmostEqual(sum(report['pity']['distribution']), 1.0)
+
+        with self.assertRaises(CommandError):
+            call_command('simulate_lootbox', self.user.username, '--pity', '-1')
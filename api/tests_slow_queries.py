@@ -0,0 +1,108 @@
+﻿import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import call, patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import Character, Skill, Goal, GoalType
+from .slow_queries import explain, get_query_shape, reset_slow_query_log
+
+class QueryShapeTests(SimpleTestCase):
+    """
+    Тесты нормализации SQL в форму запроса.
+    """
+    def test_placeholder_lists_and_literals_are_collapsed(self):
+        short = get_query_shape('SELECT * FROM "api_goal" WHERE "api_goal"."id" IN (%s, %s) LIMIT 21')
+        long = get_query_shape('SELECT *  FROM "api_goal"\n WHERE "api_goal"."id" IN (%s, %s, %s) LIMIT 5')
+        self.assertEqual(short, long)
+        self.assertNotEqual(short, get_query_shape('SELECT * FROM "api_skill" WHERE "api_skill"."id" IN (%s, %s)'))
+        self.assertEqual(get_query_shape("SELECT 'a''b', 12.5"), 'SELECT ?, ?')
+
+class SlowQueryLogTests(APITestCase):
+    """
+    Тесты журнала медленных запросов: контекст запроса, EXPLAIN один раз на форму, отчет.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.log_path = os.path.join(self.directory.name, 'slow.jsonl')
+        settings_override = override_settings(
+            SLOW_QUERY_ENABLED=True, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG=self.log_path, SLOW_QUERY_EXPLAIN_ANALYZE=True
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_slow_query_log()
+        self.addCleanup(reset_slow_query_log)
+
+        self.user = User.objects.create_user(username='slow_user', password='password')
+        character = Character.objects.create(user=self.user, name='Тормоз')
+        for i in range(2):
+            skill = Skill.objects.create(character=character, name=f'Навык {i}')
+            Goal.objects.create(skill=skill, description=f'Цель {i}', goal_type=GoalType.DAILY)
+        self.client.force_authenticate(user=self.user)
+
+    def _read_log(self):
+        with open(self.log_path, encoding='utf-8') as log:
+            return [json.loads(line) for line in log]
+
+    def test_records_queries_with_context_and_explains_each_shape_once(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('goal-list')).status_code, status.HTTP_200_OK)
+
+        entries = self._read_log()
+        queries = [entry for entry in entries if entry['type'] == 'query']
+        plans = [entry for entry in entries if entry['type'] == 'plan']
+        self.assertTrue(queries)
+        self.assertEqual({entry['route'] for entry in queries}, {'goal-list'})
+        self.assertTrue(all(entry['path'] == reverse('goal-list') for entry in queries))
+        self.assertTrue(any(entry['frame'] and entry['frame']['file'].startswith('api') for entry in queries))
+
+        fingerprints = [plan['fingerprint'] for plan in plans]
+        self.assertEqual(len(fingerprints), len(set(fingerprints)))
+        self.assertEqual(set(fingerprints), {entry['fingerprint'] for entry in queries})
+        self.assertGreater(len(queries), len(plans))
+        self.assertTrue(all(plan['prefix'] == 'EXPLAIN QUERY PLAN' and plan['rows'] for plan in plans))
+
+    def test_report_groups_by_shape(self):
+        self.client.get(reverse('goal-list'))
+        self.client.get(reverse('goal-list'))
+        out = StringIO()
+        call_command('slow_queries_report', '--top', '3', stdout=out)
+        output = out.getvalue()
+        self.assertIn('routes: goal-list', output)
+        self.assertIn('plan (EXPLAIN QUERY PLAN):', output)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=60000)
+    def test_fast_queries_are_not_recorded(self):
+        self.client.get(reverse('goal-list'))
+        self.assertFalse(os.path.exists(self.log_path))
+
+    @override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_QUERY_BUDGET=100, REQUEST_TIMING_LATENCY_BUDGET_MS=60000)
+    def test_explain_is_not_counted_as_request_query(self):
+        """
+        EXPLAIN выполняется после ответа и мимо execute-оберток: первый запрос,
+        для которого снимаются планы, насчитывает столько же запросов, сколько повторный.
+        """
+        first = self.client.get(reverse('goal-list'))
+        plans = [entry for entry in self._read_log() if entry['type'] == 'plan']
+        self.assertTrue(plans)
+        second = self.client.get(reverse('goal-list'))
+        self.assertEqual(len([entry for entry in self._read_log() if entry['type'] == 'plan']), len(plans))
+
+        def db_description(response):
+            return next(part for part in response['Server-Timing'].split(', ') if part.startswith('db;')).split(';desc=')[1]
+        self.assertEqual(db_description(first), db_description(second))
+
+    def test_locking_selects_are_not_analyzed(self):
+        with patch.object(connection.ops, 'explain_query_prefix', wraps=connection.ops.explain_query_prefix) as prefix:
+            explain('SELECT "api_skill"."id" FROM "api_skill" FOR UPDATE', ())
+            self.assertEqual(prefix.call_args_list, [call()])
+            prefix.reset_mock()
+            explain('SELECT "api_skill"."id" FROM "api_skill"', ())
+            self.assertEqual(prefix.call_args_list[0], call(analyze=True))
@@ -0,0 +1,92 @@
+﻿import json
+import os
+import tempfile
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import Character, Skill, Goal, GoalType
+from .tracing import SPAN_KIND_CLIENT, SPAN_KIND_SERVER, LOGGER_NAME
+from .instrumentation import close_jsonl_logger
+
+class TracingTests(APITestCase):
+    """
+    Тесты трассировки: дерево спанов в формате OTLP/JSON, сэмплирование и traceparent.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.log_path = os.path.join(self.directory.name, 'traces.jsonl')
+        settings_override = override_settings(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=1.0, TRACING_LOG=self.log_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(close_jsonl_logger, LOGGER_NAME)
+
+        self.user = User.objects.create_user(username='trace_user', password='password')
+        character = Character.objects.create(user=self.user, name='Следопыт')
+        self.skill = Skill.objects.create(character=character, name='Трассировка')
+        self.goal = Goal.objects.create(skill=self.skill, description='Цель', goal_type=GoalType.YELLOW, xp_reward=50)
+        self.client.force_authenticate(user=self.user)
+
+    def _read_traces(self):
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path, encoding='utf-8') as log:
+            return [json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans'] for line in log]
+
+    def test_request_produces_span_tree(self):
+        response = self.client.post(reverse('goal-toggle-complete', kwargs={'pk': self.goal.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        [spans] = self._read_traces()
+        by_id = {span['spanId']: span for span in spans}
+        [root] = [span for span in spans if 'parentSpanId' not in span]
+        self.assertEqual(root['kind'], SPAN_KIND_SERVER)
+        self.assertEqual(root['name'], 'POST goal-toggle-complete')
+        self.assertIn({'key': 'http.response.status_code', 'value': {'intValue': '200'}}, root['attributes'])
+        self.assertEqual(response['traceresponse'], f'00-{root["traceId"]}-{root["spanId"]}-01')
+        self.assertEqual({span['traceId'] for span in spans}, {root['traceId']})
+        self.assertTrue(all(span['parentSpanId'] in by_id for span in spans if span is not root))
+        for span in spans:
+            self.assertLessEqual(int(span['startTimeUnixNano']), int(span['endTimeUnixNano']))
+
+        names = {span['name'] for span in spans}
+        for name in ('get_user_current_date', 'apply_xp', 'Skill.add_xp', 'Character.add_xp', 'check_for_achievements',
+                     'SkillSerializer.to_representation', 'CharacterSerializer.to_representation', 'response.render'):
+            self.assertIn(name, names)
+        skill_add_xp = next(span for span in spans if span['name'] == 'Skill.add_xp')
+        self.assertEqual(by_id[skill_add_xp['parentSpanId']]['name'], 'apply_xp')
+
+        sql_spans = [span for span in spans if span['kind'] == SPAN_KIND_CLIENT]
+        self.assertTrue(sql_spans)
+        self.assertTrue(any(attribute['key'] == 'db.statement' for attribute in sql_spans[0]['attributes']))
+
+    def test_untrusted_traceparent_does_not_force_sampling(self):
+        trace_id, parent_id = 'ab' * 16, 'cd' * 8
+        with override_settings(TRACING_SAMPLE_RATE=0.0):
+            self.client.get(reverse('character-detail'))
+            response = self.client.get(reverse('character-detail'), HTTP_TRACEPARENT=f'00-{trace_id}-{parent_id}-01')
+            self.assertNotIn('traceresponse', response)
+            self.assertEqual(self._read_traces(), [])
+
+        self.client.get(reverse('character-detail'), HTTP_TRACEPARENT=f'00-{trace_id}-{parent_id}-00')
+
+        [spans] = self._read_traces()
+        root = next(span for span in spans if span['kind'] == SPAN_KIND_SERVER)
+        self.assertEqual(root['traceId'], trace_id)
+        self.assertEqual(root['parentSpanId'], parent_id)
+
+    @override_settings(TRACING_TRUST_TRACEPARENT=True)
+    def test_trusted_traceparent_keeps_sampling_decision(self):
+        trace_id, parent_id = 'ab' * 16, 'cd' * 8
+        with override_settings(TRACING_SAMPLE_RATE=0.0):
+            self.client.get(reverse('character-detail'), HTTP_TRACEPARENT=f'00-{trace_id}-{parent_id}-01')
+
+        response = self.client.get(reverse('character-detail'), HTTP_TRACEPARENT=f'00-{trace_id}-{parent_id}-00')
+        self.assertNotIn('traceresponse', response)
+
+        [spans] = self._read_traces()
+        root = next(span for span in spans if span['kind'] == SPAN_KIND_SERVER)
+        self.assertEqual(root['traceId'], trace_id)
+        self.assertEqual(root['parentSpanId'], parent_id)
@@ -1,9 +1,9 @@
-﻿from django.test import TestCase
+﻿from django.test import TestCase, RequestFactory
 from django.contrib.auth.models import User
 from datetime import date, time
 from freezegun import freeze_time
-from .models import Character
-from .utils import get_user_current_date
+from .models import Character, Skill, Goal, GoalType, GoalCompletion
+from .utils import get_user_current_date, CompletionState, get_completion_state
 
 class UtilsTests(TestCase):
     """
@@ -76,3 +76,42 @@ class UtilsTests(TestCase):
             current_date = get_user_current_date(self.user, 'UTC')
             # Наступил новый игровой день
             self.assertEqual(current_date, date(2024, 5, 22))
+
+    @freeze_time("2024-05-22 10:00:00")
+    def test_completion_state_loads_completions_once(self):
+        """
+        Проверяем, что CompletionState загружает выполненные цели одним запросом
+        и корректно учитывает игровой день для ежедневных целей.
+        """
+        skill = Skill.objects.create(character=self.character, name='Навык')
+        daily_today = Goal.objects.create(skill=skill, description='Сегодня', goal_type=GoalType.DAILY)
+        daily_yesterday = Goal.objects.create(skill=skill, description='Вчера', goal_type=GoalType.DAILY)
+        long_term = Goal.objects.create(skill=skill, description='Давно', goal_type=GoalType.RED)
+        pending = Goal.objects.create(skill=skill, description='Не выполнена', goal_type=GoalType.BLUE)
+        GoalCompletion.objects.create(goal=daily_today, owner=self.user, completion_date=date(2024, 5, 22))
+        GoalCompletion.objects.create(goal=daily_yesterday, owner=self.user, completion_date=date(2024, 5, 21))
+        GoalCompletion.objects.create(goal=long_term, owner=self.user, completion_date=date(2024, 1, 1))
+
+        state = CompletionState(self.user, 'UTC')
+        self.assertEqual(state.user_today, date(2024, 5, 22))
+
+        with self.assertNumQueries(1):
+            self.assertTrue(state.is_completed(daily_today))
+            self.assertFalse(state.is_completed(daily_yesterday))
+            self.assertTrue(state.is_completed(long_term))
+            self.assertFalse(state.is_completed(pending))
+
+        state.invalidate()
+        with self.assertNumQueries(1):
+            self.assertTrue(state.is_completed(daily_today))
+
+    def test_get_completion_state_is_cached_per_request(self):
+        """
+        Проверяем, что состояние выполнения вычисляется один раз на запрос.
+        """
+        request = RequestFactory().get('/', HTTP_X_TIMEZONE='Europe/Moscow')
+        request.user = self.user
+
+        state = get_completion_state(request)
+        self.assertIs(get_completion_state(request), state)
+        self.assertEqual(state.user_today, get_user_current_date(self.user, 'Europe/Moscow'))
@@ -0,0 +1,211 @@
+﻿"""
+Lightweight request tracing. A sampled request gets a root span; `span()` and
+`@traced` add child spans through a context variable, and every SQL call is a
+span of its own. Finished traces are written as one OTLP/JSON
+ExportTraceServiceRequest per line to a rotating file, the same shape the
+OpenTelemetry collector's file exporter produces. Unsampled requests only pay
+for one context variable lookup per instrumented call.
+"""
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from .instrumentation import get_jsonl_logger, get_route
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_ERROR = 2
+
+MAX_SPANS_PER_TRACE = 2000
+MAX_STATEMENT_LENGTH = 2000
+LOGGER_NAME = 'api.tracing.file'
+
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.spans = []
+        self.dropped = 0
+
+    def start_span(self, name, parent_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped += 1
+            return None
+        span = Span(self, name, parent_id, kind, attributes)
+        self.spans.append(span)
+        return span
+
+    def to_otlp(self):
+        return {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': settings.TRACING_SERVICE_NAME, 'process.pid': os.getpid()})},
+            'scopeSpans': [{
+                'scope': {'name': 'api.tracing'},
+                'spans': [span.to_otlp() for span in self.spans],
+            }],
+        }]}
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'attributes', 'start', 'end', 'error')
+
+    def __init__(self, trace, name, parent_id, kind, attributes):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        self.end = time.time_ns()
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+
+    def to_otlp(self):
+        data = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end or time.time_ns()),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': STATUS_CODE_ERROR, 'message': self.error} if self.error else {},
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        return data
+
+@contextmanager
+def span(name, kind=SPAN_KIND_INTERNAL, **attributes):
+    parent = _current_span.get()
+    current = parent and parent.trace.start_span(name, parent.span_id, kind, attributes)
+    if not current:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.finish(exc)
+        raise
+    else:
+        current.finish()
+    finally:
+        _current_span.reset(token)
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_sql(execute, sql, params, many, context):
+    operation = sql.lstrip().split(' ', 1)[0].upper()
+    with span(f'db {operation}', SPAN_KIND_CLIENT, **{
+        'db.system': connection.vendor,
+        'db.operation': operation,
+        'db.statement': sql[:MAX_STATEMENT_LENGTH],
+        'db.many': many or None,
+    }):
+        return execute(sql, params, many, context)
+
+def export_trace(trace):
+    get_jsonl_logger(
+        LOGGER_NAME, settings.TRACING_LOG, settings.TRACING_LOG_MAX_BYTES, settings.TRACING_LOG_BACKUPS
+    ).info(json.dumps(trace.to_otlp(), ensure_ascii=False, separators=(',', ':')))
+
+def start_request_trace(request):
+    """
+    Root span for the request, or None if it is not sampled. A W3C `traceparent`
+    header continues the caller's trace. Its sampled flag is only honoured with
+    TRACING_TRUST_TRACEPARENT (behind a trusted proxy); otherwise the local
+    sampler decides, so clients cannot force their requests to be traced.
+    """
+    match = _TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+    if match and settings.TRACING_TRUST_TRACEPARENT:
+        sampled = bool(int(match.group(3), 16) & 1)
+    else:
+        sampled = random.random() < settings.TRACING_SAMPLE_RATE
+    if not sampled:
+        return None
+    trace, parent_id = (Trace(match.group(1)), match.group(2)) if match else (Trace(), None)
+    return trace.start_span(request.method, parent_id, SPAN_KIND_SERVER, {
+        'http.request.method': request.method,
+        'url.path': request.path,
+    })
+
+class TracingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRACING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        root = start_request_trace(request)
+        if root is None:
+            return self.get_response(request)
+
+        token = _current_span.set(root)
+        try:
+            with connection.execute_wrapper(trace_sql):
+                response = self.get_response(request)
+        except BaseException as exc:
+            root.finish(exc)
+            export_trace(root.trace)
+            raise
+        finally:
+            _current_span.reset(token)
+
+        route = get_route(request)
+        root.name = f'{request.method} {route}'
+        root.set_attribute('http.route', route)
+        root.set_attribute('http.response.status_code', response.status_code)
+        if root.trace.dropped:
+            root.set_attribute('tracing.dropped_spans', root.trace.dropped)
+        response['traceresponse'] = f'00-{root.trace.trace_id}-{root.span_id}-01'
+
+        root.finish()
+        export_trace(root.trace)
+        return response
+
+    def process_template_response(self, request, response):
+        # Django renders right after this hook, still inside get_response().
+        root = _current_span.get()
+        render = root and root.trace.start_span('response.render', root.span_id)
+        if render:
+            response.add_post_render_callback(lambda rendered: render.finish())
+        return response
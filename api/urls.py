@@ -18,8 +18,12 @@ urlpatterns = [
     path('impersonate/stop/', ImpersonateStopView.as_view(), name='impersonate-stop'),
     path('character/', CharacterView.as_view(), name='character-detail'),
     path('lootbox/', LootboxAPIView.as_view(), name='lootbox-api'),
+    path('lootbox/simulate/', LootboxSimulationView.as_view(), name='lootbox-simulate'),
     path('users/', UserListView.as_view(), name='user-list'),
     path('users/search/', UserSearchView.as_view(), name='user-search'),
+    path('cache-stats/', PayloadCacheStatsView.as_view(), name='cache-stats'),
+    path('profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:profile_id>/<str:kind>/', ProfileDownloadView.as_view(), name='profile-download'),
     path('get-csrf-token/', GetCSRFToken.as_view(), name='get-csrf-token'),
     path('', include(router.urls)),
 ]
@@ -1,8 +1,11 @@
 ﻿import pytz
 from datetime import timedelta, time
+from django.db.models import Q
 from django.utils import timezone
-from .models import Character
+from .models import Character, GoalCompletion, GoalType
+from .tracing import traced
 
+@traced('get_user_current_date')
 def get_user_current_date(user, timezone_str='UTC'):
     try:
         user_tz = pytz.timezone(timezone_str)
@@ -19,3 +22,40 @@ def get_user_current_date(user, timezone_str='UTC'):
         return (user_now - timedelta(days=1)).date()
     else:
         return user_now.date()
+
+
+def get_completed_goal_ids(user, user_today):
+    return set(
+        GoalCompletion.objects.filter(owner=user).filter(
+            Q(goal__goal_type=GoalType.DAILY, completion_date=user_today) |
+            ~Q(goal__goal_type=GoalType.DAILY)
+        ).values_list('goal_id', flat=True)
+    )
+
+
+class CompletionState:
+    def __init__(self, user, timezone_str='UTC'):
+        self.user = user
+        self.user_today = get_user_current_date(user, timezone_str)
+        self._completed_goal_ids = None
+
+    @property
+    def completed_goal_ids(self):
+        if self._completed_goal_ids is None:
+            self._completed_goal_ids = get_completed_goal_ids(self.user, self.user_today)
+        return self._completed_goal_ids
+
+    def is_completed(self, goal):
+        return goal.id in self.completed_goal_ids
+
+    def invalidate(self):
+        self._completed_goal_ids = None
+
+
+def get_completion_state(request):
+    state = getattr(request, '_completion_state', None)
+    if state is None or state.user != request.user:
+        tz_str = request.headers.get('X-Timezone', 'UTC')
+        state = CompletionState(request.user, tz_str)
+        request._completion_state = state
+    return state
@@ -0,0 +1,162 @@
+﻿import contextvars
+import hashlib
+from contextlib import contextmanager
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+from .models import Character
+from .utils import get_completion_state
+
+_pending_changes = contextvars.ContextVar('pending_version_changes', default=None)
+
+def _empty_changes():
+    return {'characters': set(), 'users': set(), 'skills': set(), 'groups': set()}
+
+def _bump_versions(changes, exclude=None):
+    condition = Q()
+    if changes['characters']:
+        condition |= Q(pk__in=changes['characters'])
+    if changes['users']:
+        condition |= Q(user_id__in=changes['users'])
+    if changes['skills']:
+        condition |= (
+            Q(skills__id__in=changes['skills']) |
+            Q(user__group_memberships__skills__id__in=changes['skills']) |
+            Q(user__owned_groups__skills__id__in=changes['skills'])
+        )
+    if changes['groups']:
+        condition |= Q(user__group_memberships__id__in=changes['groups']) | Q(user__owned_groups__id__in=changes['groups'])
+    if condition:
+        characters = Character.objects.filter(condition)
+        if exclude is not None:
+            characters = characters.exclude(pk=exclude)
+        characters.update(version=F('version') + 1)
+
+def mark_changed(characters=(), users=(), skills=(), groups=()):
+    changes = _empty_changes()
+    changes['characters'].update(pk for pk in characters if pk is not None)
+    changes['users'].update(pk for pk in users if pk is not None)
+    changes['skills'].update(pk for pk in skills if pk is not None)
+    changes['groups'].update(pk for pk in groups if pk is not None)
+
+    pending = _pending_changes.get()
+    if pending is None:
+        _bump_versions(changes)
+    else:
+        for key, ids in changes.items():
+            pending[key].update(ids)
+
+def _take_pending():
+    pending = _pending_changes.get()
+    if pending is None:
+        return None
+    changes = {key: set(ids) for key, ids in pending.items()}
+    for ids in pending.values():
+        ids.clear()
+    return changes
+
+def flush_version_bumps():
+    changes = _take_pending()
+    if changes is not None:
+        _bump_versions(changes)
+
+def _bump_returning(character):
+    quote = connection.ops.quote_name
+    table, version, pk = quote(Character._meta.db_table), quote('version'), quote(Character._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {table} SET {version} = {version} + 1 WHERE {pk} = %s RETURNING {version}', [character.pk])
+        row = cursor.fetchone()
+    if row is None:
+        raise Character.DoesNotExist(f'Character {character.pk} does not exist.')
+    character.version = row[0]
+
+def refresh_version(character):
+    """
+    Flushes the deferred bumps and loads the character's new version. If the
+    character's own row is among them, it is bumped with UPDATE ... RETURNING
+    instead of being read back.
+    """
+    changes = _take_pending()
+    own_bump = (
+        changes is not None
+        and (character.pk in changes['characters'] or character.user_id in changes['users'])
+        # Both support UPDATE ... RETURNING; SQLite since 3.35, as for inserts.
+        and connection.vendor in ('postgresql', 'sqlite')
+        and connection.features.can_return_columns_from_insert
+    )
+    if not own_bump:
+        if changes is not None:
+            _bump_versions(changes)
+        character.refresh_from_db(fields=['version'])
+        return character
+    # Character.user is one-to-one, so these ids match this row only.
+    changes['characters'].discard(character.pk)
+    changes['users'].discard(character.user_id)
+    _bump_versions(changes, exclude=character.pk)
+    _bump_returning(character)
+    return character
+
+@contextmanager
+def deferred_version_bumps():
+    token = _pending_changes.set(_empty_changes())
+    try:
+        yield
+    finally:
+        try:
+            flush_version_bumps()
+        finally:
+            _pending_changes.reset(token)
+
+class VersionBumpMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deferred_version_bumps():
+            return self.get_response(request)
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+class CharacterETagMixin:
+    def get_etag(self, request):
+        character = Character.objects.filter(user=request.user).first()
+        if character is None:
+            return None
+        # Always read the current version; the view reuses this instance.
+        request.user.character = character
+
+        user_today = get_completion_state(request).user_today
+        raw = ':'.join([
+            str(request.user.pk),
+            str(character.version),
+            user_today.isoformat(),
+            request.headers.get('X-Timezone', 'UTC'),
+            request.get_full_path(),
+            request.headers.get('Accept', ''),
+        ])
+        return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        if request.method in ('GET', 'HEAD'):
+            self.etag = self.get_etag(request)
+            if self.etag and self.etag in parse_etags(request.headers.get('If-None-Match', '')):
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        etag = getattr(self, 'etag', None)
+        if etag and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+        return response
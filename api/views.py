@@ -3,9 +3,9 @@ import pytz
 from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q, Case, When, Value, IntegerField
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.http import FileResponse, HttpRequest, HttpResponse, JsonResponse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
@@ -22,39 +22,96 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import *
 from .serializers import *
-from .logic import recalculate_loot_chances, get_weighted_random_award
-from .utils import get_user_current_date
-
+from .logic import recalculate_loot_chances, get_weighted_random_award, apply_xp, update_xp_row_steps, XPConflictError
+from .utils import get_completion_state
+from .versioning import CharacterETagMixin, mark_changed, refresh_version
+from .cache import payload_cache
+from .pagination import GoalHistoryPagination, ReceivedRewardPagination
+from .simulation import simulate_lootbox
+from .tracing import traced
+from .profiling import PROFILE_FILES, get_profile_path, list_profiles
+from .metrics import REGISTRY, GOALS_COMPLETED, XP_GRANTED, LOOTBOXES_OPENED, ACHIEVEMENTS_CLAIMED
+
+MAX_BULK_ENTRIES = 200
+# The endpoint runs inside the request: larger runs go through `manage.py simulate_lootbox --workers N`.
+MAX_SIMULATION_SESSIONS = 10_000
+MAX_SIMULATION_OPENS = 50
+MAX_SIMULATION_PITY = 1000
+
+@traced('check_for_achievements')
 def check_for_achievements(character, skill=None):
+    return claim_achievements(character, [skill] if skill else [])
+
+@traced('claim_achievements')
+def claim_achievements(character, skills, character_level=None, skill_levels=None):
+    character_level = character.level if character_level is None else character_level
+    skill_levels = skill_levels or {}
+    skills = list(skills)
+
+    claimed_at = timezone.now()
+    claimed_achievements = []
     newly_claimed_rewards = []
-    
-    char_achievements = character.achievements.filter(claimed_date__isnull=True, required_level__lte=character.level)
-    for ach in char_achievements:
-        ach.claimed_date = timezone.now()
-        ach.save()
-        reward = ReceivedReward.objects.create(
-            owner=character.user,
-            description=f'Ур. {ach.required_level}: {ach.description}',
-            source_name='Уровень персонажа',
-            received_date=ach.claimed_date
+
+    owners = [(character, character_level, 'Уровень персонажа')]
+    owners += [(skill, skill_levels.get(skill.pk, skill.level), f'Навык: {skill.name}') for skill in skills]
+
+    for owner, level, source_name in owners:
+        # Порог хранится у владельца, поэтому без пересеченного уровня запроса нет.
+        if owner.next_achievement_level is None or owner.next_achievement_level > level:
+            continue
+
+        next_level = None
+        for ach in owner.achievements.filter(claimed_date__isnull=True).order_by('required_level', 'id'):
+            if ach.required_level <= level:
+                ach.claimed_date = claimed_at
+                claimed_achievements.append(ach)
+                newly_claimed_rewards.append(ReceivedReward(
+                    owner_id=character.user_id,
+                    description=f'Ур. {ach.required_level}: {ach.description}',
+                    source_name=source_name,
+                    received_date=claimed_at
+                ))
+            elif next_level is None:
+                next_level = ach.required_level
+
+        owner.next_achievement_level = next_level
+        type(owner).objects.filter(pk=owner.pk).update(next_achievement_level=next_level)
+
+    if claimed_achievements:
+        Achievement.objects.bulk_update(claimed_achievements, ['claimed_date'])
+        ReceivedReward.objects.bulk_create(newly_claimed_rewards)
+        skill_claims = sum(1 for ach in claimed_achievements if ach.owner_skill_id)
+        if skill_claims:
+            ACHIEVEMENTS_CLAIMED.inc_on_commit(skill_claims, owner='skill')
+        if len(claimed_achievements) > skill_claims:
+            ACHIEVEMENTS_CLAIMED.inc_on_commit(len(claimed_achievements) - skill_claims, owner='character')
+        # bulk_update/bulk_create do not send post_save.
+        mark_changed(
+            characters=[character.pk],
+            users=[character.user_id],
+            skills=[ach.owner_skill_id for ach in claimed_achievements]
         )
-        newly_claimed_rewards.append(reward)
-
-    if skill:
-        skill_achievements = skill.achievements.filter(claimed_date__isnull=True, required_level__lte=skill.level)
-        for ach in skill_achievements:
-            ach.claimed_date = timezone.now()
-            ach.save()
-            reward = ReceivedReward.objects.create(
-                owner=character.user,
-                description=f'Ур. {ach.required_level}: {ach.description}',
-                source_name=f'Навык: {skill.name}',
-                received_date=ach.claimed_date
-            )
-            newly_claimed_rewards.append(reward)
 
     return newly_claimed_rewards
 
+def wants_delta_response(request):
+    mode = request.headers.get('X-Response-Mode') or request.query_params.get('response_mode', '')
+    return mode.lower() == 'delta'
+
+class DeltaResponseMixin:
+    def delta_response(self, skills=(), goals=(), removed_skill_ids=(), removed_goal_ids=(), new_rewards=(), status_code=status.HTTP_200_OK):
+        context = {'request': self.request}
+        character = self.request.user.character
+        return Response({
+            'version': character.version,
+            'character': CharacterStateSerializer(character, context=context).data,
+            'skills': SkillSerializer(skills, many=True, context=context).data,
+            'removed_skill_ids': list(removed_skill_ids),
+            'goals': GoalSerializer(goals, many=True, context=context).data,
+            'removed_goal_ids': list(removed_goal_ids),
+            'new_rewards': ReceivedRewardSerializer(new_rewards, many=True).data,
+        }, status=status_code)
+
 class IsAdminUser(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_staff
@@ -120,15 +177,28 @@ class UserListView(generics.ListAPIView):
     def get_queryset(self):
         return User.objects.exclude(id=self.request.user.id).order_by('id')
 
-class CharacterView(generics.RetrieveUpdateAPIView):
+class CharacterView(CharacterETagMixin, generics.RetrieveUpdateAPIView):
     serializer_class = CharacterSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        character, created = Character.objects.get_or_create(user=self.request.user)
-        return character
+        try:
+            return self.request.user.character
+        except Character.DoesNotExist:
+            return Character.objects.create(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        character = self.get_object()
+        data = payload_cache.get_or_build(
+            'character', request, character,
+            lambda: self.get_serializer(character).data
+        )
+        return Response(data)
 
-class SkillViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        refresh_version(serializer.save())
+
+class SkillViewSet(DeltaResponseMixin, viewsets.ModelViewSet):
     serializer_class = SkillSerializer
     permission_classes = [IsAuthenticated]
 
@@ -139,6 +209,20 @@ class SkillViewSet(viewsets.ModelViewSet):
             models.Q(character__user=user) | models.Q(group__in=my_groups) | models.Q(group__owner=user)
         ).distinct()
 
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        try:
+            character = request.user.character
+        except Character.DoesNotExist:
+            return Response(self.get_serializer(instance).data)
+
+        data = payload_cache.get_or_build(
+            'skill', request, character,
+            lambda: self.get_serializer(instance).data,
+            instance.pk
+        )
+        return Response(data)
+
     def perform_create(self, serializer):
         character_id = self.request.data.get('character')
         group_id = self.request.data.get('group')
@@ -162,6 +246,10 @@ class SkillViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
+        refresh_version(request.user.character)
+
+        if wants_delta_response(request):
+            return self.delta_response(skills=[serializer.instance], status_code=status.HTTP_201_CREATED)
 
         character_data = CharacterSerializer(request.user.character, context={'request': request}).data
         return Response(character_data, status=status.HTTP_201_CREATED)
@@ -172,13 +260,22 @@ class SkillViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
+        refresh_version(request.user.character)
+
+        if wants_delta_response(request):
+            return self.delta_response(skills=[instance])
 
         character_data = CharacterSerializer(request.user.character, context={'request': request}).data
         return Response(character_data)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
+        skill_id = instance.id
         self.perform_destroy(instance)
+        refresh_version(request.user.character)
+
+        if wants_delta_response(request):
+            return self.delta_response(removed_skill_ids=[skill_id])
 
         character_data = CharacterSerializer(request.user.character, context={'request': request}).data
         return Response(character_data, status=status.HTTP_200_OK)
@@ -196,11 +293,11 @@ class SkillViewSet(viewsets.ModelViewSet):
 
         xp_to_add = skill.xp_per_unit * units
         
-        skill_leveled_up = skill.add_xp(xp_to_add)
-        character.add_xp(xp_to_add)
-        
-        skill.save()
-        character.save()
+        try:
+            skill_leveled_up, _ = apply_xp(skill, character, xp_to_add)
+        except XPConflictError:
+            return Response({'error': 'Не удалось начислить опыт, попробуйте еще раз.'}, status=status.HTTP_409_CONFLICT)
+        XP_GRANTED.inc_on_commit(xp_to_add, source='progress')
 
         new_rewards = check_for_achievements(character, skill if skill_leveled_up else None)
 
@@ -212,6 +309,10 @@ class SkillViewSet(viewsets.ModelViewSet):
             xp_amount=xp_to_add,
             action=GoalHistoryAction.PROGRESS_ADDED
         )
+        refresh_version(character)
+
+        if wants_delta_response(request):
+            return self.delta_response(skills=[skill], new_rewards=new_rewards)
 
         skill_data = SkillSerializer(skill, context={'request': request}).data
         character_data = CharacterSerializer(character, context={'request': request}).data
@@ -223,7 +324,78 @@ class SkillViewSet(viewsets.ModelViewSet):
             'new_rewards': ReceivedRewardSerializer(new_rewards, many=True).data
         }, status=status.HTTP_200_OK)
 
-class GoalViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def bulk_progress(self, request):
+        entries = request.data.get('entries')
+        if not isinstance(entries, list) or not entries or len(entries) > MAX_BULK_ENTRIES:
+            return Response({'error': f'"entries" должен быть непустым списком (не более {MAX_BULK_ENTRIES}).'}, status=status.HTTP_400_BAD_REQUEST)
+
+        parsed_entries = []
+        for entry in entries:
+            try:
+                skill_id = int(entry['skill'])
+                units = int(entry.get('units', 1))
+                if units <= 0:
+                    raise ValueError
+            except (KeyError, ValueError, TypeError, AttributeError):
+                return Response({'error': 'Каждая запись должна содержать "skill" и положительное "units".'}, status=status.HTTP_400_BAD_REQUEST)
+            parsed_entries.append((skill_id, units))
+
+        skill_ids = {skill_id for skill_id, _ in parsed_entries}
+        accessible_ids = set(self.get_queryset().filter(pk__in=skill_ids).values_list('pk', flat=True))
+        if accessible_ids != skill_ids:
+            return Response({'error': 'Навык не найден.', 'skills': sorted(skill_ids - accessible_ids)}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            with transaction.atomic():
+                character = Character.objects.select_for_update().get(user=request.user)
+                request.user.character = character
+                skills = {skill.pk: skill for skill in Skill.objects.select_for_update().filter(pk__in=skill_ids)}
+
+                history = []
+                skill_amounts = {}
+                for skill_id, units in parsed_entries:
+                    skill = skills[skill_id]
+                    xp_to_add = skill.xp_per_unit * units
+                    skill_amounts.setdefault(skill_id, []).append(xp_to_add)
+                    history.append(GoalHistory(
+                        owner=request.user,
+                        goal_description=f"{units} ед. прогресса",
+                        skill_name=skill.name,
+                        skill_id=skill.id,
+                        xp_amount=xp_to_add,
+                        action=GoalHistoryAction.PROGRESS_ADDED
+                    ))
+
+                # Conditional updates like apply_xp: writers that skip the row
+                # locks (add_progress) can never be overwritten by these values.
+                leveled_up_skills = {}
+                for skill_id, amounts in skill_amounts.items():
+                    if update_xp_row_steps(skills[skill_id], amounts)[0]:
+                        leveled_up_skills[skill_id] = skills[skill_id]
+                update_xp_row_steps(character, [entry.xp_amount for entry in history])
+                GoalHistory.objects.bulk_create(history)
+                mark_changed(characters=[character.pk], skills=skills.keys())
+                XP_GRANTED.inc_on_commit(sum(entry.xp_amount for entry in history), source='progress')
+
+                new_rewards = claim_achievements(character, leveled_up_skills.values())
+        except XPConflictError:
+            return Response({'error': 'Не удалось начислить опыт, попробуйте еще раз.'}, status=status.HTTP_409_CONFLICT)
+
+        refresh_version(character)
+        touched_skills = [skills[skill_id] for skill_id in sorted(skills)]
+
+        if wants_delta_response(request):
+            return self.delta_response(skills=touched_skills, new_rewards=new_rewards)
+
+        return Response({
+            'message': f'{sum(units for _, units in parsed_entries)} ед. прогресса добавлено.',
+            'skills': SkillSerializer(touched_skills, many=True, context={'request': request}).data,
+            'character': CharacterSerializer(character, context={'request': request}).data,
+            'new_rewards': ReceivedRewardSerializer(new_rewards, many=True).data
+        }, status=status.HTTP_200_OK)
+
+class GoalViewSet(DeltaResponseMixin, viewsets.ModelViewSet):
     serializer_class = GoalSerializer
     permission_classes = [IsAuthenticated]
     
@@ -244,9 +416,16 @@ class GoalViewSet(viewsets.ModelViewSet):
         context['request'] = self.request
         return context
 
-    def get_response_data(self, goal):
+    def get_response_data(self, goal, removed_goal_id=None):
         skill = goal.skill
         character = self.request.user.character
+        refresh_version(character)
+
+        if wants_delta_response(self.request):
+            if removed_goal_id is not None:
+                return self.delta_response(skills=[skill], removed_goal_ids=[removed_goal_id])
+            return self.delta_response(skills=[skill], goals=[goal])
+
         return Response({
             'skill': SkillSerializer(skill, context={'request': self.request}).data,
             'character': CharacterSerializer(character, context={'request': self.request}).data,
@@ -280,6 +459,12 @@ class GoalViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
+        refresh_version(request.user.character)
+
+        if wants_delta_response(request):
+            goal = serializer.instance
+            return self.delta_response(skills=[goal.skill], goals=[goal], status_code=status.HTTP_201_CREATED)
+
         character_data = CharacterSerializer(request.user.character, context={'request': request}).data
         return Response(character_data, status=status.HTTP_201_CREATED)
 
@@ -294,8 +479,9 @@ class GoalViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         skill = instance.skill
+        goal_id = instance.id
         self.perform_destroy(instance)
-        return self.get_response_data(Goal(skill=skill))
+        return self.get_response_data(Goal(skill=skill), removed_goal_id=goal_id)
 
     @action(detail=True, methods=['post'])
     def duplicate(self, request, pk=None):
@@ -311,72 +497,86 @@ class GoalViewSet(viewsets.ModelViewSet):
     def toggle_complete(self, request, pk=None):
         goal = self.get_object()
         skill = goal.skill
-        character = request.user.character
 
         xp_amount = 0
         completion_record = None
         action_to_log = None
 
-        if goal.goal_type == GoalType.DAILY:
-            tz_str = request.headers.get('X-Timezone', 'UTC')
-            user_today = get_user_current_date(request.user, tz_str)
-            completion_record = GoalCompletion.objects.filter(
-                goal=goal, 
-                owner=request.user, 
-                completion_date=user_today
-            ).first()
-
-            if completion_record:
-                completion_record.delete()
-                xp_amount = -goal.xp_reward
-                action_to_log = GoalHistoryAction.REVERTED
-            else:
-                GoalCompletion.objects.create(
-                    goal=goal,
-                    owner=request.user,
-                    completion_date=user_today
-                )
-                xp_amount = goal.xp_reward
-                action_to_log = GoalHistoryAction.COMPLETED
-        else:
-            completion_record = GoalCompletion.objects.filter(
-                goal=goal, 
-                owner=request.user
-            ).first()
-
-            if completion_record:
-                completion_record.delete()
-                xp_amount = -goal.xp_reward
-                action_to_log = GoalHistoryAction.REVERTED
-            else:
-                tz_str = request.headers.get('X-Timezone', 'UTC')
-                user_today = get_user_current_date(request.user, tz_str)
-
-                GoalCompletion.objects.create(
-                    goal=goal,
-                    owner=request.user,
-                    completion_date=user_today
-                )
-                xp_amount = goal.xp_reward
-                action_to_log = GoalHistoryAction.COMPLETED
-
-        if xp_amount != 0:
-            skill_leveled_up = skill.add_xp(xp_amount)
-            character.add_xp(xp_amount)
-            skill.save()
-            character.save()
-            new_rewards = check_for_achievements(character, skill if skill_leveled_up else None)
-            GoalHistory.objects.create(
-                owner=request.user,
-                goal_description=goal.description,
-                skill_name=skill.name,
-                skill_id=skill.id,
-                xp_amount=abs(goal.xp_reward),
-                action=action_to_log,
-                goal_type=goal.goal_type
-            )
-        else:
-            new_rewards = []
+        try:
+            # Отметка о выполнении откатывается вместе с опытом, если его не удалось начислить.
+            with transaction.atomic():
+                # Та же блокировка, что и в bulk_toggle: отметки пользователя меняются по очереди.
+                character = Character.objects.select_for_update().get(user=request.user)
+                request.user.character = character
+                # После блокировки: дата пользователя берется из уже загруженного персонажа.
+                completion_state = get_completion_state(request)
+                user_today = completion_state.user_today
+                if goal.goal_type == GoalType.DAILY:
+                    completion_record = GoalCompletion.objects.filter(
+                        goal=goal, 
+                        owner=request.user, 
+                        completion_date=user_today
+                    ).first()
+
+                    if completion_record:
+                        completion_record.delete()
+                        xp_amount = -goal.xp_reward
+                        action_to_log = GoalHistoryAction.REVERTED
+                    else:
+                        GoalCompletion.objects.create(
+                            goal=goal,
+                            owner=request.user,
+                            completion_date=user_today
+                        )
+                        xp_amount = goal.xp_reward
+                        action_to_log = GoalHistoryAction.COMPLETED
+                else:
+                    completion_record = GoalCompletion.objects.filter(
+                        goal=goal, 
+                        owner=request.user
+                    ).first()
+
+                    if completion_record:
+                        completion_record.delete()
+                        xp_amount = -goal.xp_reward
+                        action_to_log = GoalHistoryAction.REVERTED
+                    else:
+                        GoalCompletion.objects.create(
+                            goal=goal,
+                            owner=request.user,
+                            completion_date=user_today
+                        )
+                        xp_amount = goal.xp_reward
+                        action_to_log = GoalHistoryAction.COMPLETED
+
+                completion_state.invalidate()
+
+                if action_to_log == GoalHistoryAction.COMPLETED:
+                    GOALS_COMPLETED.inc_on_commit(goal_type=goal.goal_type)
+                    if xp_amount > 0:
+                        XP_GRANTED.inc_on_commit(xp_amount, source='goal')
+
+                if xp_amount != 0:
+                    skill_leveled_up, _ = apply_xp(skill, character, xp_amount)
+                    new_rewards = check_for_achievements(character, skill if skill_leveled_up else None)
+                    GoalHistory.objects.create(
+                        owner=request.user,
+                        goal_description=goal.description,
+                        skill_name=skill.name,
+                        skill_id=skill.id,
+                        xp_amount=abs(goal.xp_reward),
+                        action=action_to_log,
+                        goal_type=goal.goal_type
+                    )
+                else:
+                    new_rewards = []
+        except XPConflictError:
+            return Response({'error': 'Не удалось начислить опыт, попробуйте еще раз.'}, status=status.HTTP_409_CONFLICT)
+
+        refresh_version(character)
+
+        if wants_delta_response(request):
+            return self.delta_response(skills=[skill], goals=[goal], new_rewards=new_rewards)
 
         return Response({
             'skill': SkillSerializer(skill, context={'request': request}).data,
@@ -384,9 +584,129 @@ class GoalViewSet(viewsets.ModelViewSet):
             'new_rewards': ReceivedRewardSerializer(new_rewards, many=True).data
         }, status=status.HTTP_200_OK)
 
-class GoalHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=False, methods=['post'])
+    def bulk_toggle(self, request):
+        goal_ids = request.data.get('goal_ids')
+        mode = request.data.get('mode', 'toggle')
+        if mode not in ('toggle', 'complete', 'uncomplete'):
+            return Response({'error': '"mode" должен быть toggle, complete или uncomplete.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if not isinstance(goal_ids, list):
+                raise TypeError
+            goal_ids = [int(goal_id) for goal_id in goal_ids]
+            if not goal_ids or len(goal_ids) > MAX_BULK_ENTRIES:
+                raise ValueError
+        except (ValueError, TypeError):
+            return Response({'error': f'"goal_ids" должен быть непустым списком (не более {MAX_BULK_ENTRIES}).'}, status=status.HTTP_400_BAD_REQUEST)
+
+        goals = {goal.pk: goal for goal in self.get_queryset().filter(pk__in=goal_ids)}
+        missing_ids = set(goal_ids) - goals.keys()
+        if missing_ids:
+            return Response({'error': 'Цель не найдена.', 'goals': sorted(missing_ids)}, status=status.HTTP_404_NOT_FOUND)
+
+        completion_state = get_completion_state(request)
+        user_today = completion_state.user_today
+
+        try:
+            with transaction.atomic():
+                character = Character.objects.select_for_update().get(user=request.user)
+                request.user.character = character
+                skills = {skill.pk: skill for skill in Skill.objects.select_for_update().filter(pk__in={goal.skill_id for goal in goals.values()})}
+
+                # Read under the character lock: a toggle committed before it would
+                # otherwise lead to a duplicate completion or a delete of a gone row.
+                existing_completions = {}
+                for completion_id, goal_id in GoalCompletion.objects.filter(owner=request.user, goal_id__in=goals.keys()).filter(
+                    Q(goal__goal_type=GoalType.DAILY, completion_date=user_today) | ~Q(goal__goal_type=GoalType.DAILY)
+                ).order_by('id').values_list('id', 'goal_id'):
+                    existing_completions.setdefault(goal_id, []).append(completion_id)
+
+                completions_to_delete = []
+                completions_to_create = {}
+                history = []
+                skill_amounts = {}
+                character_amounts = []
+
+                # Goals are replayed one by one, exactly like separate
+                # toggle_complete calls; only the writes are batched.
+                for goal_id in goal_ids:
+                    goal = goals[goal_id]
+                    skill = skills[goal.skill_id]
+                    is_completed = goal_id in completions_to_create or bool(existing_completions.get(goal_id))
+
+                    if mode == 'complete' and is_completed or mode == 'uncomplete' and not is_completed:
+                        continue
+
+                    if is_completed:
+                        if goal_id in completions_to_create:
+                            del completions_to_create[goal_id]
+                        else:
+                            completions_to_delete.append(existing_completions[goal_id].pop(0))
+                        xp_amount = -goal.xp_reward
+                        action_to_log = GoalHistoryAction.REVERTED
+                    else:
+                        completions_to_create[goal_id] = GoalCompletion(goal=goal, owner=request.user, completion_date=user_today)
+                        xp_amount = goal.xp_reward
+                        action_to_log = GoalHistoryAction.COMPLETED
+
+                    if xp_amount == 0:
+                        continue
+
+                    skill_amounts.setdefault(skill.pk, []).append(xp_amount)
+                    character_amounts.append(xp_amount)
+                    history.append(GoalHistory(
+                        owner=request.user,
+                        goal_description=goal.description,
+                        skill_name=skill.name,
+                        skill_id=skill.id,
+                        xp_amount=abs(goal.xp_reward),
+                        action=action_to_log,
+                        goal_type=goal.goal_type
+                    ))
+
+                if completions_to_delete:
+                    GoalCompletion.objects.filter(pk__in=completions_to_delete).delete()
+                GoalCompletion.objects.bulk_create(completions_to_create.values())
+                for completion in completions_to_create.values():
+                    GOALS_COMPLETED.inc_on_commit(goal_type=completion.goal.goal_type)
+                granted_xp = sum(entry.xp_amount for entry in history if entry.action == GoalHistoryAction.COMPLETED)
+                if granted_xp > 0:
+                    XP_GRANTED.inc_on_commit(granted_xp, source='goal')
+                # Each row gets the whole sequence in one conditional update, see
+                # bulk_progress; the top levels reached feed the achievements.
+                skill_levels = {}
+                for skill_id, amounts in skill_amounts.items():
+                    leveled_up, highest_level, _ = update_xp_row_steps(skills[skill_id], amounts)
+                    if leveled_up:
+                        skill_levels[skill_id] = highest_level
+                character_level = update_xp_row_steps(character, character_amounts)[1] if character_amounts else character.level
+                GoalHistory.objects.bulk_create(history)
+                mark_changed(characters=[character.pk], skills=skills.keys())
+
+                new_rewards = []
+                if history:
+                    leveled_up_skills = [skills[skill_id] for skill_id in skill_levels]
+                    new_rewards = claim_achievements(character, leveled_up_skills, character_level, skill_levels)
+        except XPConflictError:
+            return Response({'error': 'Не удалось начислить опыт, попробуйте еще раз.'}, status=status.HTTP_409_CONFLICT)
+
+        completion_state.invalidate()
+        refresh_version(character)
+        touched_skills = [skills[skill_id] for skill_id in sorted(skills)]
+
+        if wants_delta_response(request):
+            return self.delta_response(skills=touched_skills, goals=[goals[goal_id] for goal_id in sorted(goals)], new_rewards=new_rewards)
+
+        return Response({
+            'skills': SkillSerializer(touched_skills, many=True, context={'request': request}).data,
+            'character': CharacterSerializer(character, context={'request': request}).data,
+            'new_rewards': ReceivedRewardSerializer(new_rewards, many=True).data
+        }, status=status.HTTP_200_OK)
+
+class GoalHistoryViewSet(CharacterETagMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = GoalHistorySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = GoalHistoryPagination
 
     def get_queryset(self):
         queryset = GoalHistory.objects.filter(owner=self.request.user)
@@ -414,14 +734,10 @@ class LootItemViewSet(viewsets.ModelViewSet):
         instance.delete()
         recalculate_loot_chances(self.request.user)
 
-class LootboxAPIView(APIView):
+class LootboxAPIView(CharacterETagMixin, APIView):
     permission_classes = [IsAuthenticated]
 
-    def get(self, request, *args, **kwargs):
-        character = request.user.character
-        tz_str = request.headers.get('X-Timezone', 'UTC')
-        user_today = get_user_current_date(request.user, tz_str)
-
+    def get_status(self, request, character, user_today):
         completed_dailies = GoalCompletion.objects.filter(
             owner=request.user,
             completion_date=user_today,
@@ -429,37 +745,50 @@ class LootboxAPIView(APIView):
         ).count()
         
         can_open = (completed_dailies >= 3 and character.last_lootbox_date != user_today and LootItem.objects.filter(owner=request.user, received_date__isnull=True).exists())
-        return Response({'completed_dailies': completed_dailies,'required_dailies': 3,'can_open': can_open,'is_opened_today': character.last_lootbox_date == user_today})
+        return {'completed_dailies': completed_dailies,'required_dailies': 3,'can_open': can_open,'is_opened_today': character.last_lootbox_date == user_today}
+
+    def get(self, request, *args, **kwargs):
+        user_today = get_completion_state(request).user_today
+        return Response(self.get_status(request, request.user.character, user_today))
 
     def post(self, request, *args, **kwargs):
-        character = request.user.character
-        tz_str = request.headers.get('X-Timezone', 'UTC')
-        user_today = get_user_current_date(request.user, tz_str)
-        
-        status_data = self.get(request).data
-        if not status_data['can_open']:
-            return Response({'error': 'Лутбокс нельзя открыть.'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        available_items = list(LootItem.objects.filter(owner=request.user, received_date__isnull=True))
-        
-        won_item, new_pity_counter = get_weighted_random_award(available_items, character.pity_counter)
-        
-        if won_item:
-            won_item.received_date = timezone.now()
-            won_item.save()
-            
+        user_today = get_completion_state(request).user_today
+
+        with transaction.atomic():
+            # Блокировка строки персонажа сериализует параллельные открытия одного пользователя.
+            character = Character.objects.select_for_update().get(user=request.user)
+            request.user.character = character
+
+            if not self.get_status(request, character, user_today)['can_open']:
+                return Response({'error': 'Лутбокс нельзя открыть.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            available_items = list(LootItem.objects.filter(owner=request.user, received_date__isnull=True))
+            won_item, new_pity_counter = get_weighted_random_award(available_items, character.pity_counter)
+            if not won_item:
+                return Response({'error': 'Нет доступных наград.'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Условное обновление дополнительно защищает от повторного открытия там,
+            # где select_for_update не поддерживается (SQLite).
+            claimed = Character.objects.filter(pk=character.pk).exclude(last_lootbox_date=user_today).update(
+                last_lootbox_date=user_today,
+                pity_counter=new_pity_counter
+            )
+            if not claimed:
+                return Response({'error': 'Лутбокс нельзя открыть.'}, status=status.HTTP_400_BAD_REQUEST)
             character.last_lootbox_date = user_today
             character.pity_counter = new_pity_counter
-            character.save()
+
+            won_item.received_date = timezone.now()
+            won_item.save(update_fields=['received_date'])
             ReceivedReward.objects.create(owner=request.user,description=won_item.name,source_name='Лутбокс',received_date=won_item.received_date,rarity=won_item.rarity)
             recalculate_loot_chances(request.user)
-            
-            return Response({
-                'won_item': LootItemSerializer(won_item).data,
-                'character': CharacterSerializer(character, context={'request': request}).data
-            }, status=status.HTTP_200_OK)
-        
-        return Response({'error': 'Нет доступных наград.'}, status=status.HTTP_404_NOT_FOUND)
+            LOOTBOXES_OPENED.inc_on_commit(rarity=won_item.rarity)
+
+        refresh_version(character)
+        return Response({
+            'won_item': LootItemSerializer(won_item).data,
+            'character': CharacterSerializer(character, context={'request': request}).data
+        }, status=status.HTTP_200_OK)
 
 class NoteViewSet(viewsets.ModelViewSet):
     serializer_class = NoteSerializer
@@ -512,6 +841,7 @@ class AchievementViewSet(viewsets.ModelViewSet):
 class ReceivedRewardViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ReceivedRewardSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ReceivedRewardPagination
     def get_queryset(self):
         return ReceivedReward.objects.filter(owner=self.request.user)
 
@@ -535,6 +865,8 @@ class ImpersonateStartView(APIView):
             return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
         target_refresh = RefreshToken.for_user(target_user)
+        # Signed with the token: the request profiler accepts the session if this user is still staff.
+        target_refresh['impersonator_id'] = request.user.pk
 
         original_admin_refresh = RefreshToken.for_user(request.user)
 
@@ -571,6 +903,52 @@ class ImpersonateStopView(APIView):
         except Exception as e:
             return Response({'error': 'Invalid or expired exit token.', 'detail': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
+class PayloadCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(payload_cache.stats())
+
+class LootboxSimulationView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        try:
+            user = User.objects.select_related('character').get(pk=params.get('user_id', request.user.pk))
+            sessions = int(params.get('sessions', MAX_SIMULATION_SESSIONS))
+            opens = int(params.get('opens', 30))
+            start_pity = int(params['pity']) if 'pity' in params else getattr(getattr(user, 'character', None), 'pity_counter', 0)
+            seed = int(params['seed']) if 'seed' in params else None
+        except User.DoesNotExist:
+            return Response({'error': 'Пользователь не найден.'}, status=status.HTTP_404_NOT_FOUND)
+        except (ValueError, TypeError):
+            return Response({'error': 'Некорректные параметры симуляции.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not (0 < sessions <= MAX_SIMULATION_SESSIONS and 0 < opens <= MAX_SIMULATION_OPENS and 0 <= start_pity <= MAX_SIMULATION_PITY):
+            return Response({'error': f'sessions: 1..{MAX_SIMULATION_SESSIONS}, opens: 1..{MAX_SIMULATION_OPENS}, pity: 0..{MAX_SIMULATION_PITY}. Для больших прогонов используйте manage.py simulate_lootbox.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = list(LootItem.objects.filter(owner=user, received_date__isnull=True).order_by('id'))
+        if not items:
+            return Response({'error': 'У пользователя нет доступных предметов.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(simulate_lootbox(items, sessions, opens, start_pity=start_pity, seed=seed))
+
+class ProfileListView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(list_profiles())
+
+class ProfileDownloadView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id, kind, *args, **kwargs):
+        path = get_profile_path(profile_id, kind)
+        if path is None:
+            return Response({'error': 'Профиль не найден.'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name, content_type=PROFILE_FILES[kind])
+
 @method_decorator(ensure_csrf_cookie, name='dispatch')
 class GetCSRFToken(APIView):
     permission_classes = [permissions.AllowAny]
@@ -579,6 +957,16 @@ class GetCSRFToken(APIView):
     def get(self, request, *args, **kwargs):
         return Response({'success': 'CSRF cookie set'})
 
+class MetricsView(View):
+    skip_metrics = True
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            return HttpResponse(status=404)
+        if not settings.METRICS_TOKEN or request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+            return HttpResponse(status=403)
+        return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 class ReactAppView(View):
     def get(self, request):
         try:
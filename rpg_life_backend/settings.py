@@ -40,11 +40,17 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.slow_queries.SlowQueryMiddleware',
+    'api.tracing.TracingMiddleware',
+    'api.instrumentation.RequestTimingMiddleware',
+    'api.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.profiling.RequestProfilerMiddleware',
+    'api.versioning.VersionBumpMiddleware',
     'impersonate.middleware.ImpersonateMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -63,6 +69,8 @@ if DEBUG:
 
 CORS_ALLOW_CREDENTIALS = True
 
+CORS_EXPOSE_HEADERS = ['ETag', 'X-Profile-Id']
+
 CSRF_TRUSTED_ORIGINS = [
     "https://vladboyr.com",
     "https://www.vladboyr.com",
@@ -120,6 +128,86 @@ else:
         }
     }
 
+# Cache
+# Rendered character/skill payloads are cached under versioned keys (see api/cache.py).
+
+PAYLOAD_CACHE_ALIAS = 'payloads'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    PAYLOAD_CACHE_ALIAS: {
+        'BACKEND': os.environ.get('PAYLOAD_CACHE_BACKEND', 'api.cache.BoundedLocMemCache'),
+        'LOCATION': os.environ.get('PAYLOAD_CACHE_LOCATION', 'rpg-life-payloads'),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('PAYLOAD_CACHE_MAX_ENTRIES', 5000)),
+            'MAX_BYTES': int(os.environ.get('PAYLOAD_CACHE_MAX_MB', 64)) * 1024 * 1024,
+        },
+    },
+}
+
+if is_testing:
+    CACHES[PAYLOAD_CACHE_ALIAS] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+# Request timing
+# Server-Timing headers and over-budget log lines (see api/instrumentation.py).
+
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', 'False') == 'True'
+REQUEST_TIMING_QUERY_BUDGET = int(os.environ.get('REQUEST_TIMING_QUERY_BUDGET', 30))
+REQUEST_TIMING_LATENCY_BUDGET_MS = int(os.environ.get('REQUEST_TIMING_LATENCY_BUDGET_MS', 500))
+
+# Metrics
+# Per-process samples are summed from METRICS_DIR at /metrics (see api/metrics.py).
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True' and not is_testing
+METRICS_DIR = os.environ.get('METRICS_DIR', str(BASE_DIR / 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+# Required: /metrics answers 403 until a token is configured.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Slow-query log
+# Queries over the threshold and their plans go to a rotating JSONL file (see api/slow_queries.py).
+
+SLOW_QUERY_ENABLED = os.environ.get('SLOW_QUERY_ENABLED', 'False') == 'True'
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+SLOW_QUERY_EXPLAIN_ANALYZE = os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE', 'False') == 'True'
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', str(BASE_DIR / 'logs' / 'slow_queries.jsonl'))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get('SLOW_QUERY_LOG_MAX_MB', 10)) * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
+
+# Tracing
+# Sampled requests are written as OTLP/JSON span trees to a rotating file (see api/tracing.py).
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'False') == 'True'
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', 0.01))
+# Honour the sampled flag of incoming traceparent headers (only behind a trusted proxy).
+TRACING_TRUST_TRACEPARENT = os.environ.get('TRACING_TRUST_TRACEPARENT', 'False') == 'True'
+TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'rpg-life-backend')
+TRACING_LOG = os.environ.get('TRACING_LOG', str(BASE_DIR / 'logs' / 'traces.jsonl'))
+TRACING_LOG_MAX_BYTES = int(os.environ.get('TRACING_LOG_MAX_MB', 20)) * 1024 * 1024
+TRACING_LOG_BACKUPS = int(os.environ.get('TRACING_LOG_BACKUPS', 5))
+
+# Request profiler
+# Staff requests with `X-Profile: 1` are profiled (see api/profiling.py).
+
+REQUEST_PROFILER_ENABLED = os.environ.get('REQUEST_PROFILER_ENABLED', 'False') == 'True'
+REQUEST_PROFILER_DIR = os.environ.get('REQUEST_PROFILER_DIR', str(BASE_DIR / 'profiles'))
+REQUEST_PROFILER_MAX_PROFILES = int(os.environ.get('REQUEST_PROFILER_MAX_PROFILES', 20))
+REQUEST_PROFILER_SAMPLE_INTERVAL = float(os.environ.get('REQUEST_PROFILER_SAMPLE_INTERVAL', 0.001))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.environ.get('API_LOG_LEVEL', 'INFO')},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,6 +1,6 @@
 ﻿from django.contrib import admin
 from django.urls import path, include, re_path
-from api.views import ReactAppView
+from api.views import MetricsView, ReactAppView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -12,5 +12,6 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/', include('api.urls')),
     path('impersonate/', include('impersonate.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     re_path(r'^(?!api/|admin/).*$', ReactAppView.as_view(), name='react-app'),
 ]